@@ -1,9 +1,12 @@
 # app.py
 import os
+import json
+import asyncio
 import logging
 import base64
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Form, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # This code reads the secret key from the "Repository secrets"
@@ -18,7 +21,12 @@ if credentials_json_str:
 else:
     logging.error("CRITICAL: GOOGLECREDENTIALSJSON secret not found.")
 
-from backend import rag, stt, tts, translation, safety
+from backend import (
+    rag, stt, tts, translation, safety, workers, pipeline, clients, audio, admission, singleflight, metrics, sessions, cache,
+)
+from backend.streaming import (
+    sse_event, json_frame, audio_frame, accepts, multipart, FRAMES_MEDIA_TYPE, MULTIPART_MEDIA_TYPE,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -30,22 +38,117 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Chat-Response"],
+    expose_headers=["X-Chat-Response", "Retry-After", "Server-Timing"],
 )
+# Per-stage timings for every response, and end-to-end latency for /metrics
+app.add_middleware(metrics.ServerTimingMiddleware)
+
+# Build clients and open their channels at startup, before /ready says so
+CLIENT_WARMUP = os.environ.get("CLIENT_WARMUP", "1") != "0"
+
+@app.on_event("startup")
+async def warm_up_clients():
+    if CLIENT_WARMUP:
+        # in the background, so the server starts accepting connections now
+        app.state.warmup = asyncio.ensure_future(clients.warm_up())
+    else:
+        clients.mark_ready()
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    workers.shutdown()
 
 @app.get("/")
 def home():
     return {"message": "Mental Health Backend running"}
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the startup warm-up has finished."""
+    status = clients.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats")
+def stats():
+    """Cache and upstream call counters, for checking savings in production."""
+    return {
+        "translation": translation.stats(),
+        "tts_cache": tts.cache_stats(),
+        "retrieval_cache": rag.retrieval_cache_stats(),
+        "response_cache": rag.response_cache_stats(),
+        "admission": admission.stats(),
+        "coalescing": singleflight.stats(),
+        "sessions": sessions.stats(),
+        "shared_cache": cache.shared_cache().stats() if cache.shared_cache() else None,
+        "worker": os.getpid(),
+    }
+
+metrics.register_stats("admission", admission.stats, label="upstream")
+metrics.register_stats("coalescing", singleflight.stats, label="group")
+metrics.register_stats("tts_cache", tts.cache_stats)
+metrics.register_stats("retrieval_cache", rag.retrieval_cache_stats)
+metrics.register_stats("response_cache", rag.response_cache_stats)
+metrics.register_stats("sessions", sessions.stats)
+if cache.shared_cache():
+    metrics.register_stats("shared_cache", cache.shared_cache().stats)
+metrics.register_stats("translation_cache", lambda: {
+    "detect": translation.stats()["detect_cache"],
+    "translate": translation.stats()["translate_cache"],
+}, label="cache")
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Latency histograms, error counters, payload sizes and the /stats counters, for Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profile")
+def profile(span: str = "analyze_risk", limit: int = 30):
+    """cProfile report of a span sampled through METRICS_PROFILE."""
+    report = metrics.profile_report(span, limit)
+    if report is None:
+        return JSONResponse({"error": f"no profile for '{span}' (set METRICS_PROFILE)"}, status_code=404)
+    return PlainTextResponse(report)
+
+def _too_many_requests(e: admission.Rejected) -> JSONResponse:
+    retry_after = int(e.retry_after)
+    return JSONResponse(
+        {"error": "Server busy, please retry shortly.", "retry_after": retry_after},
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def _bad_session(session_id: Optional[str]) -> Optional[JSONResponse]:
+    if session_id is None or sessions.valid_id(session_id):
+        return None
+    return JSONResponse({"error": "session_id must be 1-128 letters, digits, '-' or '_'."}, status_code=400)
+
+@app.delete("/sessions/{session_id}")
+def end_session(session_id: str):
+    """Forgets a conversation (the user started over or left)."""
+    sessions.store.end(session_id)
+    return Response(status_code=204)
+
+# Upstreams each kind of request calls, whose queues decide whether it is admitted
+TEXT_UPSTREAMS = ("translate", "rag", "gemini")
+VOICE_UPSTREAMS = TEXT_UPSTREAMS + ("tts",)
+
+def _text_priority(query: str) -> int:
+    # A quick English-only look at the message; the pipeline's own risk
+    # stages escalate the turn later if the full analysis finds it high risk
+    risk, _ = safety.classify_risk(safety.normalize_text(query))
+    return admission.CRITICAL if risk == "high" else admission.NORMAL
+
 # --- TEXT-TO-SPEECH ENDPOINT ---
 @app.post("/tts")
-async def text_to_speech(text: str = Form(...)):
+async def text_to_speech(text: str = Form(...), accept: Optional[str] = Header(None)):
     """
     A dedicated endpoint to convert a string of text into speech audio.
-    It automatically detects the language of the text.
+    It automatically detects the language of the text. The audio type
+    follows Accept (see tts.negotiate_format); MP3 by default.
     """
     try:
-        detected_lang = translation.detect_language(text)
+        admission.begin_request(admission.NORMAL, upstreams=("translate", "tts"))
+        detected_lang = await translation.detect_language_async(text)
         detected_lang = translation.normalize_lang_code(detected_lang)
         
         tts_lang = f"{detected_lang}-IN" if detected_lang != "en" else "en-IN"
@@ -53,96 +156,376 @@ async def text_to_speech(text: str = Form(...)):
 
         # --- THE FIX ---
         # The parameter name in tts.py is 'text', so we use that here.
-        audio_content = tts.synthesize_text(text=text, language_code=tts_lang)
+        # Audio is the whole point here, so it queues instead of being shed
+        audio_format = tts.negotiate_format(accept)
+        with metrics.span("tts"):
+            audio_content = await tts.synthesize_audio_async(
+                text=text, language_code=tts_lang, optional=False, audio_format=audio_format
+            )
         # --- END OF FIX ---
 
         if not audio_content:
             return JSONResponse({"error": "Failed to generate audio."}, status_code=500)
 
-        return StreamingResponse(iter([audio_content]), media_type="audio/mpeg")
+        return StreamingResponse(iter([audio_content]), media_type=audio_format.media_type)
 
+    except admission.Rejected as e:
+        return _too_many_requests(e)
     except Exception as e:
         logging.error(f"[tts_endpoint] error: {e}", exc_info=True)
         return JSONResponse({"error": "Internal server error during TTS."}, status_code=500)
 
 @app.post("/chat_text")
-async def chat_text(query: str = Form(...), user_lang: str = Form("auto")):
+async def chat_text(query: str = Form(...), user_lang: str = Form("auto"), session_id: Optional[str] = Form(None)):
+    """
+    Answers a message. With a session_id the server remembers the
+    conversation (see backend/sessions.py), so send only the new message.
+    """
+    error = _bad_session(session_id)
+    if error is not None:
+        return error
     try:
-        detected = translation.detect_language(query) if user_lang == "auto" else user_lang
-        detected = translation.normalize_lang_code(detected)
-        english_query = translation.translate_to(query, "en") if detected != "en" else query
-        rag_out = rag.query_with_safety(english_query, top_k=3)
-        context = rag_out.get("context", "")
-        generated = rag.generate_response_with_llm(english_query, context)
-        response_text = generated
-        if detected != "en":
-            try:
-                response_text = translation.translate_from(generated, "en", detected)
-            except Exception as e:
-                response_text = generated
-        if rag_out.get("risk", {}).get("risk") == "high":
-            helplines = rag_out.get("helpline_results", [])
-            lines = [f"{h['name']}: {h['number']}" for h in helplines if h.get("number")]
-            if lines:
-                response_text += "\n\n⚠️ Helplines:\n" + "\n".join(lines)
-        return JSONResponse({"query": query, "response": response_text})
+        admission.begin_request(_text_priority(query), upstreams=TEXT_UPSTREAMS)
+        turn = await pipeline.run_chat_turn(query, user_lang, top_k=3, session_id=session_id)
+        body = {"query": query, "response": turn["response"]}
+        if admission.degraded():
+            body["degraded"] = admission.degraded()
+        return JSONResponse(body)
+    except admission.Rejected as e:
+        return _too_many_requests(e)
     except Exception as e:
         logging.error(f"[chat_text] error: {e}")
         return JSONResponse({"error": "Internal server error"}, status_code=500)
 
 
-@app.post("/chat_voice")
-async def chat_voice(file: UploadFile = File(...), language_code: str = Form("auto")):
+@app.post("/chat_text_stream")
+async def chat_text_stream(query: str = Form(...), user_lang: str = Form("auto"), session_id: Optional[str] = Form(None)):
+    """
+    Same as /chat_text, but the reply streams back as Server-Sent Events:
+    meta, delta (text pieces), helplines (high risk only), done, or error.
+    """
+    error = _bad_session(session_id)
+    if error is not None:
+        return error
+    try:
+        admission.begin_request(_text_priority(query), upstreams=TEXT_UPSTREAMS)
+    except admission.Rejected as e:
+        return _too_many_requests(e)
+
+    async def events():
+        try:
+            async for event, data in pipeline.stream_chat_turn(query, user_lang, top_k=3, session_id=session_id):
+                yield sse_event(event, data)
+        except Exception as e:
+            logging.error(f"[chat_text_stream] error: {e}")
+            yield sse_event("error", {"error": "Internal server error"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _stt_language(language_code: str) -> str:
+    if language_code == "auto":
+        return "en-IN"
+    detected = translation.normalize_lang_code(language_code)
+    return f"{detected}-{detected.upper()}" if len(detected) == 2 else detected
+
+
+def _ws_object(text: str) -> Optional[dict]:
+    """A WebSocket text message as a JSON object, or None if it isn't one."""
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+async def _transcribe_upload(file: UploadFile, language_code: str):
+    """Returns (transcript, None), or (None, error response)."""
+    # The format comes from the bytes, not the file name; bad uploads are
+    # rejected here, before anything is sent to Speech-to-Text
     try:
-        filename = file.filename or "unknown_file"
-        audio_bytes = await file.read()
-        if not audio_bytes:
-            return JSONResponse({"error": "Received an empty audio file."}, status_code=400)
-        file_extension = os.path.splitext(filename)[1].lower()
-        audio_encoding = None
-        sample_rate_hertz = None
-        if file_extension == ".webm":
-            audio_encoding = "OGG_OPUS"
-            sample_rate_hertz = 48000
-        stt_lang = "en-IN"
-        if language_code != "auto":
-            detected = translation.normalize_lang_code(language_code)
-            stt_lang = f"{detected}-{detected.upper()}" if len(detected) == 2 else detected
-        transcript = stt.speech_to_text_bytes(
-            audio_bytes,
-            language_code=stt_lang,
-            encoding=audio_encoding,
-            sample_rate_hertz=sample_rate_hertz
+        with metrics.span("decode"):
+            prepared = await workers.run_blocking(audio.prepare, file.file)
+    except audio.UnsupportedAudio as e:
+        return None, JSONResponse({"error": str(e)}, status_code=400)
+    with metrics.span("stt"):
+        transcript = await stt.speech_to_text_segments_async(
+            prepared.segments,
+            language_code=_stt_language(language_code),
+            encoding=prepared.encoding,
+            sample_rate_hertz=prepared.sample_rate_hertz,
+            audio_channel_count=prepared.channels,
         )
-        if not transcript:
-            return JSONResponse({"error": "Could not transcribe audio. Check encoding/format."}, status_code=400)
-        detected_lang = translation.detect_language(transcript) if language_code == "auto" else translation.normalize_lang_code(language_code)
-        english_query = translation.translate_to(transcript, "en") if detected_lang != "en" else transcript
-        rag_out = rag.query_with_safety(english_query, top_k=3)
-        context = rag_out.get("context", "")
-        generated = rag.generate_response_with_llm(english_query, context)
-        response_text = generated
-        if detected_lang != "en":
-            try:
-                response_text = translation.translate_from(generated, "en", detected_lang)
-            except Exception:
-                response_text = generated
-        if rag_out.get("risk", {}).get("risk") == "high":
-            helplines = rag_out.get("helpline_results", [])
-            lines = [f"{h['name']}: {h['number']}" for h in helplines if h.get("number")]
-            if lines:
-                response_text += "\n\n⚠️ Helplines:\n" + "\n".join(lines)
-        tts_lang = f"{detected_lang}-IN" if detected_lang != "en" else "en-IN"
+    if not transcript:
+        return None, JSONResponse({"error": "Could not transcribe audio. Check encoding/format."}, status_code=400)
+    return transcript, None
+
+
+def _voice_reply(accept: Optional[str], transcript: str, response_text: str, audio_content, audio_format) -> Response:
+    """
+    Text and audio of a voice reply in one body, in the container Accept
+    names: frames (see backend/streaming.py) or multipart/mixed. Older
+    clients get the audio as the body and the text base64-encoded in the
+    X-Chat-Response header.
+    """
+    reply = {"query": transcript, "response": response_text, "media_type": audio_format.media_type}
+    if accepts(accept, FRAMES_MEDIA_TYPE):
+        header, payload = audio_frame(audio_content)
+        body, media_type = json_frame("reply", reply) + header + bytes(payload), FRAMES_MEDIA_TYPE
+        headers = {}
+    elif accepts(accept, MULTIPART_MEDIA_TYPE):
+        body, media_type = multipart([
+            ("application/json; charset=utf-8", json.dumps(reply, ensure_ascii=False).encode("utf-8")),
+            (audio_format.media_type, audio_content),
+        ])
+        headers = {}
+    else:
+        body, media_type = audio_content, audio_format.media_type
+        headers = {"X-Chat-Response": base64.b64encode(response_text.encode("utf-8")).decode("utf-8")}
+    metrics.observe_payload("voice_reply", len(body) + sum(len(v) for v in headers.values()))
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.post("/chat_voice")
+async def chat_voice(
+    file: UploadFile = File(...), language_code: str = Form("auto"), accept: Optional[str] = Header(None),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Answers a recorded question with speech. The reply's text and audio
+    come back in one body when Accept names application/x-chat-frames or
+    multipart/mixed (see _voice_reply); the audio type follows Accept too,
+    e.g. "multipart/mixed, audio/ogg; codecs=opus; rate=16000".
+    session_id works as in /chat_text.
+    """
+    error = _bad_session(session_id)
+    if error is not None:
+        return error
+    try:
+        # nothing tells a crisis apart before transcription: it is never refused
+        admission.begin_request(admission.CRITICAL)
+        transcript, error = await _transcribe_upload(file, language_code)
+        if error is not None:
+            return error
+        admission.reclassify(_text_priority(transcript), VOICE_UPSTREAMS)
+        turn = await pipeline.run_chat_turn(transcript, language_code, top_k=3, session_id=session_id)
+        detected_lang = turn["lang"]
+        response_text = turn["response"]
+        tts_lang = pipeline.tts_language(detected_lang)
         
         # This also needs to use the correct 'text' parameter
-        audio_content = tts.synthesize_text(text=response_text, language_code=tts_lang)
-        encoded_text = base64.b64encode(response_text.encode('utf-8')).decode('utf-8')
-        return Response(
-            content=audio_content,
-            media_type="audio/mpeg",
-            headers={"X-Chat-Response": encoded_text}
-        )
+        audio_format = tts.negotiate_format(accept)
+        with metrics.span("tts"):
+            audio_content = await tts.synthesize_audio_async(
+                text=response_text, language_code=tts_lang, audio_format=audio_format
+            )
+        if not audio_content:
+            # TTS failed or was shed under load: the reply still goes out, as text
+            return JSONResponse({
+                "query": transcript,
+                "response": response_text,
+                "degraded": admission.degraded() or ["tts"],
+            })
+        return _voice_reply(accept, transcript, response_text, audio_content, audio_format)
+    except admission.Rejected as e:
+        return _too_many_requests(e)
     except Exception as e:
         logging.error(f"[chat_voice] error: {e}", exc_info=True)
         return JSONResponse({"error": "Internal server error"}, status_code=500)
 
+
+@app.post("/chat_voice_stream")
+async def chat_voice_stream(
+    file: UploadFile = File(...), language_code: str = Form("auto"), accept: Optional[str] = Header(None),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Pipelined /chat_voice: the reply is synthesized sentence by sentence and
+    streamed back as frames (see backend/streaming.py) — JSON events
+    (meta with the transcript and media_type, text, done, error)
+    interleaved with audio frames in playback order. Audio for the first
+    sentence is sent while the rest of the reply is still being generated.
+    The audio type follows Accept, and session_id works, as for /chat_voice.
+    """
+    audio_format = tts.negotiate_format(accept)
+    error = _bad_session(session_id)
+    if error is not None:
+        return error
+    try:
+        admission.begin_request(admission.CRITICAL)
+        transcript, error = await _transcribe_upload(file, language_code)
+        if error is None:
+            admission.reclassify(_text_priority(transcript), VOICE_UPSTREAMS)
+    except admission.Rejected as e:
+        return _too_many_requests(e)
+    except Exception as e:
+        logging.error(f"[chat_voice_stream] error: {e}", exc_info=True)
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+    if error is not None:
+        return error
+
+    async def frames():
+        try:
+            async for event, data in pipeline.stream_voice_turn(
+                transcript, language_code, top_k=3, audio_format=audio_format, session_id=session_id
+            ):
+                if event == "audio":
+                    for part in audio_frame(data["audio"]):
+                        yield part
+                elif event == "meta":
+                    yield json_frame(event, {**data, "transcript": transcript})
+                else:
+                    yield json_frame(event, data)
+        except Exception as e:
+            logging.error(f"[chat_voice_stream] error: {e}")
+            yield json_frame("error", {"error": "Internal server error"})
+
+    return StreamingResponse(
+        frames(),
+        media_type=FRAMES_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/chat_voice")
+async def chat_voice_ws(websocket: WebSocket):
+    """
+    Voice chat over a WebSocket, recognized while the user speaks.
+    Client -> server:
+      - optional first text message with settings, e.g.
+        {"language_code": "auto", "encoding": "WEBM_OPUS", "sample_rate_hertz": 48000,
+         "output_encoding": "OGG_OPUS", "output_sample_rate_hertz": 16000,
+         "session_id": "..."}
+        (without "encoding" it is read from the first audio message; the
+        reply's audio is MP3 without "output_encoding"; session_id works
+        as in /chat_text)
+      - binary messages with audio as it is recorded
+      - {"event": "end"} (or closing the socket) when the user stops
+    Server -> client: JSON {"event": "interim"/"transcript", "text"} while
+    recognizing, then the reply as in /chat_voice_stream: JSON meta, text
+    and done events, with each sentence's audio as a binary message.
+    """
+    await websocket.accept()
+    try:
+        # no deadline while the user is still talking; it starts with the
+        # reply. Critical until transcribed, as for /chat_voice
+        admission.begin_request(admission.CRITICAL, budget=None)
+    except admission.Rejected as e:
+        await websocket.send_json({"event": "error", "error": "Server busy, please retry shortly.",
+                                   "retry_after": int(e.retry_after)})
+        await websocket.close()
+        return
+    settings = {}
+    first = await websocket.receive()
+    if first.get("type") == "websocket.disconnect":
+        return
+    if first.get("text"):
+        settings = _ws_object(first["text"])
+        if settings is None:
+            await websocket.send_json({"event": "error", "error": "Settings must be a JSON object."})
+            await websocket.close()
+            return
+        first = None
+    language_code = settings.get("language_code", "auto")
+    encoding = settings.get("encoding")
+    sample_rate_hertz = settings.get("sample_rate_hertz")
+    try:
+        audio_format = tts.AudioFormat(
+            settings.get("output_encoding", tts.DEFAULT_FORMAT.encoding),
+            settings.get("output_sample_rate_hertz", tts.DEFAULT_FORMAT.sample_rate_hertz),
+        )
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "error": str(e)})
+        await websocket.close()
+        return
+    session_id = settings.get("session_id")
+    if session_id is not None and not sessions.valid_id(session_id):
+        await websocket.send_json({"event": "error", "error": "Invalid session_id."})
+        await websocket.close()
+        return
+    if encoding is None:
+        # No format given: read it from the first chunk's headers
+        if first is None:
+            first = await websocket.receive()
+        try:
+            info = audio.sniff(first.get("bytes") or b"")
+        except audio.UnsupportedAudio as e:
+            await websocket.send_json({"event": "error", "error": str(e)})
+            await websocket.close()
+            return
+        encoding = audio.streaming_encoding(info)
+        sample_rate_hertz = sample_rate_hertz or info.sample_rate
+
+    malformed = False
+
+    async def audio_chunks():
+        nonlocal malformed
+        message = first
+        while True:
+            if message is None:
+                message = await websocket.receive()
+            if message.get("type") == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                yield message["bytes"]
+            elif message.get("text"):
+                control = _ws_object(message["text"])
+                if control is None:
+                    # ends the audio; reported once recognition has stopped
+                    malformed = True
+                    return
+                if control.get("event") == "end":
+                    return
+            message = None
+
+    try:
+        transcript = ""
+        async for kind, text in stt.stream_speech_to_text(
+            audio_chunks(),
+            language_code=_stt_language(language_code),
+            sample_rate_hertz=sample_rate_hertz or 48000,
+            encoding=encoding,
+            single_utterance=bool(settings.get("single_utterance", False)),
+        ):
+            if kind == "interim":
+                await websocket.send_json({"event": "interim", "text": text})
+            else:
+                transcript = text
+        if malformed:
+            await websocket.send_json({"event": "error", "error": "Messages must be audio or a JSON object."})
+            await websocket.close()
+            return
+        if not transcript:
+            await websocket.send_json({"event": "error", "error": "Could not transcribe audio."})
+            await websocket.close()
+            return
+        await websocket.send_json({"event": "transcript", "text": transcript})
+        admission.restart_deadline()
+        admission.reclassify(_text_priority(transcript), VOICE_UPSTREAMS)
+
+        # safety analysis and retrieval start as soon as the turn does
+        async for event, data in pipeline.stream_voice_turn(
+            transcript, language_code, top_k=3, audio_format=audio_format, session_id=session_id
+        ):
+            if event == "audio":
+                await websocket.send_bytes(bytes(data["audio"]))
+            else:
+                await websocket.send_json({"event": event, **data})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except admission.Rejected as e:
+        await websocket.send_json({"event": "error", "error": "Server busy, please retry shortly.",
+                                   "retry_after": int(e.retry_after)})
+        await websocket.close()
+    except Exception as e:
+        logging.error(f"[chat_voice_ws] error: {e}", exc_info=True)
+        try:
+            await websocket.send_json({"event": "error", "error": "Internal server error"})
+            await websocket.close()
+        except Exception:
+            pass
@@ -0,0 +1,315 @@
+# backend/admission.py
+"""
+Admission control in front of the upstream APIs (Speech-to-Text,
+Translate, Vertex RAG, Gemini, Text-to-Speech):
+  - each upstream has a concurrency limit; calls beyond it wait in a
+    priority queue, where turns flagged high risk go first,
+  - every request carries a deadline; a call still queued when it passes
+    gives up instead of adding to the backlog,
+  - optional work (TTS, retrieval) is shed as soon as its upstream is
+    saturated, and the callers fall back (text without audio, an answer
+    without retrieved context, the precomputed crisis reply),
+  - when the queue of an upstream a request needs is full, the request is
+    refused unless it is high risk, and the endpoint answers 429 with
+    Retry-After.
+
+Each endpoint starts a request with begin_request(); pipeline stages and
+upstream calls made for it see the same RequestContext (asyncio tasks copy
+the context they are created in), so raising its priority mid-turn
+applies to every call that hasn't been admitted yet, including calls
+already waiting in a queue.
+"""
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+
+from backend import metrics
+
+CRITICAL, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {CRITICAL: "critical", NORMAL: "normal", LOW: "low"}
+
+REQUEST_DEADLINE = float(os.environ.get("ADMISSION_REQUEST_DEADLINE", "60"))
+# Default concurrency per upstream; ADMISSION_<NAME>_CONCURRENCY overrides.
+# Live recognition (stt_stream) holds its slot for as long as the user
+# talks, so it has its own pool rather than starving uploads' "stt"
+DEFAULT_CONCURRENCY = {"stt": 16, "stt_stream": 32, "translate": 32, "rag": 16, "gemini": 16, "tts": 16}
+# Waiting calls allowed per upstream, as a multiple of its concurrency
+QUEUE_FACTOR = float(os.environ.get("ADMISSION_QUEUE_FACTOR", "4"))
+# Weight of the latest call in the service-time average used for Retry-After
+EWMA_ALPHA = 0.2
+
+class Rejected(Exception):
+    """An upstream call was not admitted; retry_after is a hint in seconds."""
+    def __init__(self, upstream: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Overloaded(Rejected):
+    """The upstream's queue is full."""
+
+class DeadlineExceeded(Rejected):
+    """The request's deadline passed while the call was waiting."""
+
+class Shed(Rejected):
+    """Optional work skipped because the upstream is saturated."""
+
+# -------------------------
+# Request context
+# -------------------------
+class RequestContext:
+    __slots__ = ("priority", "deadline", "degraded", "waiting")
+
+    def __init__(self, priority: int = NORMAL, deadline: Optional[float] = None):
+        self.priority = priority
+        self.deadline = deadline
+        # upstreams whose work was skipped for this request
+        self.degraded: List[str] = []
+        # (upstream, heap entry) of this request's calls still queued
+        self.waiting: list = []
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def set_priority(self, priority: int):
+        """Sets the priority, moving this request's queued calls along with it."""
+        self.priority = priority
+        for upstream, entry in self.waiting:
+            upstream.reprioritize(entry, priority)
+
+    def join(self, other: "RequestContext"):
+        """Serves other too (a coalesced call): its priority if higher, its deadline if later."""
+        if other.priority < self.priority:
+            self.set_priority(other.priority)
+        if self.deadline is not None:
+            self.deadline = None if other.deadline is None else max(self.deadline, other.deadline)
+
+    def degrade(self, upstreams: List[str]):
+        for name in upstreams:
+            if name not in self.degraded:
+                self.degraded.append(name)
+
+_request: contextvars.ContextVar = contextvars.ContextVar("admission_request", default=None)
+
+def _check_queues(priority: int, upstreams: Optional[Iterable[str]]):
+    if priority == CRITICAL:
+        return
+    for upstream in (_upstreams[name] for name in upstreams) if upstreams is not None else _upstreams.values():
+        if upstream.queue_full():
+            upstream.rejected += 1
+            raise Overloaded(upstream.name, "queue full", upstream.retry_after())
+
+def begin_request(
+    priority: int = NORMAL, budget: Optional[float] = REQUEST_DEADLINE, upstreams: Optional[Iterable[str]] = None
+) -> RequestContext:
+    """
+    Starts a request in the current context. Refuses it (Overloaded) when
+    the queue of one of the upstreams it will call (all by default) is
+    full, unless it is critical.
+    """
+    ctx = RequestContext(priority, time.monotonic() + budget if budget else None)
+    _request.set(ctx)
+    _check_queues(priority, upstreams)
+    return ctx
+
+def reclassify(priority: int, upstreams: Optional[Iterable[str]] = None):
+    """
+    Sets the current request's priority once more is known about it (e.g. a
+    voice turn, once transcribed), refusing it as begin_request would.
+    """
+    ctx = _request.get()
+    if ctx is not None:
+        ctx.set_priority(priority)
+    _check_queues(priority, upstreams)
+
+def current() -> Optional[RequestContext]:
+    return _request.get()
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current request's deadline (None without one)."""
+    ctx = _request.get()
+    return ctx.remaining() if ctx is not None else None
+
+def restart_deadline(budget: Optional[float] = REQUEST_DEADLINE):
+    """Starts the current request's deadline over (e.g. once a live recording has ended)."""
+    ctx = _request.get()
+    if ctx is not None:
+        ctx.deadline = time.monotonic() + budget if budget else None
+
+def escalate(priority: int = CRITICAL):
+    """Raises the current request's priority (e.g. once a turn is found high risk)."""
+    ctx = _request.get()
+    if ctx is not None and priority < ctx.priority:
+        ctx.set_priority(priority)
+
+def degraded() -> List[str]:
+    ctx = _request.get()
+    return list(ctx.degraded) if ctx is not None else []
+
+# -------------------------
+# Per-upstream limiter
+# -------------------------
+class Upstream:
+    def __init__(self, name: str, concurrency: int, queue_limit: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.queued = 0
+        # heap of [priority, sequence, future]; a future that is already done
+        # belongs to a caller that gave up
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.admitted_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_seconds = 0.0
+        self.service_ewma = 0.0
+
+    def saturated(self) -> bool:
+        return self.in_flight >= self.concurrency or self.queued > 0
+
+    def queue_full(self) -> bool:
+        return self.queued >= self.queue_limit
+
+    def retry_after(self) -> float:
+        """Rough time for the current queue to drain, at least a second."""
+        service = self.service_ewma or 1.0
+        return max(1.0, math.ceil((self.queued + 1) / self.concurrency * service))
+
+    async def acquire(
+        self, priority: int, deadline: Optional[float], optional: bool, ctx: Optional[RequestContext] = None
+    ):
+        if self.in_flight < self.concurrency and not self.queued:
+            self.in_flight += 1
+            self._admit(priority, 0.0)
+            return
+        if optional:
+            self.shed += 1
+            raise Shed(self.name, "saturated", self.retry_after())
+        if priority != CRITICAL and self.queue_full():
+            self.rejected += 1
+            raise Overloaded(self.name, "queue full", self.retry_after())
+        timeout = None if deadline is None else deadline - time.monotonic()
+        if timeout is not None and timeout <= 0:
+            self.timeouts += 1
+            raise DeadlineExceeded(self.name, "deadline passed", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future]
+        heapq.heappush(self._waiters, entry)
+        self.queued += 1
+        if ctx is not None:
+            # so that escalating the request moves this call up the queue
+            ctx.waiting.append((self, entry))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._leave_queue(future)
+            self.timeouts += 1
+            raise DeadlineExceeded(self.name, "deadline passed while queued", self.retry_after())
+        except asyncio.CancelledError:
+            self._leave_queue(future)
+            raise
+        finally:
+            if ctx is not None:
+                ctx.waiting.remove((self, entry))
+        self._admit(entry[0], time.monotonic() - started)
+
+    def reprioritize(self, entry: list, priority: int):
+        if entry[0] != priority and not entry[2].done():
+            entry[0] = priority
+            heapq.heapify(self._waiters)
+
+    def _leave_queue(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # the slot was handed over just as the caller gave up; pass it on
+            self.release()
+        else:
+            future.cancel()
+            self.queued -= 1
+
+    def _admit(self, priority: int, waited: float):
+        self.admitted += 1
+        self.admitted_by_priority[PRIORITY_NAMES[priority]] += 1
+        self.wait_seconds += waited
+
+    def release(self, service_seconds: Optional[float] = None):
+        if service_seconds is not None:
+            self.service_ewma += EWMA_ALPHA * (service_seconds - self.service_ewma)
+        # hand the slot straight to the best waiter that is still waiting
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queue_limit": self.queue_limit,
+            "admitted": self.admitted,
+            "admitted_by_priority": dict(self.admitted_by_priority),
+            "shed": self.shed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(1000 * self.wait_seconds / self.admitted, 2) if self.admitted else 0.0,
+            "avg_service_ms": round(1000 * self.service_ewma, 2),
+        }
+
+def _make_upstream(name: str, default: int) -> Upstream:
+    concurrency = int(os.environ.get(f"ADMISSION_{name.upper()}_CONCURRENCY", str(default)))
+    return Upstream(name, concurrency, max(1, int(concurrency * QUEUE_FACTOR)))
+
+_upstreams: Dict[str, Upstream] = {name: _make_upstream(name, n) for name, n in DEFAULT_CONCURRENCY.items()}
+
+def get_upstream(name: str) -> Upstream:
+    return _upstreams[name]
+
+@asynccontextmanager
+async def slot(name: str, optional: bool = False):
+    """
+    Holds one of the upstream's concurrency slots for the duration of a
+    call, at the current request's priority and deadline. optional calls
+    are shed (Shed) instead of queueing; the request records the upstream
+    as degraded whenever its call is not admitted.
+    """
+    upstream = _upstreams[name]
+    ctx = _request.get()
+    priority = ctx.priority if ctx is not None else NORMAL
+    deadline = ctx.deadline if ctx is not None else None
+    queued = time.monotonic()
+    try:
+        await upstream.acquire(priority, deadline, optional, ctx)
+    except Rejected:
+        if ctx is not None:
+            ctx.degrade([name])
+        raise
+    started = time.monotonic()
+    metrics.upstream_queue_seconds.observe(started - queued, name)
+    try:
+        yield
+    except Exception as e:
+        metrics.upstream_errors.inc(name, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        metrics.upstream_seconds.observe(elapsed, name)
+        upstream.release(elapsed)
+
+def stats() -> Dict:
+    return {name: upstream.stats() for name, upstream in _upstreams.items()}
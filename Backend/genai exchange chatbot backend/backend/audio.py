@@ -0,0 +1,443 @@
+# backend/audio.py
+"""
+Audio ingestion for speech recognition:
+  - sniff the container and codec from magic bytes (never the file name)
+    and reject what Speech-to-Text can't take before any network call,
+  - turn WAV uploads (PCM, float, A-law, mu-law; any channel count or
+    rate) into mono 16 kHz LINEAR16, block by block, so memory stays
+    bounded whatever the upload size, cut into segments short enough for
+    synchronous recognize,
+  - pick the RecognitionConfig parameters for everything else (Opus in
+    Ogg or WebM, FLAC, MP3, AMR) from the stream headers.
+
+    python -m backend.audio recording.webm other.wav
+prints what was detected, the config chosen and how long preparing took.
+"""
+import io
+import sys
+import time
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+
+TARGET_RATE = 16000
+# Synchronous recognize takes about a minute; leave some slack
+MAX_SEGMENT_SECONDS = 55
+# A segment is cut at the quietest 20 ms in its last few seconds
+CUT_SEARCH_SECONDS = 3
+BLOCK_FRAMES = 32768
+# Opus sample rates Speech-to-Text accepts
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+class UnsupportedAudio(ValueError):
+    """The upload is empty, truncated, or in a format Speech-to-Text can't decode."""
+
+class AudioInfo:
+    __slots__ = ("container", "codec", "sample_rate", "channels", "bits", "duration", "data_offset", "data_size", "format_tag")
+
+    def __init__(self, container: str, codec: str, sample_rate: Optional[int] = None, channels: Optional[int] = None):
+        self.container = container
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bits = None
+        self.duration = None
+        self.data_offset = None
+        self.data_size = None
+        self.format_tag = None
+
+    def as_dict(self) -> Dict:
+        return {
+            "container": self.container,
+            "codec": self.codec,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "duration": self.duration,
+        }
+
+# -------------------------
+# Sniffing
+# -------------------------
+WAVE_PCM, WAVE_FLOAT, WAVE_ALAW, WAVE_MULAW, WAVE_EXTENSIBLE = 1, 3, 6, 7, 0xFFFE
+
+def _sniff_wav(head: bytes) -> AudioInfo:
+    pos = 12
+    info = None
+    while pos + 8 <= len(head):
+        chunk_id, size = head[pos:pos + 4], struct.unpack_from("<I", head, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if size < 16 or body + 16 > len(head):
+                raise UnsupportedAudio("WAV fmt chunk is truncated")
+            tag, channels, rate, _, block_align, bits = struct.unpack_from("<HHIIHH", head, body)
+            if tag == WAVE_EXTENSIBLE and size >= 40 and body + 26 <= len(head):
+                tag = struct.unpack_from("<H", head, body + 24)[0]
+            codec = {WAVE_PCM: "pcm", WAVE_FLOAT: "float", WAVE_ALAW: "alaw", WAVE_MULAW: "mulaw"}.get(tag)
+            if codec is None:
+                raise UnsupportedAudio(f"WAV format tag {tag:#x} is not supported")
+            if not channels or not rate or not block_align:
+                raise UnsupportedAudio("WAV header has zero channels or sample rate")
+            info = AudioInfo("wav", codec, rate, channels)
+            info.bits = bits
+            info.format_tag = tag
+        elif chunk_id == b"data":
+            if info is None:
+                raise UnsupportedAudio("WAV data chunk comes before fmt")
+            info.data_offset = body
+            # recorders that stream WAV write 0 or 0xFFFFFFFF: read to the end
+            info.data_size = None if size in (0, 0xFFFFFFFF) else size
+            if info.data_size:
+                info.duration = info.data_size / (info.channels * max(1, info.bits // 8)) / info.sample_rate
+            return info
+        pos = body + size + (size & 1)
+    raise UnsupportedAudio("WAV has no data chunk in its first bytes")
+
+def _opus_head(data: bytes, at: int) -> AudioInfo:
+    # OpusHead: magic(8) version(1) channels(1) pre-skip(2) input rate(4)
+    if at + 16 > len(data):
+        raise UnsupportedAudio("OpusHead is truncated")
+    channels = data[at + 9]
+    input_rate = struct.unpack_from("<I", data, at + 12)[0]
+    # Opus always decodes at 48 kHz; the input rate is only a hint
+    return AudioInfo("", "opus", input_rate if input_rate in OPUS_RATES else 48000, channels)
+
+def _sniff_ogg(head: bytes) -> AudioInfo:
+    if len(head) < 28:
+        raise UnsupportedAudio("Ogg page is truncated")
+    segments = head[26]
+    packet = 27 + segments
+    if head.startswith(b"OpusHead", packet):
+        info = _opus_head(head, packet)
+        info.container = "ogg"
+        return info
+    if head.startswith(b"\x7fFLAC", packet):
+        raise UnsupportedAudio("FLAC in Ogg is not supported; send native FLAC")
+    if head.startswith(b"\x01vorbis", packet):
+        raise UnsupportedAudio("Ogg Vorbis is not supported by Speech-to-Text")
+    raise UnsupportedAudio("Ogg stream with an unknown codec")
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool):
+    if pos >= len(data):
+        raise UnsupportedAudio("WebM header is truncated")
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise UnsupportedAudio("WebM element header is corrupt")
+    value = first if keep_marker else first & (0xFF >> length)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+# Matroska IDs: masters we descend into, and the track fields we read
+_EBML_MASTERS = {0x18538067, 0x1654AE6B, 0xAE, 0xE1}  # Segment, Tracks, TrackEntry, Audio
+_EBML_CLUSTER = 0x1F43B675
+_EBML_CODEC_ID, _EBML_CODEC_PRIVATE, _EBML_RATE, _EBML_CHANNELS, _EBML_DOCTYPE = 0x86, 0x63A2, 0xB5, 0x9F, 0x4282
+
+def _sniff_webm(head: bytes) -> AudioInfo:
+    fields = {}
+    pos = 0
+    while pos < len(head) - 1:
+        element, id_len, _ = _read_vint(head, pos, keep_marker=True)
+        size, size_len, unknown = _read_vint(head, pos + id_len, keep_marker=False)
+        body = pos + id_len + size_len
+        if element == _EBML_CLUSTER:
+            break
+        if element == 0x1A45DFA3 or element in _EBML_MASTERS:
+            pos = body
+            continue
+        if element in (_EBML_CODEC_ID, _EBML_CODEC_PRIVATE, _EBML_RATE, _EBML_CHANNELS, _EBML_DOCTYPE):
+            fields.setdefault(element, head[body:body + size])
+        if unknown:
+            break
+        pos = body + size
+    codec_id = fields.get(_EBML_CODEC_ID, b"").decode("ascii", "ignore")
+    if not codec_id:
+        raise UnsupportedAudio("WebM has no audio track in its first bytes")
+    if codec_id != "A_OPUS":
+        raise UnsupportedAudio(f"WebM codec {codec_id} is not supported; record Opus")
+    private = fields.get(_EBML_CODEC_PRIVATE, b"")
+    if private.startswith(b"OpusHead"):
+        info = _opus_head(private, 0)
+    else:
+        info = AudioInfo("", "opus", 48000, None)
+    rate = fields.get(_EBML_RATE)
+    if rate and len(rate) in (4, 8):
+        declared = int(struct.unpack(">f" if len(rate) == 4 else ">d", rate)[0])
+        if declared in OPUS_RATES:
+            info.sample_rate = declared
+    channels = fields.get(_EBML_CHANNELS)
+    if channels:
+        info.channels = int.from_bytes(channels, "big")
+    info.container = fields.get(_EBML_DOCTYPE, b"webm").decode("ascii", "ignore") or "webm"
+    return info
+
+def _sniff_flac(head: bytes) -> AudioInfo:
+    if len(head) < 26:
+        raise UnsupportedAudio("FLAC header is truncated")
+    # STREAMINFO: 20 bits sample rate, 3 bits channels - 1, 5 bits bps - 1, 36 bits samples
+    packed = int.from_bytes(head[18:26], "big")
+    rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    samples = packed & ((1 << 36) - 1)
+    info = AudioInfo("flac", "flac", rate, channels)
+    info.bits = ((packed >> 36) & 0x1F) + 1
+    info.duration = samples / rate if rate and samples else None
+    return info
+
+_MP3_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _sniff_mp3(head: bytes) -> AudioInfo:
+    pos = 0
+    if head.startswith(b"ID3") and len(head) >= 10:
+        size = 0
+        for b in head[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        pos = 10 + size
+    end = min(len(head) - 4, pos + 4096)
+    while pos <= end:
+        if head[pos] == 0xFF and head[pos + 1] & 0xE0 == 0xE0:
+            version = (head[pos + 1] >> 3) & 0x3
+            rate_index = (head[pos + 2] >> 2) & 0x3
+            if version in _MP3_RATES and rate_index < 3:
+                channels = 1 if head[pos + 3] >> 6 == 3 else 2
+                return AudioInfo("mp3", "mp3", _MP3_RATES[version][rate_index], channels)
+        pos += 1
+    raise UnsupportedAudio("No MP3 frame found")
+
+def sniff(head: bytes) -> AudioInfo:
+    """
+    Identifies an upload from its first bytes (64 KB is plenty for every
+    supported container). Raises UnsupportedAudio for anything unusable.
+    """
+    if not head:
+        raise UnsupportedAudio("Received an empty audio file.")
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return _sniff_wav(head)
+    if head.startswith(b"OggS"):
+        return _sniff_ogg(head)
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return _sniff_webm(head)
+    if head.startswith(b"fLaC"):
+        return _sniff_flac(head)
+    if head.startswith(b"#!AMR-WB\n"):
+        return AudioInfo("amr", "amr_wb", 16000, 1)
+    if head.startswith(b"#!AMR\n"):
+        return AudioInfo("amr", "amr", 8000, 1)
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return _sniff_mp3(head)
+    raise UnsupportedAudio("Unrecognized audio format")
+
+# -------------------------
+# WAV -> mono 16 kHz LINEAR16
+# -------------------------
+def _g711_table(alaw: bool) -> np.ndarray:
+    codes = np.arange(256, dtype=np.int32)
+    if alaw:
+        x = codes ^ 0x55
+        exponent = (x >> 4) & 0x7
+        mantissa = x & 0xF
+        magnitude = np.where(exponent == 0, (mantissa << 4) + 8, ((mantissa << 4) + 0x108) << (exponent - 1))
+        sign = np.where(x & 0x80, 1, -1)
+    else:
+        x = ~codes & 0xFF
+        exponent = (x >> 4) & 0x7
+        mantissa = x & 0xF
+        magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+        sign = np.where(x & 0x80, -1, 1)
+    return (sign * magnitude / 32768.0).astype(np.float32)
+
+_ALAW = _g711_table(alaw=True)
+_MULAW = _g711_table(alaw=False)
+
+def _decode_frames(raw: bytes, info: AudioInfo) -> np.ndarray:
+    """Interleaved samples -> float32 array of shape (frames, channels) in [-1, 1]."""
+    if info.codec == "float":
+        samples = np.frombuffer(raw, dtype="<f4" if info.bits == 32 else "<f8").astype(np.float32)
+    elif info.codec == "alaw":
+        samples = _ALAW[np.frombuffer(raw, dtype=np.uint8)]
+    elif info.codec == "mulaw":
+        samples = _MULAW[np.frombuffer(raw, dtype=np.uint8)]
+    elif info.bits == 8:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif info.bits == 16:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif info.bits == 24:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    elif info.bits == 32:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise UnsupportedAudio(f"{info.bits}-bit PCM is not supported")
+    return samples.reshape(-1, info.channels)
+
+class Resampler:
+    """
+    Streaming downsampler: windowed-sinc low-pass at the source rate, then
+    linear interpolation at the output sample times. Filter history and the
+    output position carry over between blocks, so block boundaries are
+    seamless and memory doesn't grow with the input.
+    """
+    def __init__(self, src_rate: int, dst_rate: int, taps_per_ratio: int = 16):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        ratio = src_rate / dst_rate
+        taps = int(taps_per_ratio * ratio) | 1
+        cutoff = 0.45 * dst_rate / src_rate
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.base = 0        # source index of the next filtered sample
+        self.next_out = 0    # index of the next output sample
+        self.prev = np.float32(0.0)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        if self.src_rate == self.dst_rate or not len(block):
+            return block
+        padded = np.concatenate([self.history, block])
+        filtered = np.convolve(padded, self.kernel, mode="valid")
+        self.history = padded[len(padded) - len(self.history):] if len(self.history) else self.history
+        last = self.base + len(filtered) - 1
+        last_out = (last * self.dst_rate) // self.src_rate
+        if last_out < self.next_out:
+            out = np.zeros(0, dtype=np.float32)
+        else:
+            k = np.arange(self.next_out, last_out + 1, dtype=np.int64)
+            pos = k * self.src_rate / self.dst_rate - (self.base - 1)
+            z = np.concatenate([[self.prev], filtered])
+            i0 = np.floor(pos).astype(np.int64)
+            frac = (pos - i0).astype(np.float32)
+            i1 = np.minimum(i0 + 1, len(z) - 1)
+            out = z[i0] * (1 - frac) + z[i1] * frac
+            self.next_out = last_out + 1
+        self.base += len(filtered)
+        self.prev = filtered[-1]
+        return out.astype(np.float32, copy=False)
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(samples * 32767.0), -32768, 32767).astype("<i2")
+
+def _quietest_cut(segment: np.ndarray, rate: int) -> int:
+    """Index in the last CUT_SEARCH_SECONDS of segment with the least energy (20 ms windows)."""
+    window = rate // 50
+    start = max(0, len(segment) - CUT_SEARCH_SECONDS * rate)
+    tail = segment[start:].astype(np.float32)
+    count = len(tail) // window
+    if count < 2:
+        return len(segment)
+    energy = np.square(tail[:count * window]).reshape(count, window).sum(axis=1)
+    return start + int(np.argmin(energy)) * window
+
+def wav_to_linear16(stream: BinaryIO, info: AudioInfo, target_rate: int = TARGET_RATE,
+                    max_segment_seconds: float = MAX_SEGMENT_SECONDS) -> Iterator[bytes]:
+    """
+    Reads the WAV data from stream block by block and yields mono LINEAR16
+    segments at min(source rate, target_rate), each at most
+    max_segment_seconds long and cut at a quiet point.
+    """
+    rate = min(info.sample_rate, target_rate)
+    resampler = Resampler(info.sample_rate, rate)
+    frame_bytes = info.channels * max(1, info.bits // 8)
+    stream.seek(info.data_offset)
+    remaining = info.data_size
+    max_samples = int(max_segment_seconds * rate)
+    pending: List[np.ndarray] = []
+    pending_len = 0
+    while remaining is None or remaining > 0:
+        want = BLOCK_FRAMES * frame_bytes
+        if remaining is not None:
+            want = min(want, remaining)
+        raw = stream.read(want)
+        if not raw:
+            break
+        raw = raw[:len(raw) - len(raw) % frame_bytes]
+        if remaining is not None:
+            remaining -= len(raw)
+        mono = _decode_frames(raw, info).mean(axis=1)
+        pcm = _to_int16(resampler.process(mono))
+        pending.append(pcm)
+        pending_len += len(pcm)
+        while pending_len >= max_samples:
+            buffered = np.concatenate(pending)
+            cut = _quietest_cut(buffered[:max_samples], rate)
+            yield buffered[:cut].tobytes()
+            pending, pending_len = [buffered[cut:]], len(buffered) - cut
+    if pending_len:
+        yield np.concatenate(pending).tobytes()
+
+# -------------------------
+# Upload preparation
+# -------------------------
+SNIFF_BYTES = 64 * 1024
+
+class PreparedAudio:
+    """What to send to Speech-to-Text: one or more segments and their config."""
+    __slots__ = ("segments", "encoding", "sample_rate_hertz", "channels", "info")
+
+    def __init__(self, segments: List[bytes], encoding: str, sample_rate_hertz: Optional[int],
+                 channels: Optional[int], info: AudioInfo):
+        self.segments = segments
+        self.encoding = encoding
+        self.sample_rate_hertz = sample_rate_hertz
+        self.channels = channels
+        self.info = info
+
+_ENCODINGS = {
+    ("ogg", "opus"): "OGG_OPUS",
+    ("flac", "flac"): "FLAC",
+    ("mp3", "mp3"): "MP3",
+    ("amr", "amr"): "AMR",
+    ("amr", "amr_wb"): "AMR_WB",
+}
+
+def streaming_encoding(info: AudioInfo) -> str:
+    """Encoding to send a sniffed stream with as-is (WAV as LINEAR16 with its header)."""
+    if info.container == "wav":
+        if info.codec != "pcm" or info.bits != 16:
+            raise UnsupportedAudio("Only 16-bit PCM WAV can be streamed")
+        return "LINEAR16"
+    if info.codec == "opus" and info.container != "ogg":
+        return "WEBM_OPUS"
+    return _ENCODINGS[(info.container, info.codec)]
+
+def prepare(stream: BinaryIO) -> PreparedAudio:
+    """
+    Sniffs and validates an upload, converting WAV to mono 16 kHz LINEAR16
+    segments. Raises UnsupportedAudio before anything is sent.
+    """
+    stream.seek(0)
+    info = sniff(stream.read(SNIFF_BYTES))
+    if info.container == "wav":
+        segments = [s for s in wav_to_linear16(stream, info) if s]
+        if not segments:
+            raise UnsupportedAudio("WAV file has no audio samples")
+        return PreparedAudio(segments, "LINEAR16", min(info.sample_rate, TARGET_RATE), 1, info)
+    stream.seek(0)
+    return PreparedAudio([stream.read()], streaming_encoding(info), info.sample_rate, info.channels, info)
+
+def prepare_bytes(data: bytes) -> PreparedAudio:
+    return prepare(io.BytesIO(data))
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            started = time.perf_counter()
+            try:
+                prepared = prepare(f)
+            except UnsupportedAudio as e:
+                print(f"{path}: rejected: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            size = f.seek(0, 2)
+        out = sum(len(s) for s in prepared.segments)
+        print(
+            f"{path}: {prepared.info.as_dict()} -> {prepared.encoding} "
+            f"{prepared.sample_rate_hertz} Hz x{prepared.channels}, {len(prepared.segments)} segment(s), "
+            f"{size} -> {out} bytes in {elapsed * 1000:.1f} ms"
+        )
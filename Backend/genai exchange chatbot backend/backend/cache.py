@@ -0,0 +1,226 @@
+# backend/cache.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+MISSING = object()
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after ttl seconds.
+    Thread-safe, since the backend calls it from the worker thread pool.
+    """
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING, count_miss: bool = True) -> Any:
+        """count_miss=False is for a check that falls back to another get() on a miss."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            if count_miss:
+                self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# -------------------------
+# Node-wide tier
+# -------------------------
+# One SQLite file that every worker process on the node reads and writes
+# (serve.py puts it in /dev/shm); unset, caches stay per process
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "")
+SHARED_CACHE_ENTRIES = int(os.environ.get("SHARED_CACHE_ENTRIES", "200000"))
+# Longest a lookup waits for another process's write; past it, a miss
+SHARED_CACHE_BUSY_TIMEOUT = float(os.environ.get("SHARED_CACHE_BUSY_TIMEOUT", "0.05"))
+# Expired and excess entries are pruned every this many writes
+PRUNE_EVERY = 1000
+
+class SharedCache:
+    """
+    Cache shared by the processes of one node, in a SQLite file in WAL mode
+    (readers never wait for the writer). Values are JSON. Entries expire
+    after their ttl; beyond max_entries the oldest written go first. Any
+    SQLite error counts as a miss (or a skipped write): a cache never
+    fails a request.
+    """
+    def __init__(self, path: str, max_entries: int = 200000, busy_timeout: float = 0.05):
+        self.path = path
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.writes = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection doesn't survive fork; each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # it's a cache: losing the last writes in a crash is fine
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, written REAL NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_written ON entries (written)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, namespace: str, key: str, default: Any = MISSING) -> Any:
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires > ?",
+                    (namespace, key, time.time()),
+                ).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                return default
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        # no ttl: kept until evicted
+        expires = now + ttl if ttl else 1e18
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (namespace, key, data, now, expires))
+                self.writes += 1
+                if self.writes % PRUNE_EVERY == 0:
+                    self._prune(conn, now)
+            except sqlite3.Error:
+                self.errors += 1
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM entries WHERE (namespace, key) IN "
+                "(SELECT namespace, key FROM entries ORDER BY written LIMIT ?)",
+                (excess,),
+            )
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+_shared: Optional[SharedCache] = SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_ENTRIES, SHARED_CACHE_BUSY_TIMEOUT) if SHARED_CACHE_PATH else None
+
+def shared_cache() -> Optional[SharedCache]:
+    """The node-wide cache, or None when SHARED_CACHE_PATH isn't set."""
+    return _shared
+
+def shared_key(key: Hashable) -> str:
+    # tuples of strings and numbers, as the callers' keys are
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+class TieredCache:
+    """
+    A TTLCache in front of a namespace of the node-wide cache: a local miss
+    is looked up there (and copied into the local tier), and sets go to
+    both. Without a shared cache it behaves as the TTLCache alone.
+    """
+    def __init__(self, namespace: str, max_entries: int = 10000, ttl: Optional[float] = None,
+                 shared: Optional[SharedCache] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(max_entries, ttl)
+        # a size of 0 turns the cache off, node-wide tier included
+        self.shared = shared if max_entries > 0 else None
+        self.shared_hits = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        value = self.local.get(key, MISSING)
+        if value is MISSING and self.shared is not None:
+            value = self.shared.get(self.namespace, shared_key(key))
+            if value is not MISSING:
+                self.shared_hits += 1
+                self.local.set(key, value)
+        return default if value is MISSING else value
+
+    def peek(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        The local tier only, and a miss isn't counted: cheap enough to call
+        on the event loop before deciding to get() from a worker thread.
+        """
+        return self.local.get(key, default, count_miss=False)
+
+    def set(self, key: Hashable, value: Any):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(self.namespace, shared_key(key), value, self.ttl)
+
+    def pop(self, key: Hashable):
+        self.local.pop(key)
+
+    def clear(self):
+        self.local.clear()
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+    def stats(self) -> Dict[str, float]:
+        return {**self.local.stats(), "shared_hits": self.shared_hits}
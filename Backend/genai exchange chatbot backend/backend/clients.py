@@ -0,0 +1,203 @@
+# backend/clients.py
+"""
+Registry of the Google clients the backend uses.
+
+Modules register a factory per client and call get(name) where they used
+to keep a module-level client. Nothing is imported, authenticated or
+connected until the first get() (or warm_up() at startup), and each client
+is built once and reused, also across threads.
+"""
+import os
+import time
+import functools
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+# Used when GOOGLE_APPLICATION_CREDENTIALS is not set
+DEFAULT_CREDENTIALS_FILE = "ai-youth-471917-1a4546328712.json"
+WARMUP_TIMEOUT = float(os.environ.get("CLIENT_WARMUP_TIMEOUT", "10"))
+
+class _Entry:
+    def __init__(self, factory: Callable[[], Any], warm: Optional[Callable], on_loop: bool):
+        self.factory = factory
+        self.warm = warm
+        self.on_loop = on_loop
+        self.instance = None
+        self.built = False
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+
+_entries: Dict[str, _Entry] = {}
+_warmup_timings: Dict[str, float] = {}
+_ready = threading.Event()
+
+def register(
+    name: str,
+    factory: Callable[[], Any],
+    warm: Optional[Callable[[Any], Union[None, Awaitable[None]]]] = None,
+    on_loop: bool = False,
+):
+    """
+    factory builds the client. warm(client), if given, pre-opens its
+    connection during warm_up(). on_loop marks asyncio clients, which bind
+    to the event loop they are created on and so are built on the loop
+    (warm is then a coroutine function).
+    """
+    _entries[name] = _Entry(factory, warm, on_loop)
+
+def get(name: str) -> Any:
+    entry = _entries[name]
+    if not entry.built:
+        with entry.lock:
+            if not entry.built:
+                try:
+                    entry.instance = entry.factory()
+                except Exception as e:
+                    entry.error = repr(e)
+                    raise
+                entry.error = None
+                entry.built = True
+    return entry.instance
+
+async def get_async(name: str) -> Any:
+    """
+    get() for async code: a built client is returned inline; building one
+    (imports, credentials, the lock another thread may hold while it
+    builds) happens on a worker thread, except for on_loop clients.
+    """
+    entry = _entries[name]
+    if entry.built or entry.on_loop:
+        return get(name)
+    from backend.workers import run_blocking
+    return await run_blocking(get, name)
+
+def override(name: str, instance: Any):
+    """Use instance (e.g. a fake) instead of building the client."""
+    entry = _entries[name]
+    with entry.lock:
+        entry.instance = instance
+        entry.built = True
+
+def reset(name: Optional[str] = None):
+    """Forgets built clients so the next get() builds new ones."""
+    for key in [name] if name else list(_entries):
+        entry = _entries[key]
+        with entry.lock:
+            entry.instance = None
+            entry.built = False
+
+def _after_fork():
+    # gRPC channels and their threads don't survive fork: a forked worker
+    # (serve.py) builds, warms up and pools its own clients. Locks are
+    # replaced rather than taken, in case the parent held one.
+    for entry in _entries.values():
+        entry.lock = threading.Lock()
+        entry.instance = None
+        entry.built = False
+        entry.error = None
+    _warmup_timings.clear()
+    _ready.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+# -------------------------
+# Credentials
+# -------------------------
+def _credentials():
+    path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or DEFAULT_CREDENTIALS_FILE
+    if os.path.exists(path):
+        from google.oauth2 import service_account
+        return service_account.Credentials.from_service_account_file(path, scopes=[CLOUD_PLATFORM_SCOPE])
+    import google.auth
+    credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+    return credentials
+
+def _refresh_token(credentials):
+    # Every client shares these (already scoped) credentials, so one token
+    # fetch here saves one on each client's first call
+    import google.auth.transport.requests
+    request = google.auth.transport.requests.Request()
+    credentials.refresh(functools.partial(request, timeout=WARMUP_TIMEOUT))
+
+register("credentials", _credentials, warm=_refresh_token)
+
+def credentials():
+    return get("credentials")
+
+# -------------------------
+# Channel warm-up helpers
+# -------------------------
+def grpc_channel_ready(client):
+    """warm hook for sync GAPIC clients: waits until the channel is connected."""
+    import grpc
+    grpc.channel_ready_future(client.transport.grpc_channel).result(timeout=WARMUP_TIMEOUT)
+
+async def aio_channel_ready(client):
+    """warm hook for asyncio GAPIC clients."""
+    await client.transport.grpc_channel.channel_ready()
+
+# -------------------------
+# Warm-up and readiness
+# -------------------------
+def _warm_one(name: str) -> None:
+    entry = _entries[name]
+    started = time.perf_counter()
+    try:
+        client = get(name)
+        if entry.warm is not None:
+            entry.warm(client)
+    except Exception as e:
+        entry.error = repr(e)
+        logging.warning(f"[clients] warm-up of '{name}' failed: {e!r}")
+    finally:
+        _warmup_timings[name] = time.perf_counter() - started
+
+async def _warm_one_on_loop(name: str) -> None:
+    entry = _entries[name]
+    started = time.perf_counter()
+    try:
+        client = get(name)
+        if entry.warm is not None:
+            await asyncio.wait_for(entry.warm(client), WARMUP_TIMEOUT)
+    except Exception as e:
+        entry.error = repr(e)
+        logging.warning(f"[clients] warm-up of '{name}' failed: {e!r}")
+    finally:
+        _warmup_timings[name] = time.perf_counter() - started
+
+async def warm_up(names: Optional[Iterable[str]] = None):
+    """
+    Builds the clients (all registered ones by default) and pre-opens their
+    channels, concurrently. Failures are logged and left for the first
+    request to retry; readiness turns on either way.
+    """
+    from backend.workers import run_blocking
+    names = list(names) if names is not None else list(_entries)
+    # credentials first: every other factory needs them
+    if "credentials" in names:
+        await run_blocking(_warm_one, "credentials")
+    await asyncio.gather(*(
+        _warm_one_on_loop(name) if _entries[name].on_loop else run_blocking(_warm_one, name)
+        for name in names if name != "credentials"
+    ))
+    _ready.set()
+
+def mark_ready():
+    _ready.set()
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def status() -> Dict[str, Any]:
+    return {
+        "ready": is_ready(),
+        "clients": {
+            name: "error" if entry.error else ("built" if entry.built else "lazy")
+            for name, entry in _entries.items()
+        },
+        "errors": {name: entry.error for name, entry in _entries.items() if entry.error},
+        "warmup_seconds": dict(_warmup_timings),
+    }
@@ -0,0 +1,115 @@
+# backend/context.py
+"""
+Assembles the retrieved chunks that go into the Gemini prompt:
+  1. drops near-duplicate chunks (MinHash over word shingles), keeping the
+     better-ranked copy,
+  2. keeps the retrieval ranking (both the Vertex corpus and the local
+     index return their best match first),
+  3. fills a token budget in that order, cutting the last chunk that
+     doesn't fit at a sentence boundary.
+"""
+import os
+import re
+import zlib
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("PROMPT_CONTEXT_TOKENS", "1000"))
+# Estimated Jaccard similarity of word shingles above which two chunks count as duplicates
+DEDUP_THRESHOLD = float(os.environ.get("PROMPT_DEDUP_THRESHOLD", "0.6"))
+SHINGLE_WORDS = 3
+# A cut-down chunk shorter than this is left out instead
+MIN_FRAGMENT_TOKENS = 40
+SEPARATOR = "\n\n"
+
+def estimate_tokens(text: str) -> int:
+    # Gemini averages about four characters per token; close enough for a
+    # budget, and it needs no network call
+    return (len(text) + 3) // 4
+
+# -------------------------
+# MinHash
+# -------------------------
+MINHASH_PERMUTATIONS = 64
+_MERSENNE = np.uint64((1 << 31) - 1)
+_hash_rng = np.random.RandomState(20240917)
+_HASH_A = _hash_rng.randint(1, (1 << 31) - 1, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_HASH_B = _hash_rng.randint(0, (1 << 31) - 1, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+def minhash_signature(features: Iterable[str], permutations: int = MINHASH_PERMUTATIONS) -> np.ndarray:
+    """MinHash signature of a set of strings; equal positions estimate Jaccard similarity."""
+    features = list(features)
+    if not features:
+        return np.full(permutations, _MERSENNE, dtype=np.uint64)
+    x = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint64, count=len(features))
+    return ((x[:, None] * _HASH_A[:permutations] + _HASH_B[:permutations]) % _MERSENNE).min(axis=0)
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def dedup(texts: List[str], threshold: float = DEDUP_THRESHOLD) -> List[int]:
+    """Indices of the texts to keep; of two near-duplicates the earlier one wins."""
+    kept, signatures = [], []
+    for i, text in enumerate(texts):
+        signature = minhash_signature(shingles(text))
+        if any(np.mean(signature == other) >= threshold for other in signatures):
+            continue
+        kept.append(i)
+        signatures.append(signature)
+    return kept
+
+# -------------------------
+# Budget
+# -------------------------
+_SENTENCE_END = re.compile(r"[.!?।](?=\s)|\n")
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text to about max_tokens, at the last sentence end (or word) before the limit."""
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+    if ends and ends[-1] >= limit // 2:
+        return head[:ends[-1]].rstrip()
+    space = head.rfind(" ")
+    return head[:space].rstrip() if space > 0 else head
+
+def assemble_context(results: List[Dict], max_tokens: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict]:
+    """
+    Context string for the prompt from retrieval results (best first), and
+    stats: chunks in/kept, duplicates dropped, truncated, estimated tokens.
+    """
+    texts = [r.get("text", "").strip() for r in results]
+    texts = [t for t in texts if t]
+    kept = [texts[i] for i in dedup(texts)]
+    parts, used, truncated = [], 0, 0
+    for text in kept:
+        cost = estimate_tokens(text) + (estimate_tokens(SEPARATOR) if parts else 0)
+        if used + cost <= max_tokens:
+            parts.append(text)
+            used += cost
+            continue
+        room = max_tokens - used - (estimate_tokens(SEPARATOR) if parts else 0)
+        if room >= MIN_FRAGMENT_TOKENS:
+            parts.append(truncate_to_tokens(text, room))
+            truncated += 1
+        break
+    context = SEPARATOR.join(parts)
+    stats = {
+        "chunks": len(texts),
+        "kept": len(parts),
+        "duplicates": len(texts) - len(kept),
+        "truncated": truncated,
+        "tokens": estimate_tokens(context),
+    }
+    logging.info(
+        f"[context] kept {stats['kept']}/{stats['chunks']} chunks "
+        f"({stats['duplicates']} near-duplicate, {truncated} truncated), ~{stats['tokens']} tokens"
+    )
+    return context, stats
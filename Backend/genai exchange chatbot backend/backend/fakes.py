@@ -0,0 +1,381 @@
+# backend/fakes.py
+"""
+Local stand-ins for Google services, for running the backend and its
+checks without credentials or network access.
+
+FakeSpeechServer speaks the real google.cloud.speech.v1 gRPC protocol on
+localhost, so the stock SpeechClient / SpeechAsyncClient (and everything in
+stt.py, streaming included) run unchanged against it:
+
+    python -m backend.fakes --port 50051
+    SPEECH_EMULATOR_HOST=localhost:50051 uvicorn app:app
+
+The "audio" it recognizes is UTF-8 text: sending b"I feel low" transcribes
+to "I feel low".
+
+The in-process fakes below replace every client in the registry (Speech,
+Text-to-Speech, Translate, Vertex RAG, Gemini) with objects that answer
+after a sampled latency and fail at a given rate, for benchmarks:
+
+    fakes.install(fakes.REALISTIC, seed=1)
+"""
+import math
+import types
+import random
+import asyncio
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import grpc
+from google.api_core import exceptions
+from google.cloud import speech
+from google.longrunning import operations_pb2
+from google.protobuf import any_pb2
+
+SPEECH_SERVICE = "google.cloud.speech.v1.Speech"
+
+class FakeSpeechServer:
+    """
+    Recognize, LongRunningRecognize and StreamingRecognize over an insecure
+    local port. Like the real API, Recognize rejects audio longer than
+    sync_limit_bytes with "Sync input too long". Streaming sends an interim
+    result per audio request, then one final result.
+    """
+    def __init__(self, port: int = 0, sync_limit_bytes: int = 64 * 1024, latency: float = 0.0):
+        self.sync_limit_bytes = sync_limit_bytes
+        self.latency = latency
+        self.calls = {"recognize": 0, "long_running_recognize": 0, "streaming_recognize": 0}
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=8))
+        self._server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(SPEECH_SERVICE, {
+            "Recognize": grpc.unary_unary_rpc_method_handler(
+                self._recognize,
+                request_deserializer=speech.RecognizeRequest.deserialize,
+                response_serializer=speech.RecognizeResponse.serialize,
+            ),
+            "LongRunningRecognize": grpc.unary_unary_rpc_method_handler(
+                self._long_running_recognize,
+                request_deserializer=speech.LongRunningRecognizeRequest.deserialize,
+                response_serializer=operations_pb2.Operation.SerializeToString,
+            ),
+            "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+                self._streaming_recognize,
+                request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+                response_serializer=speech.StreamingRecognizeResponse.serialize,
+            ),
+        })])
+        self.port = self._server.add_insecure_port(f"localhost:{port}")
+
+    @property
+    def address(self) -> str:
+        return f"localhost:{self.port}"
+
+    def start(self) -> "FakeSpeechServer":
+        self._server.start()
+        return self
+
+    def stop(self):
+        self._server.stop(grace=None)
+
+    def wait(self):
+        self._server.wait_for_termination()
+
+    @staticmethod
+    def _alternatives(text: str):
+        return [speech.SpeechRecognitionAlternative(transcript=text, confidence=0.9)]
+
+    def _recognize(self, request, context):
+        self.calls["recognize"] += 1
+        time.sleep(self.latency)
+        if len(request.audio.content) > self.sync_limit_bytes:
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                "Sync input too long. For audio longer than 1 min use LongRunningRecognize with a 'uri' parameter.",
+            )
+        text = request.audio.content.decode("utf-8", "ignore").strip()
+        return speech.RecognizeResponse(results=[speech.SpeechRecognitionResult(alternatives=self._alternatives(text))])
+
+    def _long_running_recognize(self, request, context):
+        self.calls["long_running_recognize"] += 1
+        time.sleep(self.latency)
+        text = request.audio.content.decode("utf-8", "ignore").strip()
+        response = any_pb2.Any()
+        result = speech.SpeechRecognitionResult(alternatives=self._alternatives(text))
+        response.Pack(speech.LongRunningRecognizeResponse.pb(speech.LongRunningRecognizeResponse(results=[result])))
+        # already done, so the client never has to poll GetOperation
+        return operations_pb2.Operation(name=uuid.uuid4().hex, done=True, response=response)
+
+    def _streaming_recognize(self, requests, context):
+        self.calls["streaming_recognize"] += 1
+        audio = b""
+        for request in requests:
+            if not request.audio_content:
+                continue
+            audio += request.audio_content
+            time.sleep(self.latency)
+            text = audio.decode("utf-8", "ignore").strip()
+            result = speech.StreamingRecognitionResult(alternatives=self._alternatives(text), stability=0.5)
+            yield speech.StreamingRecognizeResponse(results=[result])
+        text = audio.decode("utf-8", "ignore").strip()
+        result = speech.StreamingRecognitionResult(alternatives=self._alternatives(text), is_final=True)
+        yield speech.StreamingRecognizeResponse(results=[result])
+
+# -------------------------
+# In-process fakes
+# -------------------------
+class CallProfile:
+    """
+    Latency and failures of one kind of fake call: lognormal latency with
+    the given median and 95th percentile (seconds), and a failure rate.
+    """
+    def __init__(self, median: float = 0.0, p95: Optional[float] = None, failure_rate: float = 0.0):
+        self.median = median
+        self.sigma = math.log(p95 / median) / 1.645 if median > 0 and p95 and p95 > median else 0.0
+        self.failure_rate = failure_rate
+
+    def scaled(self, factor: float) -> "CallProfile":
+        profile = CallProfile(self.median * factor, None, self.failure_rate)
+        profile.sigma = self.sigma
+        return profile
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * rng.gauss(0.0, 1.0)) if self.sigma else self.median
+
+    def fails(self, rng: random.Random) -> bool:
+        return self.failure_rate > 0 and rng.random() < self.failure_rate
+
+# Rough latencies of the real APIs from an Indian region
+REALISTIC = {
+    "stt": CallProfile(0.35, 0.9),
+    "detect": CallProfile(0.04, 0.1),
+    "translate": CallProfile(0.06, 0.15),
+    "rag": CallProfile(0.15, 0.4),
+    "gemini": CallProfile(0.6, 1.5),            # time to the first chunk
+    "gemini_chunk": CallProfile(0.05, 0.12),    # between streamed chunks
+    "tts": CallProfile(0.2, 0.5),
+}
+# No latency at all: what is left is the backend's own cost
+ZERO = {name: CallProfile() for name in REALISTIC}
+
+class _Fake:
+    def __init__(self, profiles: Dict[str, CallProfile], rng: random.Random):
+        self.profiles = profiles
+        self.rng = rng
+        self.calls: Dict[str, int] = {}
+
+    def _begin(self, kind: str) -> float:
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        profile = self.profiles[kind]
+        if profile.fails(self.rng):
+            raise exceptions.ServiceUnavailable(f"fake {kind} outage")
+        return profile.sample(self.rng)
+
+    def _wait(self, kind: str):
+        time.sleep(self._begin(kind))
+
+    async def _wait_async(self, kind: str):
+        await asyncio.sleep(self._begin(kind))
+
+class FakeTranslateClient(_Fake):
+    """translate_v2.Client: detect_language and translate (text is returned as is)."""
+    @staticmethod
+    def _language(text: str) -> str:
+        return "hi" if any("\u0900" <= ch <= "\u097f" for ch in text) else "en"
+
+    def detect_language(self, text: str) -> Dict:
+        self._wait("detect")
+        return {"language": self._language(text), "confidence": 0.9}
+
+    def translate(self, values, target_language: str = "en", source_language: Optional[str] = None):
+        self._wait("translate")
+        def one(text):
+            return {"translatedText": text, "detectedSourceLanguage": source_language or self._language(text)}
+        return [one(v) for v in values] if isinstance(values, list) else one(values)
+
+FAKE_CORPUS = [
+    "Exam stress is common among students. Breaking study time into short sessions with breaks helps.",
+    "Sleep problems often come with anxiety. Keeping a fixed bedtime and avoiding screens before sleep can help.",
+    "Feeling lonely in a new college is normal. Joining a club or talking to a counsellor are good first steps.",
+    "Pressure from parents can feel overwhelming. Calm, honest conversations about your limits can ease it.",
+    "Breathing exercises such as 4-7-8 breathing reduce the body's stress response within minutes.",
+    "Talking to someone you trust about how you feel is one of the most effective ways to cope.",
+]
+
+class FakeVertexRag(_Fake):
+    """The vertexai.preview.rag module: retrieval_query over a small built-in corpus."""
+    def RagRetrievalConfig(self, top_k: int = 3):
+        return types.SimpleNamespace(top_k=top_k)
+
+    def RagResource(self, rag_corpus: str = ""):
+        return types.SimpleNamespace(rag_corpus=rag_corpus)
+
+    def retrieval_query(self, rag_resources=None, text: str = "", rag_retrieval_config=None):
+        self._wait("rag")
+        top_k = getattr(rag_retrieval_config, "top_k", 3)
+        start = sum(map(ord, text)) % len(FAKE_CORPUS)
+        contexts = [
+            types.SimpleNamespace(text=FAKE_CORPUS[(start + i) % len(FAKE_CORPUS)], score=0.8 - 0.1 * i,
+                                  source_uri=f"gs://fake-corpus/{(start + i) % len(FAKE_CORPUS)}.txt")
+            for i in range(top_k)
+        ]
+        return types.SimpleNamespace(contexts=types.SimpleNamespace(contexts=contexts))
+
+FAKE_REPLY = [
+    "I hear you, and it makes sense that you feel this way. ",
+    "Exams can put a lot of weight on your shoulders. ",
+    "It might help to break your study time into small parts and rest in between.\n\n",
+    "Would you like to talk about what worries you most?",
+]
+
+class FakeGemini(_Fake):
+    """GenerativeModel: generate_content(_async), streamed or not."""
+    @staticmethod
+    def _response(prompt: str, text: str):
+        usage = types.SimpleNamespace(prompt_token_count=len(prompt) // 4, cached_content_token_count=0,
+                                      candidates_token_count=len(text) // 4)
+        return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self._wait("gemini")
+        if not stream:
+            return self._response(prompt, "".join(FAKE_REPLY))
+        def chunks():
+            for i, piece in enumerate(FAKE_REPLY):
+                if i:
+                    self._wait("gemini_chunk")
+                yield self._response(prompt, piece)
+        return chunks()
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        await self._wait_async("gemini")
+        if not stream:
+            return self._response(prompt, "".join(FAKE_REPLY))
+        async def chunks():
+            for i, piece in enumerate(FAKE_REPLY):
+                if i:
+                    await self._wait_async("gemini_chunk")
+                yield self._response(prompt, piece)
+        return chunks()
+
+# About 32 kbit/s MP3 of speech at ~15 characters a second. Compressed
+# encodings all get this size (their real ratio needs the live API);
+# LINEAR16 is sized exactly, from its sample rate.
+TTS_BYTES_PER_CHAR = 270
+TTS_CHARS_PER_SECOND = 15
+TTS_MAGIC = {"MP3": b"ID3", "OGG_OPUS": b"OggS", "LINEAR16": b"RIFF"}
+
+class FakeTextToSpeech(_Fake):
+    """TextToSpeechClient / TextToSpeechAsyncClient (asynchronous=True): synthesize_speech."""
+    def __init__(self, profiles: Dict[str, CallProfile], rng: random.Random, asynchronous: bool = False):
+        super().__init__(profiles, rng)
+        self.asynchronous = asynchronous
+
+    @staticmethod
+    def _response(input, audio_config) -> types.SimpleNamespace:
+        text = getattr(input, "text", "") or ""
+        encoding = getattr(getattr(audio_config, "audio_encoding", None), "name", "MP3")
+        if encoding == "LINEAR16":
+            rate = getattr(audio_config, "sample_rate_hertz", 0) or 24000
+            size = int(2 * rate * len(text) / TTS_CHARS_PER_SECOND)
+        else:
+            size = TTS_BYTES_PER_CHAR * len(text)
+        return types.SimpleNamespace(audio_content=TTS_MAGIC.get(encoding, b"") + bytes(size))
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **kwargs):
+        if self.asynchronous:
+            return self._synthesize_async(input, audio_config)
+        self._wait("tts")
+        return self._response(input, audio_config)
+
+    async def _synthesize_async(self, input, audio_config):
+        await self._wait_async("tts")
+        return self._response(input, audio_config)
+
+class FakeSpeech(_Fake):
+    """
+    SpeechClient / SpeechAsyncClient (asynchronous=True). Returns the given
+    transcripts in turn; without any, the audio bytes read as UTF-8 text,
+    as with FakeSpeechServer.
+    """
+    def __init__(self, profiles: Dict[str, CallProfile], rng: random.Random,
+                 transcripts: Optional[List[str]] = None, asynchronous: bool = False):
+        super().__init__(profiles, rng)
+        self.transcripts = transcripts or []
+        self.asynchronous = asynchronous
+        self._next = 0
+
+    def _transcript(self, content: bytes) -> str:
+        if not self.transcripts:
+            return content.decode("utf-8", "ignore").strip()
+        text = self.transcripts[self._next % len(self.transcripts)]
+        self._next += 1
+        return text
+
+    def _response(self, audio) -> speech.RecognizeResponse:
+        text = self._transcript(audio.content)
+        return speech.RecognizeResponse(results=[speech.SpeechRecognitionResult(
+            alternatives=[speech.SpeechRecognitionAlternative(transcript=text, confidence=0.9)])])
+
+    def recognize(self, config=None, audio=None, **kwargs):
+        if self.asynchronous:
+            return self._recognize_async(audio)
+        self._wait("stt")
+        return self._response(audio)
+
+    async def _recognize_async(self, audio):
+        await self._wait_async("stt")
+        return self._response(audio)
+
+    def long_running_recognize(self, config=None, audio=None, **kwargs):
+        # never reached: recognize() doesn't reject long audio here
+        raise exceptions.Unimplemented("fake speech has no long-running recognition")
+
+    async def streaming_recognize(self, requests=None, **kwargs):
+        async def responses():
+            audio = b""
+            async for request in requests:
+                audio += request.audio_content
+            await self._wait_async("stt")
+            text = self._transcript(audio)
+            result = speech.StreamingRecognitionResult(
+                alternatives=[speech.SpeechRecognitionAlternative(transcript=text)], is_final=True)
+            yield speech.StreamingRecognizeResponse(results=[result])
+        return responses()
+
+def install(profiles: Dict[str, CallProfile] = REALISTIC, seed: int = 0,
+            transcripts: Optional[List[str]] = None) -> Dict[str, _Fake]:
+    """
+    Replaces every Google client in the registry with a fake (see
+    clients.override); returns them by registry name, e.g. to read .calls.
+    """
+    from backend import clients
+
+    rng = random.Random(seed)
+    rag = FakeVertexRag(profiles, rng)
+    installed = {
+        "translate": FakeTranslateClient(profiles, rng),
+        "speech": FakeSpeech(profiles, rng, transcripts),
+        "speech_async": FakeSpeech(profiles, rng, transcripts, asynchronous=True),
+        "tts": FakeTextToSpeech(profiles, rng),
+        "tts_async": FakeTextToSpeech(profiles, rng, asynchronous=True),
+        "vertex_rag": rag,
+        "rag_resource": rag.RagResource("projects/fake/locations/fake/ragCorpora/fake"),
+        "gemini": FakeGemini(profiles, rng),
+        "gemini_summary": FakeGemini(profiles, rng),
+    }
+    for name, fake in installed.items():
+        clients.override(name, fake)
+    return installed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Cloud Speech server")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each call")
+    args = parser.parse_args()
+    server = FakeSpeechServer(args.port, latency=args.latency).start()
+    print(f"Fake speech server on {server.address}")
+    server.wait()
@@ -0,0 +1,310 @@
+# backend/langid.py
+"""
+Local language identification, so most messages need no Cloud Translation
+detect call:
+  - native Indic scripts are recognized from their Unicode blocks; the
+    only script shared by two of our languages, Devanagari, is split
+    into Hindi and Marathi with a character n-gram model,
+  - Latin text is English or romanized Indic ("te-Latn" and friends);
+    a character n-gram model trained on the samples below decides.
+
+identify() returns the same codes normalize_lang_code produces ("te" for
+romanized Telugu too) with a confidence; detect() returns None when the
+confidence is too low, and the caller asks the API instead.
+
+More training text (JSON {"te": ["...", ...], ...}, romanized Latin or
+native script) can be added with LANGID_SAMPLES=path.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import functools
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MIN_CONFIDENCE = float(os.environ.get("LANGID_MIN_CONFIDENCE", "0.9"))
+# Fewer letters than this is too little to go on (e.g. "ok", "hmm")
+MIN_LETTERS = int(os.environ.get("LANGID_MIN_LETTERS", "6"))
+NGRAM_ORDERS = (1, 2, 3, 4)
+# Add-k smoothing for n-grams a language never produced in training
+SMOOTHING = 0.05
+# Nats of average per-n-gram evidence that count as certainty; keeps the
+# confidence of long messages from saturating on a small margin
+CONFIDENCE_SCALE = 6.0
+
+# -------------------------
+# Training samples
+# -------------------------
+# Everyday and mental-health vocabulary as users type it
+SAMPLES: Dict[str, List[str]] = {
+    "en": [
+        "i feel very sad and i do not know what to do, my mind is not okay",
+        "i cannot sleep at night and there is nobody to talk to, i need help",
+        "how are you, i am fine, what happened, why is this happening to me",
+        "my family and my friends do not understand, work is too much",
+        "i feel lonely and anxious, i want to die, i am scared of everything",
+        "i feel like crying, please tell me what i should do, i do not understand",
+        "the exams are stressing me out and college is hard, my parents are angry",
+        "thank you for listening, it was a bad day, i have been thinking about it",
+        "they said that she would be there with them but nothing happened",
+        "can you help me with my anxiety and depression, i feel hopeless",
+    ],
+    "te": [
+        "nenu chala badhaga unnanu naku emi cheyalo teliyatledu na manasu baledu",
+        "nidra raavatledu evaru leru naaku sahayam kavali meeru ela unnaru",
+        "nenu baagunnanu emaindi enduku ila jarugutondi naa kutumbam naa snehithulu",
+        "pani ekkuva ga undi ontariga anipistondi chanipovalani undi bhayam ga undi",
+        "edupu vastondi cheppandi ardham kaavatledu naaku tension ga undi",
+        "exams gurinchi chala bhayam ga undi amma nanna kopam ga unnaru",
+        "ee roju chala kashtam ga gadichindi evaritho matladalo teliyatledu",
+        "nuvvu cheppindi naaku nachindi kani nenu emi cheyaleka potunnanu",
+    ],
+    "ta": [
+        "naan romba kashtama irukken enakku enna pannanum theriyala en manasu sariyilla",
+        "thookkam varala yarum illa enakku udhavi venum neenga eppadi irukkeenga",
+        "naan nalla irukken enna aachu yen ippadi nadakkudhu en kudumbam en nanbargal",
+        "velai romba adhigama irukku thaniya irukkura maadhiri irukku saaganum pola irukku",
+        "bayama irukku azhugai varudhu sollunga puriyala enakku tension aa irukku",
+        "exam pathi romba bayama irukku amma appa kovama irukkanga",
+        "indha naal romba kashtama pochu yaarkitta pesanum nu theriyala",
+        "neenga sonnadhu enakku pidichirukku aana enna panradhu nu theriyala",
+    ],
+    "hi": [
+        "main bahut udaas hoon mujhe samajh nahi aa raha kya karun mera mann theek nahi hai",
+        "neend nahi aati koi nahi hai mujhe madad chahiye aap kaise ho",
+        "main theek hoon kya hua aisa kyun ho raha hai mera parivaar mere dost",
+        "kaam bahut zyada hai akela mehsoos hota hai marne ka mann karta hai",
+        "darr lag raha hai rona aa raha hai bataiye mujhe samajh nahi aata",
+        "exam ki wajah se bahut tension hai mummy papa gussa hain",
+        "aaj ka din bahut kharab tha kisse baat karun pata nahi",
+        "aapne jo kaha wo achha laga lekin main kuch nahi kar pa raha hoon",
+    ],
+    "kn": [
+        "nanage tumba bejaragide nanage enu maadabeku gottagtilla nanna manassu sariyilla",
+        "nidde bartilla yaaru illa nanage sahaaya beku neevu hegiddira",
+        "naanu chennagiddini enaaytu yaake heege aagtide nanna kutumba nanna snehitaru",
+        "kelasa tumba jaasti ide obbane iddini anisutte saayabeku anisutte",
+        "bhaya aagtide aluvu bartide heli arthaagtilla nanage tension aagtide",
+        "exam bagge tumba bhaya ide amma appa kopadalli iddare",
+        "ivattu tumba kashta aaytu yaara jothe maatadabeku gottilla",
+        "neevu helidde nanage ishta aaytu aadre naanu enu maadalu aagtilla",
+    ],
+    "ml": [
+        "enikku valiya vishamam undu enikku enthu cheyyanam ennu ariyilla ente manassu sariyalla",
+        "urakkam varunnilla aarum illa enikku sahayam venam ningal engane undu",
+        "njan sukhamayi irikkunnu enthu patti enthinanu ingane sambhavikkunnathu ente kudumbam",
+        "joli kooduthal aanu ottakku aanu ennu thonnunnu marikkanam ennu thonnunnu",
+        "pediyaavunnu karachil varunnu parayoo manassilaavunnilla enikku tension aanu",
+        "pareekshaye kurichu valiya pedi undu amma achan deshyathilaanu",
+        "innu valare moshamaya divasam aayirunnu aarodu samsarikkanam ennu ariyilla",
+        "ningal paranjathu enikku ishtapettu pakshe enikku onnum cheyyan pattunnilla",
+    ],
+    "bn": [
+        "ami khub kharap achi amar ki korbo bujhte parchi na amar mon bhalo nei",
+        "ghum ashche na keu nei amar sahajjo dorkar apni kemon achen",
+        "ami bhalo achi ki hoyeche keno emon hocche amar poribar amar bondhura",
+        "kaj khub beshi eka lagche morte ichhe korche bhoy lagche",
+        "kanna pachhe bolun bujhchi na amar khub tension hocche",
+        "porikkha niye khub bhoy lagche ma baba rege ache",
+        "aajker din ta khub kharap chilo kar sathe kotha bolbo jani na",
+        "apni ja bollen amar bhalo laglo kintu ami kichui korte parchi na",
+    ],
+    "mr": [
+        "mala khup vait vatat aahe mala kay karava samjat nahi maza mann thik nahi",
+        "zop yet nahi kuni nahi mala madat havi aahe tumhi kase aahat",
+        "mi thik aahe kay zala asa ka hota aahe maza kutumb maze mitra",
+        "kaam khup jasta aahe ekta vatat aahe marava asa vatat",
+        "bhiti vatat aahe radu yet aahe sanga mala samajat nahi",
+        "pariksha mule khup tension aahe aai baba ragavle aahet",
+        "aajcha divas khup vait hota konashi bolu kalat nahi",
+        "tumhi je sangitla te mala avadla pan mi kahich karu shakat nahi",
+    ],
+}
+
+DEVANAGARI_SAMPLES: Dict[str, List[str]] = {
+    "hi": [
+        "मैं बहुत उदास हूँ मुझे समझ नहीं आ रहा क्या करूँ मेरा मन ठीक नहीं है",
+        "नींद नहीं आती कोई नहीं है मुझे मदद चाहिए आप कैसे हैं",
+        "मैं ठीक हूँ क्या हुआ ऐसा क्यों हो रहा है मेरा परिवार मेरे दोस्त",
+        "काम बहुत ज़्यादा है अकेला महसूस होता है डर लग रहा है रोना आ रहा है",
+        "परीक्षा की वजह से बहुत तनाव है मम्मी पापा गुस्सा हैं",
+        "आज का दिन बहुत खराब था किससे बात करूँ पता नहीं",
+    ],
+    "mr": [
+        "मला खूप वाईट वाटत आहे मला काय करावं समजत नाही माझं मन ठीक नाही",
+        "झोप येत नाही कोणी नाही मला मदत हवी आहे तुम्ही कसे आहात",
+        "मी ठीक आहे काय झालं असं का होत आहे माझं कुटुंब माझे मित्र",
+        "काम खूप जास्त आहे एकटं वाटत आहे भीती वाटत आहे रडू येत आहे",
+        "परीक्षेमुळे खूप ताण आहे आई बाबा रागावले आहेत",
+        "आजचा दिवस खूप वाईट होता कोणाशी बोलू कळत नाही",
+    ],
+}
+
+# -------------------------
+# Character n-gram model
+# -------------------------
+# Letters: ASCII and the Indic blocks (Devanagari vowel signs and viramas
+# included, which \w would split words on), minus danda and digits
+_WORD = re.compile(r"[a-z\u0900-\u0963\u0971-\u0d7f]+")
+# Scored words are kept; chat vocabulary repeats a lot
+WORD_CACHE_SIZE = 50000
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+def _grams(word: str) -> List[str]:
+    padded = f" {word} "
+    return [padded[i:i + n] for n in NGRAM_ORDERS for i in range(len(padded) - n + 1) if padded[i:i + n] != " "]
+
+class NGramModel:
+    """
+    Naive Bayes over character 1-4 grams of words (padded with spaces, so
+    word starts and ends count). A word's summed log-probabilities are
+    computed once and cached; scoring a message is a cache lookup per word
+    and a few additions (plain Python: numpy's per-call overhead would
+    dominate on vectors this short).
+    """
+    def __init__(self, samples: Dict[str, List[str]]):
+        self.langs = list(samples)
+        counts: List[Dict[str, int]] = []
+        vocab: Dict[str, int] = {}
+        for lang in self.langs:
+            c: Dict[str, int] = {}
+            for text in samples[lang]:
+                for word in _words(text):
+                    for g in _grams(word):
+                        c[g] = c.get(g, 0) + 1
+                        vocab.setdefault(g, len(vocab))
+            counts.append(c)
+        table = np.full((len(vocab), len(self.langs)), SMOOTHING, dtype=np.float64)
+        for j, c in enumerate(counts):
+            for g, k in c.items():
+                table[vocab[g], j] += k
+        # grams are counted per order; normalize each order separately
+        orders = np.array([len(g) for g in vocab])
+        for n in NGRAM_ORDERS:
+            rows = orders == n
+            table[rows] /= table[rows].sum(axis=0)
+        self.table = np.log(table).astype(np.float32)
+        self.vocab = vocab
+        self.zero = (0.0,) * len(self.langs)
+        self._word_scores = functools.lru_cache(maxsize=WORD_CACHE_SIZE)(self._score_word)
+
+    def _score_word(self, word: str) -> Tuple[np.ndarray, int]:
+        # an n-gram no language has seen is equally likely in all, so it
+        # only dilutes the evidence (counts, adds nothing)
+        grams = _grams(word)
+        ids = [self.vocab[g] for g in grams if g in self.vocab]
+        return (tuple(self.table[ids].sum(axis=0).tolist()) if ids else self.zero), len(grams)
+
+    def scores(self, text: str) -> Tuple[List[float], int]:
+        """Average log-probability per n-gram for each language, and how many n-grams."""
+        scored = [self._word_scores(w) for w in _words(text)]
+        count = sum(n for _, n in scored)
+        if not count:
+            return list(self.zero), 0
+        return [sum(column) / count for column in zip(*(v for v, _ in scored))], count
+
+    def identify(self, text: str) -> Tuple[str, float]:
+        avg, count = self.scores(text)
+        if not count:
+            return self.langs[0], 0.0
+        top = max(avg)
+        # posterior of the best language against the rest, with the average
+        # evidence scaled (per-gram independence would make it overconfident)
+        confidence = 1.0 / sum(math.exp((a - top) * CONFIDENCE_SCALE) for a in avg)
+        return self.langs[avg.index(top)], confidence
+
+def _load_samples(path: Optional[str]):
+    latin = {lang: list(texts) for lang, texts in SAMPLES.items()}
+    devanagari = {lang: list(texts) for lang, texts in DEVANAGARI_SAMPLES.items()}
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            extra = json.load(f)
+        for lang, texts in extra.items():
+            for text in texts:
+                target = devanagari if re.search("[ऀ-ॿ]", text) else latin
+                target.setdefault(lang, []).append(text)
+    return latin, devanagari
+
+_latin_samples, _devanagari_samples = _load_samples(os.environ.get("LANGID_SAMPLES"))
+_latin_model = NGramModel(_latin_samples)
+_devanagari_model = NGramModel(_devanagari_samples)
+
+# -------------------------
+# Scripts
+# -------------------------
+# Indic scripts each own a 128-code-point block from U+0900 to U+0D7F
+SCRIPT_BLOCK_START = 0x0900
+SCRIPT_LANGS = [
+    "devanagari",  # U+0900 Hindi or Marathi
+    "bn",          # U+0980 Bengali
+    "pa",          # U+0A00 Gurmukhi
+    "gu",          # U+0A80 Gujarati
+    "or",          # U+0B00 Odia
+    "ta",          # U+0B80 Tamil
+    "te",          # U+0C00 Telugu
+    "kn",          # U+0C80 Kannada
+    "ml",          # U+0D00 Malayalam
+]
+
+# Maps each Indic letter to one character per script block and ASCII
+# letters to "L"; everything else is dropped
+_SCRIPT_TABLE = str.maketrans({
+    **{cp: chr(0x41 + ((cp - SCRIPT_BLOCK_START) >> 7))
+       for cp in range(SCRIPT_BLOCK_START, SCRIPT_BLOCK_START + 128 * len(SCRIPT_LANGS))},
+    **{cp: "L" for cp in list(range(0x41, 0x5B)) + list(range(0x61, 0x7B))},
+})
+_SCRIPT_TAGS = [chr(0x41 + i) for i in range(len(SCRIPT_LANGS))]
+_NOT_TAG = re.compile(f"[^{''.join(_SCRIPT_TAGS)}L]+")
+
+def _script_counts(text: str) -> Tuple[List[int], int]:
+    """Letters per Indic script block, and the number of ASCII letters."""
+    tags = _NOT_TAG.sub("", text.translate(_SCRIPT_TABLE))
+    return [tags.count(tag) for tag in _SCRIPT_TAGS], tags.count("L")
+
+def identify(text: str) -> Tuple[Optional[str], float]:
+    """
+    (language code, confidence in [0, 1]); (None, 0.0) when the text has
+    too few letters to tell.
+    """
+    if not text:
+        return None, 0.0
+    if text.isascii():
+        blocks, latin = None, sum(map(str.isalpha, text))
+    else:
+        blocks, latin = _script_counts(text)
+    native = sum(blocks) if blocks is not None else 0
+    if native > latin:
+        i = max(range(len(blocks)), key=blocks.__getitem__)
+        share = blocks[i] / (native + latin)
+        if native < MIN_LETTERS // 2:
+            # Indic letters are syllables; a few already say a lot
+            return None, 0.0
+        if SCRIPT_LANGS[i] == "devanagari":
+            lang, confidence = _devanagari_model.identify(text)
+            return lang, float(share * confidence)
+        return SCRIPT_LANGS[i], float(share)
+    if latin < MIN_LETTERS:
+        return None, 0.0
+    lang, confidence = _latin_model.identify(text)
+    share = latin / (native + latin)
+    return lang, float(share * confidence)
+
+def detect(text: str, min_confidence: float = MIN_CONFIDENCE) -> Optional[str]:
+    """Language code if identified with at least min_confidence, else None."""
+    lang, confidence = identify(text)
+    return lang if confidence >= min_confidence else None
+
+if __name__ == "__main__":
+    # python -m backend.langid "some text" ... (or lines on stdin)
+    texts = sys.argv[1:] or [line.strip() for line in sys.stdin if line.strip()]
+    for text in texts:
+        started = time.perf_counter()
+        lang, confidence = identify(text)
+        elapsed = time.perf_counter() - started
+        print(f"{lang or '?':3s} {confidence:.2f} {elapsed * 1e6:6.1f}us  {text}")
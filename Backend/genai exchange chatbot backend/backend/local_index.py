@@ -0,0 +1,303 @@
+# backend/local_index.py
+"""
+Local retrieval index: a hybrid BM25 + dense index over a snapshot of the
+RAG corpus chunks, searched in-process instead of calling Vertex
+retrieval_query across regions.
+
+Build a snapshot (from local documents, a chunks JSONL, or by harvesting
+chunks from the remote corpus with seed queries), then compare it against
+the remote corpus:
+
+    python -m backend.local_index build --docs ./corpus --out rag_index
+    python -m backend.local_index build --harvest queries.txt --out rag_index
+    python -m backend.local_index bench --index rag_index --queries queries.txt
+
+All arrays are stored as flat files and opened with np.memmap (read-only),
+so worker processes share one copy through the page cache.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+import statistics
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "rag_index")
+# Weight of the dense score in the hybrid score (BM25 gets the rest)
+DENSE_WEIGHT = float(os.environ.get("LOCAL_INDEX_DENSE_WEIGHT", "0.5"))
+
+EMBEDDING_DIMS = 512
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower().replace("'", "").replace("’", ""))
+
+# -------------------------
+# Dense embedding
+# -------------------------
+def embed(text: str, dims: int = EMBEDDING_DIMS) -> np.ndarray:
+    """
+    Hashing-trick embedding: word unigrams and bigrams hashed into `dims`
+    signed buckets, log-scaled term counts, L2-normalized. Needs no model,
+    so queries embed in microseconds.
+    """
+    words = tokenize(text)
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    vec = np.zeros(dims, dtype=np.float32)
+    for feature, count in features.items():
+        h = zlib.crc32(feature.encode("utf-8"))
+        vec[h % dims] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + np.log(count))
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def quantize(matrix: np.ndarray):
+    """Symmetric per-row int8 quantization; returns (int8 matrix, float32 scales)."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+# -------------------------
+# Building
+# -------------------------
+def chunk_text(text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    tokens = text.split()
+    if len(tokens) <= words:
+        return [" ".join(tokens)] if tokens else []
+    step = words - overlap
+    return [" ".join(tokens[i:i + words]) for i in range(0, len(tokens) - overlap, step)]
+
+def read_documents(path: str) -> Iterator[Dict]:
+    """Chunks from a directory of .txt/.md files, or records from a .jsonl file."""
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield {"text": record["text"], "source": record.get("source", "")}
+        return
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith((".txt", ".md")):
+                file_path = os.path.join(root, name)
+                with open(file_path, encoding="utf-8") as f:
+                    for chunk in chunk_text(f.read()):
+                        yield {"text": chunk, "source": file_path}
+
+def harvest_remote(queries: Iterable[str], top_k: int = 20) -> List[Dict]:
+    """
+    Snapshots corpus chunks by running seed queries against the remote
+    corpus (the RAG API has no call that lists chunk text).
+    """
+    from backend import rag
+    seen = {}
+    for query in queries:
+        for result in rag.search_remote(query, top_k=top_k):
+            seen.setdefault(result["text"], {"text": result["text"], "source": result.get("source", "")})
+    return list(seen.values())
+
+def build_index(chunks: List[Dict], out_dir: str, dims: int = EMBEDDING_DIMS, dtype: str = "int8"):
+    """Writes the index files for `chunks` ({"text", "source"}) into out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    docs = [tokenize(c["text"]) for c in chunks]
+    n_docs = len(docs)
+    lengths = np.array([len(d) for d in docs], dtype=np.float32)
+    avgdl = float(lengths.mean()) if n_docs else 0.0
+
+    # BM25 weights per (term, doc), precomputed so a query only sums them
+    postings: Dict[str, List[tuple]] = {}
+    for doc_id, words in enumerate(docs):
+        for term, tf in Counter(words).items():
+            postings.setdefault(term, []).append((doc_id, tf))
+    vocab = {term: i for i, term in enumerate(sorted(postings))}
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    doc_ids, weights = [], []
+    for term, row in vocab.items():
+        plist = postings[term]
+        idf = np.log(1.0 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+        for doc_id, tf in plist:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / avgdl)
+            doc_ids.append(doc_id)
+            weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        indptr[row + 1] = len(doc_ids)
+
+    embeddings = np.stack([embed(c["text"], dims) for c in chunks]) if chunks else np.zeros((0, dims), np.float32)
+    if dtype == "int8":
+        quantized, scales = quantize(embeddings)
+        quantized.tofile(os.path.join(out_dir, "embeddings.i8"))
+        scales.tofile(os.path.join(out_dir, "scales.f32"))
+    else:
+        embeddings.astype(np.float32).tofile(os.path.join(out_dir, "embeddings.f32"))
+    indptr.tofile(os.path.join(out_dir, "postings_indptr.i64"))
+    np.array(doc_ids, dtype=np.int32).tofile(os.path.join(out_dir, "postings_docs.i32"))
+    np.array(weights, dtype=np.float32).tofile(os.path.join(out_dir, "postings_weights.f32"))
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(out_dir, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        for c in chunks:
+            f.write(json.dumps({"text": c["text"], "source": c.get("source", "")}, ensure_ascii=False) + "\n")
+    # written last: an index directory without meta.json is incomplete
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"n_docs": n_docs, "dims": dims, "dtype": dtype, "n_postings": len(doc_ids)}, f)
+
+# -------------------------
+# Searching
+# -------------------------
+class LocalIndex:
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        n, dims = self.meta["n_docs"], self.meta["dims"]
+        self.dims = dims
+
+        def mapped(name, dtype, shape):
+            # np.memmap rejects empty files; an empty index gets empty arrays
+            if not shape[0]:
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(os.path.join(directory, name), dtype=dtype, mode="r", shape=shape)
+
+        if self.meta["dtype"] == "int8":
+            self.embeddings = mapped("embeddings.i8", np.int8, (n, dims))
+            self.scales = mapped("scales.f32", np.float32, (n,))
+        else:
+            self.embeddings = mapped("embeddings.f32", np.float32, (n, dims))
+            self.scales = None
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.indptr = mapped("postings_indptr.i64", np.int64, (len(self.vocab) + 1,))
+        self.doc_ids = mapped("postings_docs.i32", np.int32, (self.meta["n_postings"],))
+        self.weights = mapped("postings_weights.f32", np.float32, (self.meta["n_postings"],))
+        with open(os.path.join(directory, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def bm25_scores(self, terms: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in terms:
+            row = self.vocab.get(term)
+            if row is not None:
+                start, end = self.indptr[row], self.indptr[row + 1]
+                # doc ids are unique within one posting list
+                scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def dense_scores(self, query: str) -> np.ndarray:
+        scores = self.embeddings @ embed(query, self.dims)
+        if self.scales is not None:
+            scores = scores * self.scales
+        return scores.astype(np.float32, copy=False)
+
+    def search(self, query: str, top_k: int = 3, dense_weight: float = DENSE_WEIGHT) -> List[Dict]:
+        """
+        Top-k chunks by dense_weight * cosine + (1 - dense_weight) * BM25,
+        with BM25 scaled to [0, 1] by the best match for this query.
+        """
+        if not len(self) or top_k <= 0:
+            return []
+        bm25 = self.bm25_scores(tokenize(query))
+        best = bm25.max()
+        if best > 0:
+            bm25 /= best
+        scores = dense_weight * self.dense_scores(query) + (1.0 - dense_weight) * bm25
+        k = min(top_k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"text": self.chunks[i]["text"], "score": float(scores[i]), "source": self.chunks[i]["source"]}
+            for i in top
+            if scores[i] > 0
+        ]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> Optional[LocalIndex]:
+    """Loads the index from INDEX_DIR on first use; None if there isn't one."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not os.path.exists(os.path.join(INDEX_DIR, "meta.json")):
+                    return None
+                _index = LocalIndex(INDEX_DIR)
+    return _index
+
+def search(query: str, top_k: int = 3) -> List[Dict]:
+    index = get_index()
+    return index.search(query, top_k) if index is not None else []
+
+# -------------------------
+# CLI
+# -------------------------
+def _read_queries(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def benchmark(index: LocalIndex, queries: List[str], top_k: int = 3) -> Dict:
+    """Recall@k of the local index against remote results, and latency of both."""
+    from backend import rag
+    local_ms, remote_ms, recalls = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        remote = rag.search_remote(query, top_k=top_k)
+        remote_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        local = index.search(query, top_k=top_k)
+        local_ms.append((time.perf_counter() - start) * 1000)
+        if remote:
+            expected = {r["text"] for r in remote}
+            recalls.append(len(expected & {r["text"] for r in local}) / len(expected))
+    return {
+        "queries": len(queries),
+        "top_k": top_k,
+        "recall": statistics.mean(recalls) if recalls else None,
+        "local_ms": {"p50": _percentile(local_ms, 0.5), "p95": _percentile(local_ms, 0.95)},
+        "remote_ms": {"p50": _percentile(remote_ms, 0.5), "p95": _percentile(remote_ms, 0.95)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or benchmark the local retrieval index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    source = build.add_mutually_exclusive_group(required=True)
+    source.add_argument("--docs", help="directory of .txt/.md files, or a chunks .jsonl")
+    source.add_argument("--harvest", help="file of seed queries to snapshot chunks from the remote corpus")
+    build.add_argument("--harvest-top-k", type=int, default=20)
+    build.add_argument("--out", default=INDEX_DIR)
+    build.add_argument("--dtype", choices=["int8", "float32"], default="int8")
+    bench = sub.add_parser("bench")
+    bench.add_argument("--index", default=INDEX_DIR)
+    bench.add_argument("--queries", required=True, help="one query per line")
+    bench.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.docs:
+            chunks = list(read_documents(args.docs))
+        else:
+            chunks = harvest_remote(_read_queries(args.harvest), args.harvest_top_k)
+        build_index(chunks, args.out, dtype=args.dtype)
+        print(f"Indexed {len(chunks)} chunks into {args.out}")
+    else:
+        report = benchmark(LocalIndex(args.index), _read_queries(args.queries), args.top_k)
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
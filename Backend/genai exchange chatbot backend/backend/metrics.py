@@ -0,0 +1,282 @@
+# backend/metrics.py
+"""
+Timing spans and Prometheus metrics:
+  - span("name") times a block (sync or async code) into the stage
+    latency histogram and into the current request's trace, which the
+    middleware sends back as a Server-Timing header,
+  - upstream latency, queue wait, errors and payload sizes are recorded
+    by the modules that make the calls,
+  - render() writes everything, plus the stats of registered modules
+    (admission, caches, coalescing), in the Prometheus text format.
+
+A span costs a couple of microseconds. Spans named in METRICS_PROFILE are
+also run under cProfile, for a METRICS_PROFILE_RATE fraction of calls;
+profile_report() prints the accumulated profile.
+"""
+import os
+import io
+import time
+import random
+import pstats
+import cProfile
+import functools
+import threading
+import contextvars
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+PREFIX = "chatbot_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROFILE_SPANS = {s.strip() for s in os.environ.get("METRICS_PROFILE", "").split(",") if s.strip()}
+PROFILE_RATE = float(os.environ.get("METRICS_PROFILE_RATE", "0.01"))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+# -------------------------
+# Metric types
+# -------------------------
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket = _labels(self.labels, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+request_seconds = Histogram("request_seconds", "End-to-end request latency.", ("route", "status"))
+stage_seconds = Histogram("stage_seconds", "Latency of pipeline stages and other timed spans.", ("stage",))
+stage_errors = Counter("stage_errors_total", "Spans and stages that raised or timed out.", ("stage",))
+upstream_seconds = Histogram("upstream_seconds", "Upstream API call latency, after admission.", ("upstream",))
+upstream_queue_seconds = Histogram("upstream_queue_seconds", "Time waiting for an upstream slot.", ("upstream",))
+upstream_errors = Counter("upstream_errors_total", "Upstream API calls that failed.", ("upstream", "error"))
+payload_bytes = Histogram("payload_bytes", "Sizes of audio, prompts and replies.", ("kind",), SIZE_BUCKETS)
+
+_metrics = [
+    request_seconds, stage_seconds, stage_errors,
+    upstream_seconds, upstream_queue_seconds, upstream_errors, payload_bytes,
+]
+
+def observe_payload(kind: str, size: int):
+    payload_bytes.observe(size, kind)
+
+# -------------------------
+# Spans
+# -------------------------
+# (name, seconds) of the spans finished so far in the current request
+_trace: contextvars.ContextVar = contextvars.ContextVar("metrics_trace", default=None)
+
+def record(name: str, seconds: float, failed: bool = False):
+    """Records a span timed elsewhere (e.g. by the pipeline scheduler)."""
+    stage_seconds.observe(seconds, name)
+    if failed:
+        stage_errors.inc(name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+_profiles: Dict[str, pstats.Stats] = {}
+_profile_lock = threading.Lock()
+_profiling = threading.local()
+
+class span:
+    """
+    with metrics.span("transcribe"): ...
+    Usable in sync and async code. Exceptions are counted and re-raised.
+    """
+    __slots__ = ("name", "started", "profiler")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        if self.name in PROFILE_SPANS and random.random() < PROFILE_RATE and not getattr(_profiling, "active", False):
+            # cProfile sees only this thread, so nested spans aren't profiled twice
+            _profiling.active = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.started, exc_type is not None)
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiling.active = False
+            with _profile_lock:
+                if self.name in _profiles:
+                    _profiles[self.name].add(self.profiler)
+                else:
+                    _profiles[self.name] = pstats.Stats(self.profiler)
+        return False
+
+def timed(name: str) -> Callable:
+    """
+    Decorator form of span, for sync functions. Profiling a span only makes
+    sense for these: one that awaits would also profile whatever else the
+    event loop runs meanwhile.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def profile_report(name: str, limit: int = 30) -> Optional[str]:
+    """Top functions by cumulative time in the sampled calls of a span (None if never sampled)."""
+    with _profile_lock:
+        stats = _profiles.get(name)
+        if stats is None:
+            return None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+# -------------------------
+# Server-Timing
+# -------------------------
+def server_timing(trace: List[Tuple[str, float]], total: float) -> str:
+    # repeated spans (e.g. one per sentence) are summed
+    durations: Dict[str, float] = {}
+    for name, seconds in trace:
+        durations[name] = durations.get(name, 0.0) + seconds
+    parts = [f"{name};dur={1000 * seconds:.1f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={1000 * total:.1f}")
+    return ", ".join(parts)
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: starts a trace per HTTP request, adds a Server-Timing
+    header with the spans finished before the response starts, and records
+    the end-to-end latency. Streaming responses send their headers early,
+    so theirs list only what ran before the first byte.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = []
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(trace, time.perf_counter() - started)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            route = scope.get("route")
+            request_seconds.observe(time.perf_counter() - started, getattr(route, "path", "unmatched"), str(status))
+
+# -------------------------
+# Exposition
+# -------------------------
+# Stats fields that only ever grow; exported as counters, the rest as gauges
+COUNTER_FIELDS = {
+    "hits", "misses", "evictions", "exact_hits", "similar_hits", "admitted", "shed",
+    "rejected", "timeouts", "calls", "upstream_calls", "coalesced", "errors",
+    "turns", "summaries", "summary_fallbacks", "expired", "shared_hits", "writes",
+}
+
+_collectors: List[Tuple[str, Callable[[], Dict], Optional[str]]] = []
+
+def register_stats(prefix: str, fn: Callable[[], Dict], label: Optional[str] = None):
+    """
+    Exports a module's stats() at scrape time. With label, fn returns
+    {label value: {field: number}}; otherwise {field: number}. Fields that
+    aren't numbers are skipped.
+    """
+    _collectors.append((prefix, fn, label))
+
+def _render_stats(prefix: str, stats: Dict, label: Optional[str]) -> List[str]:
+    samples: Dict[str, list] = {}
+    for group, fields in (stats.items() if label else [(None, stats)]):
+        if not isinstance(fields, dict):
+            continue
+        for field, value in fields.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            samples.setdefault(field, []).append((group, value))
+    lines = []
+    for field, rows in samples.items():
+        counter = field in COUNTER_FIELDS
+        name = f"{PREFIX}{prefix}_{field}" + ("_total" if counter else "")
+        lines.append(f"# TYPE {name} {'counter' if counter else 'gauge'}")
+        for group, value in rows:
+            lines.append(f"{name}{_labels((label,), (group,)) if label else ''} {value:g}")
+    return lines
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for prefix, fn, label in _collectors:
+        try:
+            lines += _render_stats(prefix, fn(), label)
+        except Exception as e:
+            lines.append(f"# {prefix} stats unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
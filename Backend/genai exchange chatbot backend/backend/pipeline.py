@@ -0,0 +1,485 @@
+# backend/pipeline.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from backend import admission, metrics, rag, sessions, translation, tts
+from backend.safety import analyze_risk, more_severe
+from backend.streaming import SentenceBuffer
+from backend.workers import run_blocking
+
+# -------------------------
+# Stage scheduler
+# -------------------------
+# A chat turn is a small DAG of stages. Every stage starts as soon as the
+# stages it depends on have finished, so independent work (safety analysis,
+# retrieval, translation) overlaps and a turn costs its critical path instead
+# of the sum of its stages.
+
+REQUIRED = object()
+
+class StageFailed(Exception):
+    """A required stage raised or timed out; the whole run is cancelled."""
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"stage '{stage}' failed: {error!r}")
+        self.stage = stage
+        self.error = error
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[["PipelineRun"], Awaitable[Any]],
+        deps: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        default: Any = REQUIRED,
+    ):
+        """
+        fn receives the PipelineRun and can read finished dependencies with
+        run.results[name] (or await run.get(name) for an undeclared one).
+        timeout counts from when the deps are done, not from the run start.
+        If default is given, a failure or timeout yields it instead of
+        failing the run.
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.default = default
+
+class PipelineRun:
+    def __init__(self, stages: List[Stage]):
+        self.stages = {s.name: s for s in stages}
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self) -> "PipelineRun":
+        for name in self.stages:
+            self._tasks[name] = asyncio.ensure_future(self._run_stage(self.stages[name]))
+        return self
+
+    async def _run_stage(self, stage: Stage) -> Any:
+        if stage.deps:
+            await asyncio.gather(*(self._tasks[d] for d in stage.deps))
+        started = time.perf_counter()
+        failed = False
+        # no stage outlives the request's deadline
+        timeout = stage.timeout
+        remaining = admission.remaining()
+        if remaining is not None:
+            timeout = max(0.0, remaining) if timeout is None else max(0.0, min(timeout, remaining))
+        try:
+            result = await asyncio.wait_for(stage.fn(self), timeout)
+        except (asyncio.CancelledError, StageFailed):
+            # cancelled, or a stage this one awaited already failed the run
+            raise
+        except Exception as e:
+            failed = True
+            if stage.default is REQUIRED:
+                raise StageFailed(stage.name, e) from e
+            logging.warning(f"[pipeline] stage '{stage.name}' degraded: {e!r}")
+            result = stage.default
+        finally:
+            self.timings[stage.name] = time.perf_counter() - started
+            metrics.record(stage.name, self.timings[stage.name], failed)
+        self.results[stage.name] = result
+        return result
+
+    async def get(self, name: str) -> Any:
+        return await self._tasks[name]
+
+    def cancel(self, name: str):
+        task = self._tasks.get(name)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def cancel_all(self):
+        for name in self._tasks:
+            self.cancel(name)
+
+    async def wait(self) -> Dict[str, Any]:
+        """Waits for every stage; on the first failure cancels the rest and raises."""
+        pending = set(self._tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    # a stage cancelled on purpose (e.g. discarded speculation)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is not None:
+                        raise error
+        except BaseException:
+            self.cancel_all()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            raise
+        return self.results
+
+async def run_stages(stages: List[Stage]) -> PipelineRun:
+    run = PipelineRun(stages).start()
+    await run.wait()
+    return run
+
+# -------------------------
+# Chat turn
+# -------------------------
+DETECT_TIMEOUT = float(os.environ.get("PIPELINE_DETECT_TIMEOUT", "5"))
+TRANSLATE_TIMEOUT = float(os.environ.get("PIPELINE_TRANSLATE_TIMEOUT", "10"))
+RETRIEVAL_TIMEOUT = float(os.environ.get("PIPELINE_RETRIEVAL_TIMEOUT", "8"))
+GENERATE_TIMEOUT = float(os.environ.get("PIPELINE_GENERATE_TIMEOUT", "45"))
+
+# Sent instead of FALLBACK_RESPONSE to a high-risk message when no reply
+# could be generated (Gemini failing or overloaded); the helplines follow
+CRISIS_RESPONSE = (
+    "I'm really sorry you're going through this, and I'm glad you reached out. "
+    "You don't have to face it alone. Please call one of these helplines now; "
+    "they are free, confidential and there to listen."
+)
+
+def format_helplines(risk: Dict) -> str:
+    """Helpline block appended to replies when the risk is high."""
+    if risk.get("risk") != "high":
+        return ""
+    helplines = risk.get("helpline_results", [])
+    lines = [f"{h['name']}: {h['number']}" for h in helplines if h.get("number")]
+    if not lines:
+        return ""
+    return "\n\n⚠️ Helplines:\n" + "\n".join(lines)
+
+def chat_turn_stages(
+    query: str, user_lang: str = "auto", top_k: int = 3, generation: bool = True, history: Optional[str] = None
+) -> List[Stage]:
+    """
+    Stages for one turn:
+      native_risk -> risk <- english <- lang
+      english -> retrieval -> context -> generate -> reply
+    Risk is scored on the user's own words at once (the phrase tables cover
+    our Indic languages); the translated text is only a second opinion, and
+    a high native risk doesn't wait for it.
+    Retrieval starts speculatively on the raw query while the language is
+    still unknown (or known to be English); the speculative result is used if
+    the query turns out to be English and discarded otherwise.
+    With the response cache on, a "cached" stage (after risk and context)
+    looks up a stored reply for low-risk turns; on a hit generate and reply
+    pass it through without calling Gemini or Translate.
+    With generation=False the turn stops after context (streaming replies
+    generate outside the scheduler). history (the session's past
+    conversation, "" for a new one) goes into the prompt; turns of a
+    session skip the response cache, since they are remembered in English
+    and their replies depend on more than the query.
+    """
+    known_lang = None if user_lang == "auto" else translation.normalize_lang_code(user_lang)
+    speculate = known_lang in (None, "en")
+
+    async def lang(run):
+        if known_lang:
+            return known_lang
+        return translation.normalize_lang_code(await translation.detect_language_async(query))
+
+    async def english(run):
+        if run.results["lang"] == "en":
+            return query
+        # the speculative retrieval on the raw query won't be used
+        run.cancel("speculative_retrieval")
+        try:
+            return await asyncio.wait_for(
+                translation.translate_to_async(query, "en", source_language=run.results["lang"]),
+                TRANSLATE_TIMEOUT,
+            )
+        except Exception as e:
+            # Gemini reads our languages too; a translation outage shouldn't
+            # cost the user their reply (or the helplines)
+            logging.warning(f"[pipeline] translation to English failed, using the original text: {e!r}")
+            return query
+
+    async def native_risk(run):
+        result = await run_blocking(analyze_risk, query)
+        if result.get("risk") == "high":
+            # the rest of this turn's upstream calls go to the front of their queues
+            admission.escalate(admission.CRITICAL)
+        return result
+
+    async def risk(run):
+        native = run.results["native_risk"]
+        if native.get("risk") == "high":
+            return native
+        english = await run.get("english")
+        if english == query:
+            return native
+        result = more_severe(native, await run_blocking(analyze_risk, english))
+        if result.get("risk") == "high":
+            admission.escalate(admission.CRITICAL)
+        return result
+
+    async def speculative_retrieval(run):
+        return await rag.search_query_async(query, top_k=top_k)
+
+    async def retrieval(run):
+        if speculate and run.results["lang"] == "en":
+            return await run.get("speculative_retrieval")
+        return await rag.search_query_async(run.results["english"], top_k=top_k)
+
+    cache = rag.response_cache if history is None else None
+
+    def cache_key(run):
+        return cache.key(run.results["english"], run.results["context"], run.results["lang"])
+
+    async def context(run):
+        return rag.build_context(run.results["retrieval"])
+
+    async def cached(run):
+        # never serve a stored reply to a high-risk message
+        if run.results["risk"].get("risk") == "high":
+            return None
+        return cache.get(cache_key(run))
+
+    async def generate(run):
+        if run.results.get("cached") is not None:
+            return run.results["cached"]
+        return await rag.generate_response_with_llm_async(run.results["english"], run.results["context"], history or "")
+
+    async def reply(run):
+        generated = await _fallback_reply(run, run.results["generate"])
+        if run.results.get("cached") is not None or run.results["lang"] == "en":
+            text = generated
+        else:
+            try:
+                text = await translation.translate_from_async(generated, "en", run.results["lang"])
+            except Exception:
+                return generated
+        if (
+            cache is not None
+            and run.results.get("cached") is None
+            and generated != rag.FALLBACK_RESPONSE
+            and run.results["risk"].get("risk") != "high"
+        ):
+            cache.add(cache_key(run), text)
+        return text
+
+    stages = [
+        Stage("lang", lang, timeout=DETECT_TIMEOUT, default="en"),
+        Stage("english", english, deps=["lang"]),
+        Stage("native_risk", native_risk),
+        Stage("risk", risk, deps=["native_risk"]),
+        Stage("retrieval", retrieval, deps=["english"], timeout=RETRIEVAL_TIMEOUT, default=[]),
+        Stage("context", context, deps=["retrieval"]),
+    ]
+    if generation:
+        generate_deps = ["english", "context"]
+        if cache is not None:
+            stages.append(Stage("cached", cached, deps=["english", "risk", "context"], default=None))
+            generate_deps.append("cached")
+        stages += [
+            Stage("generate", generate, deps=generate_deps, timeout=GENERATE_TIMEOUT,
+                  default=rag.FALLBACK_RESPONSE),
+            Stage("reply", reply, deps=["generate"], timeout=TRANSLATE_TIMEOUT, default=None),
+        ]
+    if speculate:
+        stages.append(Stage("speculative_retrieval", speculative_retrieval, default=[]))
+    return stages
+
+async def _fallback_reply(run: PipelineRun, generated: str) -> str:
+    """CRISIS_RESPONSE in place of FALLBACK_RESPONSE when the turn is high risk."""
+    if generated == rag.FALLBACK_RESPONSE and (await run.get("risk")).get("risk") == "high":
+        return CRISIS_RESPONSE
+    return generated
+
+def _history(session_id: Optional[str]) -> Optional[str]:
+    return sessions.history(session_id) if session_id else None
+
+def _remember(session_id: Optional[str], english_query: str, english_reply: str):
+    # a turn without a real reply adds nothing worth recalling
+    if session_id and english_reply and english_reply not in (rag.FALLBACK_RESPONSE, CRISIS_RESPONSE):
+        sessions.record_turn(session_id, english_query, english_reply)
+
+async def run_chat_turn(query: str, user_lang: str = "auto", top_k: int = 3, session_id: Optional[str] = None) -> Dict:
+    """
+    Runs one chat turn, with the session's past conversation (if any) in
+    the prompt, and returns:
+      - lang, english_query, risk (analyze_risk dict), context
+      - response: reply in the user's language, with helplines if high risk
+      - timings: seconds per stage
+    """
+    run = await run_stages(chat_turn_stages(query, user_lang, top_k, history=_history(session_id)))
+    results = run.results
+    _remember(session_id, results["english"], results["generate"])
+    response_text = results["reply"] if results["reply"] is not None else results["generate"]
+    response_text += format_helplines(results["risk"])
+    metrics.observe_payload("reply", len(response_text.encode("utf-8")))
+    return {
+        "lang": results["lang"],
+        "english_query": results["english"],
+        "risk": results["risk"],
+        "context": results["context"],
+        "response": response_text,
+        "timings": run.timings,
+    }
+
+# -------------------------
+# Streaming chat turn
+# -------------------------
+async def _translate_sentence(sentence: str, lang: str) -> str:
+    if lang == "en":
+        return sentence
+    # keep the whitespace that followed the sentence (paragraph breaks)
+    body = sentence.rstrip()
+    try:
+        with metrics.span("translate_sentence"):
+            translated = await translation.translate_from_async(body, "en", lang)
+    except Exception:
+        translated = body
+    return translated + sentence[len(body):]
+
+async def stream_chat_turn(
+    query: str, user_lang: str = "auto", top_k: int = 3, by_sentence: bool = False, session_id: Optional[str] = None
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Runs one chat turn with a streamed reply, yielding (event, data):
+      - ("meta", {"lang"}) once the language is known,
+      - ("delta", {"text"}) as reply text arrives. English is forwarded as
+        Gemini produces it; other languages are translated sentence by
+        sentence, with translations in flight while generation continues,
+      - ("helplines", {"text"}) when the risk is high,
+      - ("done", {"response"}) with the full reply.
+    Risk analysis keeps running alongside generation; it is only awaited
+    for the helpline event at the end. The session's past conversation
+    goes into the prompt, as in run_chat_turn.
+    """
+    history = _history(session_id)
+    run = PipelineRun(chat_turn_stages(query, user_lang, top_k, generation=False, history=history)).start()
+    pending = deque()
+    try:
+        lang = await run.get("lang")
+        yield "meta", {"lang": lang}
+        english = await run.get("english")
+        context = await run.get("context")
+
+        parts = []
+        generated = []
+        sentences = SentenceBuffer()
+        started = time.perf_counter()
+        first = True
+        async for delta in rag.generate_response_stream_async(english, context, history or ""):
+            if first:
+                metrics.record("first_token", time.perf_counter() - started)
+                first = False
+            delta = await _fallback_reply(run, delta)
+            generated.append(delta)
+            if lang == "en" and not by_sentence:
+                parts.append(delta)
+                yield "delta", {"text": delta}
+                continue
+            for sentence in sentences.feed(delta):
+                pending.append(asyncio.ensure_future(_translate_sentence(sentence, lang)))
+            # hand out finished translations in order without waiting
+            while pending and pending[0].done():
+                text = pending.popleft().result()
+                parts.append(text)
+                yield "delta", {"text": text}
+        metrics.record("generate", time.perf_counter() - started)
+        for sentence in sentences.flush():
+            pending.append(asyncio.ensure_future(_translate_sentence(sentence, lang)))
+        while pending:
+            text = await pending.popleft()
+            parts.append(text)
+            yield "delta", {"text": text}
+
+        helplines = format_helplines(await run.get("risk"))
+        if helplines:
+            parts.append(helplines)
+            yield "helplines", {"text": helplines}
+        await run.wait()
+        _remember(session_id, english, "".join(generated))
+        response = "".join(parts)
+        metrics.observe_payload("reply", len(response.encode("utf-8")))
+        yield "done", {"response": response}
+    finally:
+        # client went away or a stage failed: stop everything still running
+        for task in pending:
+            task.cancel()
+        run.cancel_all()
+
+# -------------------------
+# Streaming voice turn
+# -------------------------
+VOICE_TTS_PARALLELISM = int(os.environ.get("VOICE_TTS_PARALLELISM", "3"))
+
+def tts_language(lang: str) -> str:
+    return f"{lang}-IN" if lang != "en" else "en-IN"
+
+async def stream_voice_turn(
+    query: str, user_lang: str = "auto", top_k: int = 3, max_parallel: int = VOICE_TTS_PARALLELISM,
+    audio_format: Optional[tts.AudioFormat] = None, session_id: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Like stream_chat_turn, but every reply sentence is also synthesized.
+    Yields (event, data):
+      - ("meta", {"lang", "media_type"}),
+      - ("text", {"index", "text"}) for each sentence (and the helpline
+        block) as soon as it is translated,
+      - ("audio", {"index", "audio"}) with that segment's audio (in
+        audio_format, MP3 by default), strictly in index order,
+      - ("done", {"response"}) after the last audio.
+    Up to max_parallel segments are synthesized at once, so the first
+    sentence's audio is out while later ones are still being generated.
+    """
+    audio_format = audio_format or tts.DEFAULT_FORMAT
+    limit = asyncio.Semaphore(max(1, max_parallel))
+    audio = deque()
+    lang = "en"
+    segments = 0
+    done = None
+
+    async def synthesize(index: int, text: str) -> Tuple[int, Any]:
+        if not text.strip():
+            return index, b""
+        async with limit:
+            with metrics.span("tts"):
+                return index, await tts.synthesize_audio_async(
+                    text=text.strip(), language_code=tts_language(lang), audio_format=audio_format
+                )
+
+    events = stream_chat_turn(query, user_lang, top_k, by_sentence=True, session_id=session_id)
+    next_event = asyncio.ensure_future(events.__anext__())
+    try:
+        while next_event is not None or audio:
+            waiting = {next_event} if next_event is not None else set()
+            if audio:
+                waiting.add(audio[0])
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            # audio goes out in order: only ever from the head of the queue
+            while audio and audio[0].done():
+                index, content = audio.popleft().result()
+                if content:
+                    yield "audio", {"index": index, "audio": content}
+            if next_event is None or not next_event.done():
+                continue
+            try:
+                event, data = next_event.result()
+            except StopAsyncIteration:
+                next_event = None
+                continue
+            next_event = asyncio.ensure_future(events.__anext__())
+            if event == "meta":
+                lang = data["lang"]
+                yield event, {**data, "media_type": audio_format.media_type}
+            elif event in ("delta", "helplines"):
+                yield "text", {"index": segments, "text": data["text"]}
+                audio.append(asyncio.ensure_future(synthesize(segments, data["text"])))
+                segments += 1
+            elif event == "done":
+                done = data
+        if done is not None:
+            yield "done", done
+    finally:
+        for task in audio:
+            task.cancel()
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose()
@@ -1,35 +1,258 @@
 # backend/rag.py
 import os
-from typing import List, Dict
+import re
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from backend.safety import analyze_risk, HELPLINE_CATEGORIES
-from google.oauth2 import service_account
-import vertexai
-from vertexai.preview import rag
-from vertexai.generative_models import GenerativeModel
+from backend.workers import run_blocking
+from backend.cache import TTLCache, SharedCache, shared_cache, shared_key
+from backend import admission, clients, local_index, metrics, singleflight
+from backend.context import assemble_context, minhash_signature, CONTEXT_TOKEN_BUDGET
 
 # === CONFIG ===
 PROJECT_ID = "ai-youth-471917"
 LOCATION = "us-east4"
 CORPUS_NAME = "projects/ai-youth-471917/locations/us-east4/ragCorpora/1441151880758558720"
+MODEL_NAME = "gemini-2.5-flash"
 
-# === AUTH ===
-SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or "ai-youth-471917-1a4546328712.json"
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
+# === CLIENTS ===
+# vertexai takes seconds to import, so it is imported and initialized on
+# first use (or during startup warm-up), not when this module is imported.
+def _init_vertex():
+    import vertexai
+    vertexai.init(project=PROJECT_ID, location=LOCATION, credentials=clients.credentials())
+    from vertexai.preview import rag
+    return rag
 
-# Init Vertex AI
-vertexai.init(project=PROJECT_ID, location=LOCATION, credentials=creds)
+def _rag_resource():
+    return clients.get("vertex_rag").RagResource(rag_corpus=CORPUS_NAME)
 
-# RAG resource
-rag_resource = rag.RagResource(rag_corpus=CORPUS_NAME)
+def _model():
+    clients.get("vertex_rag")  # vertexai.init
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION)
+
+def _summary_model():
+    clients.get("vertex_rag")
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(MODEL_NAME, system_instruction=SUMMARY_INSTRUCTION)
+
+def _open_model_channel(model):
+    # GenerativeModel creates its prediction client on first use
+    clients.grpc_channel_ready(model._prediction_client)
+
+clients.register("vertex_rag", _init_vertex)
+clients.register("rag_resource", _rag_resource)
+# One model object for every call; it keeps its prediction clients
+clients.register("gemini", _model, warm=_open_model_channel)
+# Conversation summaries (backend/sessions.py) need their own instruction;
+# built on first use, they are off the reply path
+clients.register("gemini_summary", _summary_model)
+
+# -------------------------
+# Retrieval cache
+# -------------------------
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RAG_CACHE_ENABLED", "1") != "0"
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", "2000"))
+# Word-pair similarity a different phrasing needs to reuse a cached result;
+# 1.0 turns similar-query hits off (exact normalized matches only).
+RETRIEVAL_CACHE_SIMILARITY = float(os.environ.get("RAG_CACHE_SIMILARITY", "0.8"))
+# Bump after re-importing the corpus so cached results are not served
+CORPUS_VERSION = os.environ.get("RAG_CORPUS_VERSION", "1")
+
+# Words that don't change what a query retrieves. Negations stay in.
+_FILLER_WORDS = {
+    "i", "im", "me", "my", "am", "is", "are", "was", "a", "an", "the", "so",
+    "very", "really", "just", "too", "of", "to", "and", "please", "feel", "feeling",
+}
+
+def normalize_query(query: str) -> str:
+    q = (query or "").lower().replace("'", "").replace("’", "")
+    q = re.sub(r"[^\w\s]", " ", q)
+    return " ".join(q.split())
+
+def _query_terms(normalized: str) -> Tuple[str, ...]:
+    words = [w for w in normalized.split() if w not in _FILLER_WORDS]
+    return tuple(words or normalized.split())
+
+def _bigrams(terms: Tuple[str, ...]) -> frozenset:
+    # pairs of consecutive content words, in order, so that "sad and not
+    # happy" and "happy and not sad" share nothing; the ends are marked so
+    # a one-word query still has features
+    words = ("^",) + terms + ("$",) if terms else ()
+    return frozenset(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+# MinHash LSH: 8 bands of 4 hashes. Two queries become candidates if any
+# band matches, which happens with probability 1 - (1 - J^4)^8: ~0.98 at
+# Jaccard 0.8, ~0.4 at 0.5, ~0.06 at 0.3.
+LSH_BANDS = 8
+LSH_ROWS = 4
+
+def _lsh_bands(grams: frozenset) -> List[bytes]:
+    signature = minhash_signature(grams, LSH_BANDS * LSH_ROWS)
+    return [bytes([band]) + signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes() for band in range(LSH_BANDS)]
+
+class RetrievalCache:
+    """
+    LRU cache of retrieval results keyed by (normalized query, top_k).
+    A lookup that misses exactly falls back to the most similar cached
+    query with the same top_k, scored by Jaccard similarity of the
+    pairs of consecutive content words, so "I can't sleep!" and "cant
+    sleep" share an entry but word order still counts. Candidates come from a MinHash LSH index, so a lookup
+    scores a handful of entries however large the cache is. Every entry is tagged with the corpus version it was retrieved
+    from and is ignored (and dropped) once the version changes.
+    With a shared cache (several workers, see serve.py), exact matches
+    missing here are also looked up in the node-wide tier.
+    """
+    def __init__(self, max_entries: int = 2000, similarity: float = 0.8, version: str = "1",
+                 shared: Optional[SharedCache] = None):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.version = version
+        self.shared = shared
+        self.stats_counts = {"exact_hits": 0, "similar_hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "stale": 0}
+        # key -> (version, word pairs, LSH bands, results)
+        self._entries: "OrderedDict[Tuple[str, int], tuple]" = OrderedDict()
+        self._index: Dict[Tuple[str, int], set] = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version: str):
+        with self._lock:
+            self.version = version
+
+    def get(self, query: str, top_k: int) -> Optional[List[Dict]]:
+        normalized = normalize_query(query)
+        with self._lock:
+            key = (normalized, top_k)
+            entry = self._live(key)
+            if entry is None and self.similarity < 1.0:
+                key = self._most_similar(_bigrams(_query_terms(normalized)), top_k)
+                entry = self._entries[key] if key is not None else None
+                hit = "similar_hits"
+            else:
+                hit = "exact_hits"
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats_counts[hit] += 1
+                return list(entry[3])
+            version = self.version
+        results = None
+        if self.shared is not None:
+            results = self.shared.get("retrieval", shared_key((version, normalized, top_k)), None)
+        if results is None:
+            with self._lock:
+                self.stats_counts["misses"] += 1
+            return None
+        self.put(query, top_k, results, share=False)
+        with self._lock:
+            self.stats_counts["shared_hits"] += 1
+        return list(results)
+
+    def _live(self, key) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != self.version:
+            self._drop(key)
+            self.stats_counts["stale"] += 1
+            return None
+        return entry
+
+    def _most_similar(self, grams: frozenset, top_k: int) -> Optional[Tuple[str, int]]:
+        if not grams:
+            return None
+        candidates = set()
+        for band in _lsh_bands(grams):
+            candidates |= self._index.get((band, top_k), set())
+        best, best_score = None, self.similarity
+        for key in candidates:
+            entry = self._live(key)
+            if entry is None:
+                continue
+            other = entry[1]
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def put(self, query: str, top_k: int, results: List[Dict], share: bool = True):
+        normalized = normalize_query(query)
+        grams = _bigrams(_query_terms(normalized))
+        bands = _lsh_bands(grams) if grams and self.similarity < 1.0 else []
+        key = (normalized, top_k)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (self.version, grams, bands, list(results))
+            for band in bands:
+                self._index.setdefault((band, top_k), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats_counts["evictions"] += 1
+            version = self.version
+        if share and self.shared is not None:
+            self.shared.set("retrieval", shared_key((version, normalized, top_k)), list(results))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in entry[2]:
+            keys = self._index.get((band, key[1]))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(band, key[1])]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self) -> Dict:
+        counts = dict(self.stats_counts)
+        hits = counts["exact_hits"] + counts["similar_hits"] + counts["shared_hits"]
+        lookups = hits + counts["misses"]
+        return {
+            **counts,
+            "entries": len(self._entries),
+            "corpus_version": self.version,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+_retrieval_cache = (
+    RetrievalCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_SIMILARITY, CORPUS_VERSION, shared_cache())
+    if RETRIEVAL_CACHE_ENABLED else None
+)
+
+def retrieval_cache_stats() -> Dict:
+    return _retrieval_cache.stats() if _retrieval_cache is not None else {}
+
+def set_corpus_version(version: str):
+    """Call after the corpus is re-imported; older cached results stop being served."""
+    if _retrieval_cache is not None:
+        _retrieval_cache.set_version(version)
 
 # -------------------------
 # RAG Search
 # -------------------------
-def search_query(query: str, top_k: int = 3) -> List[Dict]:
-    """Run retrieval query against RAG corpus"""
+# "remote": Vertex retrieval_query, "local": the in-process index from
+# backend/local_index.py, "local_first": local, falling back to remote when
+# there is no local index or nothing scores at least RAG_LOCAL_MIN_SCORE.
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "remote")
+LOCAL_MIN_SCORE = float(os.environ.get("RAG_LOCAL_MIN_SCORE", "0.2"))
+# Longest a caller waits on a retrieval, its own or one it shares
+SEARCH_TIMEOUT = float(os.environ.get("RAG_SEARCH_TIMEOUT", "15"))
+
+def search_remote(query: str, top_k: int = 3) -> List[Dict]:
+    """Run retrieval query against the Vertex RAG corpus (uncached)"""
     try:
+        rag = clients.get("vertex_rag")
         response = rag.retrieval_query(
-            rag_resources=[rag_resource],
+            rag_resources=[clients.get("rag_resource")],
             text=query,
             rag_retrieval_config=rag.RagRetrievalConfig(top_k=top_k),
         )
@@ -41,13 +264,75 @@ def search_query(query: str, top_k: int = 3) -> List[Dict]:
         print("❌ RAG search error:", e)
         return []
 
-def build_context(results: List[Dict]) -> str:
-    """Combine retrieved docs into one context string"""
-    return "\n\n".join([r.get("text", "") for r in results])
+@metrics.timed("local_search")
+def search_local(query: str, top_k: int = 3) -> List[Dict]:
+    try:
+        return local_index.search(query, top_k)
+    except Exception as e:
+        print("❌ Local index search error:", e)
+        return []
+
+def _retrieve(query: str, top_k: int) -> List[Dict]:
+    if RAG_BACKEND == "local":
+        results = search_local(query, top_k)
+    elif RAG_BACKEND == "local_first":
+        results = search_local(query, top_k)
+        if not results or results[0]["score"] < LOCAL_MIN_SCORE:
+            results = search_remote(query, top_k) or results
+    else:
+        results = search_remote(query, top_k)
+    # empty results are usually a failed call, so they are not cached
+    if results and _retrieval_cache is not None:
+        _retrieval_cache.put(query, top_k, results)
+    return results
+
+_retrieval_flights = singleflight.group("retrieval", SEARCH_TIMEOUT)
+
+def search_query(query: str, top_k: int = 3) -> List[Dict]:
+    """Run retrieval query against RAG corpus (cached)"""
+    if _retrieval_cache is not None:
+        cached = _retrieval_cache.get(query, top_k)
+        if cached is not None:
+            return cached
+    return _retrieve(query, top_k)
+
+async def search_query_async(query: str, top_k: int = 3) -> List[Dict]:
+    """search_query on the backend thread pool (the RAG API has no async client)"""
+    # cache hits are answered on the event loop, without a thread hop
+    if _retrieval_cache is not None:
+        cached = _retrieval_cache.get(query, top_k)
+        if cached is not None:
+            return cached
+    if RAG_BACKEND == "local":
+        return await run_blocking(_retrieve, query, top_k)
+
+    async def retrieve():
+        # retrieval is optional: under load the turn goes on without context
+        async with admission.slot("rag", optional=True):
+            return await run_blocking(_retrieve, query, top_k)
+    # the same query from many users at once (a trending phrase) is one call
+    return await _retrieval_flights.do((query, top_k), retrieve)
+
+def build_context(results: List[Dict], max_tokens: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Combine retrieved docs into one context string (deduplicated, within the token budget)"""
+    return assemble_context(results, max_tokens)[0]
 
 # -------------------------
 # Safety + RAG + Helplines
 # -------------------------
+def _safety_output(risk: Dict, results: List[Dict]) -> Dict:
+    # Include helplines only if high risk
+    helplines = HELPLINE_CATEGORIES.get(risk.get("category"), HELPLINE_CATEGORIES["general"])
+    output = {
+        "risk": risk,
+        "priority": "helpline" if risk.get("risk") == "high" else "normal",
+        "context": build_context(results)
+    }
+    if risk.get("risk") == "high":
+        output["helpline_results"] = helplines
+
+    return output
+
 def query_with_safety(query: str, top_k: int = 3) -> Dict:
     """
     Returns dict:
@@ -58,65 +343,232 @@ def query_with_safety(query: str, top_k: int = 3) -> Dict:
     """
     risk = analyze_risk(query)
     results = search_query(query, top_k=top_k)
-    context = build_context(results)
+    return _safety_output(risk, results)
 
-    # Include helplines only if high risk
-    helplines = HELPLINE_CATEGORIES.get(risk.get("category"), HELPLINE_CATEGORIES["general"])
-    output = {
-        "risk": risk,
-        "priority": "helpline" if risk.get("risk") == "high" else "normal",
-        "context": context
-    }
-    if risk.get("risk") == "high":
-        output["helpline_results"] = helplines
-
-    return output
+async def query_with_safety_async(query: str, top_k: int = 3) -> Dict:
+    """Async variant of query_with_safety; risk analysis and retrieval run concurrently"""
+    risk, results = await asyncio.gather(
+        run_blocking(analyze_risk, query),
+        search_query_async(query, top_k=top_k),
+    )
+    return _safety_output(risk, results)
 
 # -------------------------
 # LLM Generation
 # -------------------------
-def generate_response_with_llm(user_query: str, context: str) -> str:
+FALLBACK_RESPONSE = "Sorry, I am unable to generate a response right now. Please try again later."
+
+# Sent once per model as its system instruction rather than inlined in
+# every prompt; only the context and the query change between turns.
+SYSTEM_INSTRUCTION = (
+    "You are a compassionate, warm, and non-judgmental mental health assistant. "
+    "Speak like a calm, caring friend who listens first — not like a clinician.\n\n"
+
+    "Each message gives you context (helpful details or past conversation) and the user query.\n\n"
+
+    "Tone & style:\n"
+    "- Use gentle, plain language and a warm voice.\n"
+    "- Validate feelings (e.g. \"That sounds really hard\", \"I hear how much this hurts\").\n"
+    "- Keep sentences short and easy to read. Be human, not clinical.\n"
+    "- Be empathetic, patient, and respectful.\n\n"
+
+    "What to include (if relevant):\n"
+    "- Acknowledge & normalize the feeling briefly (don't minimize).\n"
+    "- Offer 1–2 practical coping suggestions (grounding, breathing, small steps).\n"
+    "- If the user is distressed, invite a next small step (\"Would you like to try a quick breathing exercise?\").\n"
+    "- Encourage reaching out to a trusted person or a professional, without giving medical diagnoses.\n"
+    "- If the user indicates self-harm or suicidal intent, be direct about safety: name that you are worried, ask if they are in immediate danger, and tell them to contact emergency services or a helpline. (Do NOT print phone numbers—the system will attach local helpline numbers.)\n\n"
+
+    "Formatting & brevity:\n"
+    "- Keep replies concise (aim for 2–6 short paragraphs).\n"
+    "- End with a gentle offer to continue the conversation (e.g. \"I’m here to listen — do you want to tell me more?\").\n\n"
+
+    "Safety guardrails:\n"
+    "- Never give medical or psychiatric diagnoses or attempt crisis triage beyond advising immediate help.\n"
+    "- Avoid giving prescriptive instructions that could cause harm.\n"
+    "- If uncertain, err on the side of urging the user to seek immediate help or call emergency services.\n\n"
+
+    "For each message, generate a single empathetic, supportive reply following the above guidelines."
+)
+
+def build_prompt(user_query: str, context: str, history: str = "") -> str:
+    # history: the session's summary and recent turns (backend/sessions.py)
+    return (
+        (f"Past conversation:\n{history}\n\n" if history else "")
+        + f"Context (helpful details or past conversation): {context}\n\n"
+        f"User query: {user_query}"
+    )
+
+def _log_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and usage.prompt_token_count:
+        logging.info(
+            f"[llm] input tokens={usage.prompt_token_count} "
+            f"cached={getattr(usage, 'cached_content_token_count', 0)} "
+            f"output tokens={usage.candidates_token_count}"
+        )
+
+# -------------------------
+# Response cache
+# -------------------------
+# Opt-in: replies for frequent low-risk queries are reused, skipping
+# generation and back-translation.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(6 * 3600)))
+# Distinct replies generated per key before the cache starts serving them
+RESPONSE_CACHE_VARIANTS = int(os.environ.get("RESPONSE_CACHE_VARIANTS", "3"))
+
+class ResponseCache:
+    """
+    Final replies (in the user's language) keyed by normalized English
+    query, a fingerprint of the retrieved context, and the reply language.
+    Each key holds a pool of up to `variants` replies: until the pool is
+    full every request still generates (adding a variant), after that a
+    random variant is served. Entries expire after ttl seconds, LRU
+    beyond max_entries. Callers must not use it for high-risk messages.
+    """
+    def __init__(self, max_entries: int = 5000, ttl: float = 6 * 3600, variants: int = 3):
+        self.variants = max(1, variants)
+        self.hits = 0
+        self.misses = 0
+        self._pools = TTLCache(max_entries, ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(english_query: str, context: str, lang: str) -> Tuple[str, str, str]:
+        fingerprint = hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+        return normalize_query(english_query), fingerprint, lang
+
+    def get(self, key) -> Optional[str]:
+        pool = self._pools.get(key, None)
+        if pool is None or len(pool) < self.variants:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return random.choice(pool)
+
+    def add(self, key, reply: str):
+        with self._lock:
+            pool = self._pools.get(key, ())
+            if reply not in pool and len(pool) < self.variants:
+                self._pools.set(key, pool + (reply,))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._pools),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self._pools.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+response_cache = (
+    ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_VARIANTS)
+    if RESPONSE_CACHE_ENABLED else None
+)
+
+def response_cache_stats() -> Dict:
+    return response_cache.stats() if response_cache is not None else {}
+
+def generate_response_with_llm(user_query: str, context: str, history: str = "") -> str:
     """
     Generate a compassionate response. Do NOT include phone numbers;
     backend will append helplines when needed.
     """
     try:
-        model = GenerativeModel("gemini-2.5-flash")
-
-        prompt = (
-        "You are a compassionate, warm, and non-judgmental mental health assistant. "
-        "Speak like a calm, caring friend who listens first — not like a clinician.\n\n"
-
-        f"Context (helpful details or past conversation): {context}\n\n"
-        f"User query: {user_query}\n\n"
-
-        "Tone & style:\n"
-        "- Use gentle, plain language and a warm voice.\n"
-        "- Validate feelings (e.g. \"That sounds really hard\", \"I hear how much this hurts\").\n"
-        "- Keep sentences short and easy to read. Be human, not clinical.\n"
-        "- Be empathetic, patient, and respectful.\n\n"
-
-        "What to include (if relevant):\n"
-        "- Acknowledge & normalize the feeling briefly (don't minimize).\n"
-        "- Offer 1–2 practical coping suggestions (grounding, breathing, small steps).\n"
-        "- If the user is distressed, invite a next small step (\"Would you like to try a quick breathing exercise?\").\n"
-        "- Encourage reaching out to a trusted person or a professional, without giving medical diagnoses.\n"
-        "- If the user indicates self-harm or suicidal intent, be direct about safety: name that you are worried, ask if they are in immediate danger, and tell them to contact emergency services or a helpline. (Do NOT print phone numbers—the system will attach local helpline numbers.)\n\n"
-
-        "Formatting & brevity:\n"
-        "- Keep replies concise (aim for 2–6 short paragraphs).\n"
-        "- End with a gentle offer to continue the conversation (e.g. \"I’m here to listen — do you want to tell me more?\").\n\n"
-
-        "Safety guardrails:\n"
-        "- Never give medical or psychiatric diagnoses or attempt crisis triage beyond advising immediate help.\n"
-        "- Avoid giving prescriptive instructions that could cause harm.\n"
-        "- If uncertain, err on the side of urging the user to seek immediate help or call emergency services.\n\n"
-
-        "Now generate a single empathetic, supportive reply following the above guidelines."
-    )
+        model = clients.get("gemini")
+        response = model.generate_content(build_prompt(user_query, context, history))
+        _log_usage(response)
+        return response.text.strip()
+    except Exception as e:
+        print("❌ LLM generation error:", e)
+        return FALLBACK_RESPONSE
 
-        response = model.generate_content(prompt)
+async def generate_response_with_llm_async(user_query: str, context: str, history: str = "") -> str:
+    """Async variant of generate_response_with_llm (generate_content_async)."""
+    try:
+        model = await clients.get_async("gemini")
+        prompt = build_prompt(user_query, context, history)
+        metrics.observe_payload("prompt", len(prompt.encode("utf-8")))
+        async with admission.slot("gemini"):
+            response = await model.generate_content_async(prompt)
+        _log_usage(response)
         return response.text.strip()
     except Exception as e:
         print("❌ LLM generation error:", e)
-        return "Sorry, I am unable to generate a response right now. Please try again later."
+        return FALLBACK_RESPONSE
+
+def generate_response_stream(user_query: str, context: str, history: str = "") -> Iterator[str]:
+    """Streaming variant of generate_response_with_llm; yields text deltas."""
+    sent = False
+    try:
+        model = clients.get("gemini")
+        chunk = None
+        for chunk in model.generate_content(build_prompt(user_query, context, history), stream=True):
+            text = chunk.text
+            if text:
+                sent = True
+                yield text
+        # usage arrives with the last chunk
+        _log_usage(chunk)
+    except Exception as e:
+        print("❌ LLM generation error:", e)
+        if not sent:
+            yield FALLBACK_RESPONSE
+
+async def generate_response_stream_async(user_query: str, context: str, history: str = "") -> AsyncIterator[str]:
+    """Async streaming variant (generate_content_async(..., stream=True))."""
+    sent = False
+    try:
+        model = await clients.get_async("gemini")
+        prompt = build_prompt(user_query, context, history)
+        metrics.observe_payload("prompt", len(prompt.encode("utf-8")))
+        async with admission.slot("gemini"):
+            stream = await model.generate_content_async(prompt, stream=True)
+            chunk = None
+            async for chunk in stream:
+                text = chunk.text
+                if text:
+                    sent = True
+                    yield text
+        _log_usage(chunk)
+    except Exception as e:
+        print("❌ LLM generation error:", e)
+        if not sent:
+            yield FALLBACK_RESPONSE
+
+# -------------------------
+# Conversation summaries
+# -------------------------
+SUMMARY_INSTRUCTION = (
+    "You keep running notes on a supportive conversation between a user and a "
+    "mental health assistant. Given the notes so far and the exchanges that "
+    "followed, write the updated notes: what the user is going through, how they "
+    "feel, what has been suggested and how they responded, and anything they asked "
+    "to be remembered. Plain prose, third person, no greetings, no advice of your own."
+)
+
+def build_summary_prompt(summary: str, turns: List[Tuple[str, str]], max_words: int) -> str:
+    exchanges = "\n".join(f"User: {user}\nAssistant: {reply}" for user, reply in turns)
+    return (
+        f"Notes so far: {summary or '(none)'}\n\n"
+        f"New exchanges:\n{exchanges}\n\n"
+        f"Updated notes, at most {max_words} words:"
+    )
+
+async def summarize_conversation_async(summary: str, turns: List[Tuple[str, str]], max_words: int) -> Optional[str]:
+    """
+    Folds (user, reply) turns into a conversation summary. None when
+    Gemini fails or is saturated; summaries are optional work, shed first.
+    """
+    try:
+        model = await clients.get_async("gemini_summary")
+        async with admission.slot("gemini", optional=True):
+            response = await model.generate_content_async(build_summary_prompt(summary, turns, max_words))
+        _log_usage(response)
+        return response.text.strip() or None
+    except Exception as e:
+        print("❌ Summary generation error:", e)
+        return None
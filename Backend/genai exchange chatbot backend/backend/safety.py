@@ -1,7 +1,17 @@
 import re
-from typing import Dict, List, Tuple
+import csv
+import json
+from typing import Dict, Iterator, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from collections import deque
 from difflib import SequenceMatcher
 import logging
+import unicodedata
+
+import numpy as np
+
+from backend import metrics
 
 # -------------------------
 # Helpline definitions (factually categorized)
@@ -71,6 +81,85 @@ ANXIETY_PHRASES = [
     "nervousness", "feeling overwhelmed at work", "anxious about exams"
 ]
 
+# -------------------------
+# Indic phrase lists (native script and romanized)
+# -------------------------
+# Checked on the user's own words, so the crisis check doesn't wait for (or
+# depend on) translation. These match as exact runs of words, the last of
+# them as a prefix, so a phrase ending in a verb stem ("खुद को मार",
+# "apni jaan le") covers its inflections ("मारना", "lena", "le lun"):
+# romanized Indic has too many one-letter pairs ("marna chahta" / "karna
+# chahta", want to die / want to do) for the fuzzy English matching, so
+# common spellings are listed instead. A romanized word that is also
+# English ("tension") is only listed inside a run of Indic words.
+INDIC_PHRASES = {
+    "suicidal": {
+        "hi": [
+            "आत्महत्या", "खुदकुशी", "ख़ुदकुशी", "मरना चाहता", "मरना चाहती", "मर जाना चाहता",
+            "मर जाना चाहती", "जीना नहीं चाहता", "जीना नहीं चाहती", "खुद को मार", "अपनी जान ले",
+            "ज़िंदगी खत्म कर", "मरने का मन",
+            "aatmahatya", "atmahatya", "khudkushi", "marna chahta", "marna chahti", "marna chahata",
+            "mar jaana chahta", "mar jana chahta", "mar jana chahti", "jeena nahi chahta",
+            "jeena nahi chahti", "jina nahi chahta", "jina nahi chahti", "khud ko maar",
+            "khud ko mar", "apni jaan le", "zindagi khatam kar", "jindagi khatam kar",
+            "marne ka mann", "marne ka man",
+        ],
+        "mr": [
+            "मरायचं आहे", "मरायचे आहे", "जगायचं नाही", "जगायचे नाही", "स्वतःला संपवून", "मरावंसं वाटतं",
+            "marayche aahe", "marayche ahe", "marayach aahe", "jagaycha nahi", "jagayche nahi",
+            "swatahla sampavun", "marava vatat", "marava asa vatat",
+        ],
+        "te": [
+            "ఆత్మహత్య", "చనిపోవాలి", "చనిపోవాలని", "చచ్చిపోవాలని", "బతకాలని లేదు", "బ్రతకాలని లేదు",
+            "చంపుకుంటా", "చంపుకుంటాను",
+            "aathmahatya", "chanipovali", "chanipovalani", "chachipovalani", "bathakalani ledu",
+            "brathakalani ledu", "champukunta", "champukuntanu",
+        ],
+        "ta": [
+            "தற்கொலை", "சாகணும்", "சாக வேண்டும்", "செத்துப் போகணும்", "வாழ விருப்பம் இல்லை", "வாழ பிடிக்கல",
+            "thatkolai", "tharkolai", "saaganum", "saganum", "sethu poganum", "vaazha pidikkala",
+            "vazha pidikala", "vaazha virupam illa",
+        ],
+        "kn": [
+            "ಆತ್ಮಹತ್ಯೆ", "ಸಾಯಬೇಕು", "ಸಾಯ್ಬೇಕು", "ಬದುಕಲು ಇಷ್ಟವಿಲ್ಲ",
+            "aatmahatye", "atmahatye", "saayabeku", "sayabeku", "saaybeku", "badukalu ishta illa",
+        ],
+        "ml": [
+            "ആത്മഹത്യ", "മരിക്കണം", "മരിക്കണമെന്ന്", "ജീവിക്കാൻ തോന്നുന്നില്ല",
+            "aathmahathya", "athmahathya", "marikkanam", "marikanam", "jeevikkan thonnunnilla",
+        ],
+        "bn": [
+            "আত্মহত্যা", "মরতে চাই", "মরে যেতে ইচ্ছে", "বাঁচতে চাই না",
+            "attohotta", "atmohotya", "morte chai", "morte ichhe", "more jete ichhe",
+            "bachte chai na", "banchte chai na",
+        ],
+    },
+    "depression": {
+        "hi": ["उदास", "अकेलापन", "अकेला महसूस", "कोई उम्मीद नहीं", "udaas", "udas", "akelapan",
+               "akela mehsoos", "koi umeed nahi", "dil nahi lagta"],
+        "mr": ["उदास वाटतं", "एकटं वाटतं", "udas vatat", "ekta vatat", "ekta vatta"],
+        "te": ["బాధగా ఉంది", "ఒంటరిగా", "మనసు బాలేదు", "badhaga undi", "baadhaga undi", "ontariga",
+               "manasu baledu"],
+        "ta": ["கஷ்டமா இருக்கு", "தனிமையா", "மனசு சரியில்ல", "kashtama irukku", "thanimaya",
+               "manasu sariyilla"],
+        "kn": ["ಬೇಜಾರಾಗಿದೆ", "ಒಬ್ಬಂಟಿ", "ಮನಸ್ಸು ಸರಿಯಿಲ್ಲ", "bejaragide", "bejar aagide", "obbanti",
+               "manassu sariyilla"],
+        "ml": ["വിഷമം", "ഒറ്റയ്ക്കാണ്", "മനസ്സ് ശരിയല്ല", "vishamam", "ottakkanu", "manassu sariyalla"],
+        "bn": ["মন খারাপ", "একা লাগছে", "কোনো আশা নেই", "mon kharap", "eka lagche", "kono asha nei"],
+    },
+    "anxiety": {
+        # "tension" alone is English too: only in a Hindi run of words
+        "hi": ["टेंशन", "घबराहट", "डर लग रहा", "bahut tension", "tension ho rahi", "tension ho raha",
+               "tension ho gayi", "ki tension", "ghabrahat", "darr lag raha", "dar lag raha"],
+        "mr": ["ताण", "भीती वाटते", "bhiti vatate", "bhiti vatat"],
+        "te": ["భయంగా ఉంది", "టెన్షన్", "bhayam ga undi", "bhayamga undi"],
+        "ta": ["பயமா இருக்கு", "டென்ஷன்", "bayama irukku", "bayamaa irukku"],
+        "kn": ["ಭಯ ಆಗ್ತಿದೆ", "ಟೆನ್ಷನ್", "bhaya aagtide", "bhaya agtide"],
+        "ml": ["പേടിയാവുന്നു", "ടെൻഷൻ", "pediyaavunnu", "pediyavunnu"],
+        "bn": ["ভয় লাগছে", "টেনশন", "bhoy lagche", "bhoy lagchhe"],
+    },
+}
+
 # -------------------------
 # Phrase -> category mapping
 # -------------------------
@@ -85,10 +174,17 @@ for phrase in ANXIETY_PHRASES:
 # -----------------------------
 # Utilities
 # -----------------------------
+# Indic vowel signs and viramas are not \w, but they belong to the word;
+# only the dandas (U+0964, U+0965) are punctuation
+_NON_WORD = r"[^\w\s\u0900-\u0963\u0966-\u0d7f]"
+_NON_WORD_OR_SEPARATOR = r"[^\w\s\u0900-\u0963\u0966-\u0d7f\x00]"
+
 def normalize_text(s: str) -> str:
-    s = s or ""
+    # NFC, so a nukta or vowel sign typed as a separate code point matches
+    # the precomposed form (and vice versa)
+    s = unicodedata.normalize("NFC", s or "")
     s = s.lower()
-    s = re.sub(r"[^\w\s]", " ", s)
+    s = re.sub(_NON_WORD, " ", s)
     s = re.sub(r"\s+", " ", s).strip()
     return s
 
@@ -97,69 +193,509 @@ def similarity(a: str, b: str) -> float:
         return 0.0
     return SequenceMatcher(None, a, b).ratio()
 
+# -----------------------------
+# Compiled phrase matcher
+# -----------------------------
+# Every phrase is compared against every word window of up to
+# phrase_len + 3 words (and the whole text), exactly like the original scan.
+# Instead of running SequenceMatcher on all of those pairs we:
+#   1. find exact hits with a word-level Aho-Corasick automaton (ratio 1.0),
+#   2. compute a character-count upper bound (difflib's quick_ratio) for all
+#      (window, phrase) pairs at once with NumPy, using prefix sums of
+#      per-word character counts so each window costs one subtraction, and
+#      one matrix product for the whole (windows x phrases) block,
+#   3. tighten the survivors' bound with a bit-parallel LCS length (matching
+#      blocks are a common subsequence, so LCS bounds them too),
+#   4. run SequenceMatcher only on pairs whose bound reaches the floor and
+#      beats the phrase's best score so far, highest bound first.
+# Neither bound underestimates SequenceMatcher.ratio(), so the scores and
+# threshold decisions are identical to the brute-force scan.
+WINDOW_SLACK = 3
+
+def window_features(t: str, words: List[str], columns: Dict[str, int], max_words: int):
+    """
+    Character counts (clipped to uint8) and lengths of the whole text (row 0)
+    and every word window a phrase could be compared against.
+    Returns (counts, lengths, starts, widths).
+    """
+    n = len(words)
+    space = columns.get(" ")
+    # Per-word character counts (t is normalized: single spaces between words)
+    cols = np.array([columns.get(ch, -1) for ch in t], dtype=np.int64)
+    word_of = np.cumsum(np.frombuffer(t.encode("utf-32-le"), dtype=np.uint32) == 32)
+    keep = cols >= 0
+    if space is not None:
+        keep &= cols != space
+    counts = np.zeros((n + 1, len(columns)), dtype=np.int32)
+    np.add.at(counts, (word_of[keep] + 1, cols[keep]), 1)
+    counts = counts.cumsum(axis=0)
+    lengths = np.zeros(n + 1, dtype=np.float64)
+    lengths[1:] = [len(word) for word in words]
+    lengths = lengths.cumsum()
+
+    widths = [n]
+    starts = [0]
+    for w in range(1, min(n, max_words + WINDOW_SLACK) + 1):
+        widths.extend([w] * (n - w + 1))
+        starts.extend(range(n - w + 1))
+    widths = np.array(widths)
+    starts = np.array(starts)
+    window_counts = counts[starts + widths] - counts[starts]
+    if space is not None:
+        window_counts[:, space] += widths - 1
+    window_lengths = lengths[starts + widths] - lengths[starts] + (widths - 1)
+    # Phrase counts are far below 255, so clipping never changes min(window, phrase)
+    return np.minimum(window_counts, 255).astype(np.uint8), window_lengths, starts, widths
+
+class PhraseMatcher:
+    """
+    stems=True makes exact_hits() match the last word of each phrase as a
+    prefix ("khud ko maar" hits "khud ko maarna"), for the Indic lists,
+    whose phrases end in verb stems.
+    """
+    def __init__(self, phrases: List[str], alphabet: str = None, stems: bool = False):
+        self.phrases = list(phrases)
+        self.stems = stems
+        self._norm = [normalize_text(p) for p in self.phrases]
+        unique = list(dict.fromkeys(p for p in self._norm if p))
+        self._unique = unique
+        self._matchers = []
+        self._lcs_masks = []
+        for p in unique:
+            m = SequenceMatcher(None)
+            m.set_seq2(p)
+            self._matchers.append(m)
+            masks = {}
+            for bit, ch in enumerate(p):
+                masks[ch] = masks.get(ch, 0) | (1 << bit)
+            self._lcs_masks.append(masks)
+
+        # Character-count profile of every phrase. Matchers sharing an alphabet
+        # can share one window_features() computation per text.
+        alphabet = sorted(set(alphabet if alphabet is not None else "".join(unique)) | set("".join(unique)))
+        self.columns = {ch: i for i, ch in enumerate(alphabet)}
+        profile = np.zeros((len(unique), len(alphabet)), dtype=np.uint8)
+        for row, p in enumerate(unique):
+            for ch in p:
+                profile[row, self.columns[ch]] += 1
+        # min(a, b) over small counts is sum_k [a >= k][b >= k], so the
+        # character-count bound for many windows is one matrix product of
+        # "count >= k" indicator columns
+        caps = profile.max(axis=0) if len(unique) else np.zeros(len(alphabet), dtype=np.uint8)
+        self._unary_cols = np.repeat(np.arange(len(alphabet)), caps)
+        self._unary_levels = np.concatenate([np.arange(1, c + 1) for c in caps] or [[]]).astype(np.uint8)
+        self._unary_profile = (profile[:, self._unary_cols] >= self._unary_levels).T.astype(np.float32)
+        self._lengths = np.array([len(p) for p in unique], dtype=np.float64)
+        self._words = np.array([len(p.split()) for p in unique], dtype=np.int32)
+        self.max_words = int(self._words.max()) if len(unique) else 1
+        self._build_automaton()
+
+    def _build_automaton(self):
+        # goto: list of {word: state}, fail: list of state, out: list of phrase
+        # ids; with stems, a phrase's last word is left out of goto and kept
+        # in stem_out: state -> {first letter: [(stem, phrase id)]}
+        goto, fail, out, stem_out = [{}], [0], [[]], [{}]
+        for idx, p in enumerate(self._unique):
+            state = 0
+            words = p.split()
+            for word in words[:-1] if self.stems else words:
+                nxt = goto[state].get(word)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][word] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                    stem_out.append({})
+                state = nxt
+            if self.stems:
+                stem_out[state].setdefault(words[-1][0], []).append((words[-1], idx))
+            else:
+                out[state].append(idx)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and word not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(word, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self._goto, self._fail, self._out, self._stem_out = goto, fail, out, stem_out
+
+    def exact_hits(self, words: List[str]) -> set:
+        """Indices of phrases that occur verbatim as a run of words (the last one a prefix, with stems)."""
+        goto, fail, out, stem_out = self._goto, self._fail, self._out, self._stem_out
+        hits = set()
+        state = 0
+        for word in words:
+            if self.stems:
+                # stems hanging off this state or any suffix of it
+                s = state
+                while True:
+                    for stem, idx in stem_out[s].get(word[0], ()):
+                        if word.startswith(stem):
+                            hits.add(idx)
+                    if not s:
+                        break
+                    s = fail[s]
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if out[state]:
+                hits.update(out[state])
+        return hits
+
+    def _lcs_length(self, idx: int, s: str) -> int:
+        """Length of the longest common subsequence of phrase idx and s (Hyyrö)."""
+        masks = self._lcs_masks[idx]
+        size = len(self._unique[idx])
+        full = (1 << size) - 1
+        v = full
+        for ch in s:
+            u = v & masks.get(ch, 0)
+            v = ((v + u) | (v - u)) & full
+        return size - v.bit_count()
+
+    def pair_bounds(self, counts, lengths, widths, floor: float):
+        """
+        Upper bound of the ratio for every (row, phrase) pair that reaches
+        floor. Rows are window_features() rows, possibly from many texts;
+        each row is compared only with phrases at least (width - WINDOW_SLACK)
+        words long, except whole-text rows (marked with width 0).
+        Returns (rows, phrase_ids, bounds).
+        """
+        unary = (counts[:, self._unary_cols] >= self._unary_levels).astype(np.float32)
+        common = (unary @ self._unary_profile).astype(np.float64)
+        bound = 2.0 * common / (lengths[:, None] + self._lengths[None, :])
+        eligible = self._words[None, :] + WINDOW_SLACK >= widths[:, None]
+        rows, phrase_ids = np.nonzero(eligible & (bound >= floor - 1e-9))
+        return rows, phrase_ids, bound[rows, phrase_ids]
+
+    def _verify(self, t, words, starts, widths, rows, phrase_ids, bounds, best, floor, stop_at, memo=None):
+        """
+        Runs the exact ratio on candidate pairs, highest bound first. memo
+        (shared across texts scored with the same floor) maps (string, phrase)
+        to its ratio, or to an LCS bound below floor.
+        """
+        unique = self._unique
+        order = np.argsort(-bounds, kind="stable")
+        strings = {}
+        seen = set()
+        for bound, row, idx in zip(bounds[order].tolist(), rows[order].tolist(), phrase_ids[order].tolist()):
+            if bound <= best[idx]:
+                continue
+            s = strings.get(row)
+            if s is None:
+                start = int(starts[row])
+                s = t if row == 0 else " ".join(words[start : start + int(widths[row])])
+                strings[row] = s
+            if (s, idx) in seen:
+                continue
+            seen.add((s, idx))
+            r = memo.get((s, idx)) if memo is not None else None
+            if r is None:
+                r = 2.0 * self._lcs_length(idx, s) / (len(s) + len(unique[idx]))
+                if r >= floor and r > best[idx]:
+                    m = self._matchers[idx]
+                    m.set_seq1(s)
+                    r = m.ratio()
+                elif memo is None or r >= floor:
+                    # only bounds below floor are safe to remember
+                    continue
+                if memo is not None:
+                    memo[(s, idx)] = r
+            if r < floor:
+                continue
+            if r > best[idx]:
+                best[idx] = r
+                if stop_at is not None and r >= stop_at:
+                    return True
+        return False
+
+    def scores(self, text: str, floor: float = 0.0, stop_at: float = None, features=None) -> Dict[str, float]:
+        """
+        Best similarity per normalized phrase, for every phrase scoring >= floor.
+        If stop_at is given, returns as soon as any phrase reaches it.
+        """
+        t = normalize_text(text)
+        words = t.split()
+        unique = self._unique
+        best = [0.0] * len(unique)
+        for idx in self.exact_hits(words):
+            best[idx] = 1.0
+            if stop_at is not None:
+                return {unique[idx]: 1.0}
+        if words:
+            counts, lengths, starts, widths = features or window_features(t, words, self.columns, self.max_words)
+            marked = widths.copy()
+            marked[0] = 0
+            rows, phrase_ids, bounds = self.pair_bounds(counts, lengths, marked, floor)
+            if self._verify(t, words, starts, widths, rows, phrase_ids, bounds, best, floor, stop_at):
+                return {unique[i]: r for i, r in enumerate(best) if r >= stop_at}
+        return {unique[i]: r for i, r in enumerate(best) if r >= floor}
+
+    def match(self, text: str, floor: float = 0.5) -> Tuple[List[Tuple[str, float]], float]:
+        """Same result as best_phrase_match(text, self.phrases)."""
+        found = self.scores(text)
+        best = max(found.values(), default=0.0)
+        matches = []
+        for phrase, p in zip(self.phrases, self._norm):
+            r = found.get(p, 0.0)
+            if r >= floor:
+                matches.append((phrase, r))
+        matches.sort(key=lambda x: x[1], reverse=True)
+        return matches, best
+
+    def reaches(self, text: str, threshold: float, features=None) -> bool:
+        """True if any phrase scores >= threshold (stops at the first one)."""
+        return bool(self.scores(text, floor=threshold, stop_at=threshold, features=features))
+
+# Built once at import over one shared alphabet; keys are the
+# PHRASE_CATEGORY_MAP categories
+PHRASE_ALPHABET = "".join(sorted(set(normalize_text(" ".join(PHRASE_CATEGORY_MAP)))))
+MAX_PHRASE_WORDS = max(len(normalize_text(p).split()) for p in PHRASE_CATEGORY_MAP)
+CATEGORY_MATCHERS = {
+    "suicidal": PhraseMatcher(SUICIDAL_PHRASES, PHRASE_ALPHABET),
+    "depression": PhraseMatcher(DEPRESSION_PHRASES, PHRASE_ALPHABET),
+    "anxiety": PhraseMatcher(ANXIETY_PHRASES, PHRASE_ALPHABET),
+}
+# Exact-only matchers for INDIC_PHRASES, last words as stems (only their word automaton is used)
+INDIC_MATCHERS = {
+    category: PhraseMatcher([p for phrases in by_lang.values() for p in phrases], stems=True)
+    for category, by_lang in INDIC_PHRASES.items()
+}
+_MATCHERS_BY_LIST = {
+    id(SUICIDAL_PHRASES): CATEGORY_MATCHERS["suicidal"],
+    id(DEPRESSION_PHRASES): CATEGORY_MATCHERS["depression"],
+    id(ANXIETY_PHRASES): CATEGORY_MATCHERS["anxiety"],
+}
+
 def best_phrase_match(text: str, phrase_list: List[str]) -> Tuple[List[Tuple[str, float]], float]:
-    t = normalize_text(text)
-    matches = []
-    best = 0.0
-    for phrase in phrase_list:
-        p = normalize_text(phrase)
-        r_whole = similarity(t, p)
-        t_words = t.split()
-        best_window = 0.0
-        phrase_len = max(1, len(p.split()))
-        max_window = min(len(t_words), phrase_len + 3)
-        for w in range(1, max_window + 1):
-            for i in range(len(t_words) - w + 1):
-                window = " ".join(t_words[i : i + w])
-                r = similarity(window, p)
-                if r > best_window:
-                    best_window = r
-        r = max(r_whole, best_window)
-        if r > best:
-            best = r
-        if r >= 0.5:
-            matches.append((phrase, r))
-    matches.sort(key=lambda x: x[1], reverse=True)
-    return matches, best
+    matcher = _MATCHERS_BY_LIST.get(id(phrase_list))
+    if matcher is None:
+        matcher = PhraseMatcher(phrase_list)
+    return matcher.match(text)
 
 # -----------------------------
 # Main risk analyzer
 # -----------------------------
-def analyze_risk(text: str) -> Dict:
-    t = normalize_text(text)
+HIGH_THRESHOLD = 0.75
+MID_THRESHOLD = 0.6
 
-    # Best match for each category
-    high_matches, best_high = best_phrase_match(t, SUICIDAL_PHRASES)
-    depression_matches, best_depression = best_phrase_match(t, DEPRESSION_PHRASES)
-    anxiety_matches, best_anxiety = best_phrase_match(t, ANXIETY_PHRASES)
-
-    HIGH_THRESHOLD = 0.75
-    MID_THRESHOLD = 0.6
-
-    risk = "none"
-    category = None
-
-    if best_high >= HIGH_THRESHOLD:
-        risk = "high"
-        category = "suicidal"
-    elif best_depression >= MID_THRESHOLD:
-        risk = "mild"
-        category = "depression"
-    elif best_anxiety >= MID_THRESHOLD:
-        risk = "mild"
-        category = "anxiety"
-    else:
-        risk = "none"
-        category = "general"
+# (category, risk, threshold) in the order they are checked
+RISK_LEVELS = [
+    ("suicidal", "high", HIGH_THRESHOLD),
+    ("depression", "mild", MID_THRESHOLD),
+    ("anxiety", "mild", MID_THRESHOLD),
+]
 
-    # Log internal matched phrases for devs
-    logging.info(f"[safety] text='{text}' risk='{risk}' category='{category}'")
+def classify_risk(text: str) -> Tuple[str, str]:
+    """Returns (risk, category) for already-normalized text."""
+    words = text.split()
+    features = window_features(text, words, CATEGORY_MATCHERS["suicidal"].columns, MAX_PHRASE_WORDS) if words else None
+    for category, risk, threshold in RISK_LEVELS:
+        if INDIC_MATCHERS[category].exact_hits(words) or CATEGORY_MATCHERS[category].reaches(text, threshold, features=features):
+            return risk, category
+    return "none", "general"
 
+def _risk_result(risk: str, category: str) -> Dict:
     # Select helplines based on category
     helplines = HELPLINE_CATEGORIES.get(category, HELPLINE_CATEGORIES["general"])
-
     return {
         "risk": risk,
         "category": category,
         "helpline_results": helplines
     }
+
+_SEVERITY = {risk: rank for rank, risk in enumerate(["none", "mild", "high"])}
+
+def more_severe(a: Dict, b: Dict) -> Dict:
+    """The analyze_risk result with the higher risk (a on a tie)."""
+    return b if _SEVERITY.get(b.get("risk"), 0) > _SEVERITY.get(a.get("risk"), 0) else a
+
+@metrics.timed("analyze_risk")
+def analyze_risk(text: str) -> Dict:
+    t = normalize_text(text)
+
+    risk, category = classify_risk(t)
+
+    # Log internal matched phrases for devs
+    logging.info(f"[safety] text='{text}' risk='{risk}' category='{category}'")
+
+    return _risk_result(risk, category)
+
+# -----------------------------
+# Batch risk analyzer
+# -----------------------------
+# Rows of window features scored against a matcher in one matrix product;
+# keeps the indicator matrix at a few MB.
+BATCH_ROWS = 4096
+# Below this many texts a process pool costs more than it saves
+PARALLEL_MIN_TEXTS = 2000
+
+_SEPARATOR = "\x00"
+
+def normalize_batch(texts: List[str]) -> List[str]:
+    """normalize_text for many texts with one pass of each regex."""
+    joined = _SEPARATOR.join((t or "").replace(_SEPARATOR, " ") for t in texts).lower()
+    joined = re.sub(_NON_WORD_OR_SEPARATOR, " ", joined)
+    joined = re.sub(r"\s+", " ", joined)
+    return [part.strip() for part in joined.split(_SEPARATOR)]
+
+def classify_batch(texts: List[str]) -> List[Tuple[str, str]]:
+    """
+    classify_risk for many texts. Window features of the whole batch are
+    stacked and scored against each category with one NumPy pass per
+    BATCH_ROWS rows; only the surviving pairs are verified per text.
+    """
+    normalized = normalize_batch(texts)
+    # Stored messages repeat a lot ("ok", "hi", "i am stressed"); score each once
+    unique = list(dict.fromkeys(normalized))
+    if len(unique) < len(normalized):
+        by_text = dict(zip(unique, classify_normalized(unique)))
+        return [by_text[t] for t in normalized]
+    return classify_normalized(normalized)
+
+def classify_normalized(normalized: List[str]) -> List[Tuple[str, str]]:
+    """classify_batch for texts that are already normalized."""
+    words = [t.split() for t in normalized]
+    decisions = [None] * len(normalized)
+    columns = CATEGORY_MATCHERS["suicidal"].columns
+    features = [window_features(t, w, columns, MAX_PHRASE_WORDS) if w else None
+                for t, w in zip(normalized, words)]
+
+    for category, risk, threshold in RISK_LEVELS:
+        matcher = CATEGORY_MATCHERS[category]
+        indic = INDIC_MATCHERS[category]
+        # Window/phrase pairs repeat a lot across messages; remember the
+        # verified score (or the LCS bound that ruled the pair out)
+        memo = {}
+        pending = []
+        for i, w in enumerate(words):
+            if decisions[i] is not None or features[i] is None:
+                continue
+            if matcher.exact_hits(w) or indic.exact_hits(w):
+                decisions[i] = (risk, category)
+            else:
+                pending.append(i)
+        # Score the pending texts' rows in chunks, then verify text by text
+        start = 0
+        while start < len(pending):
+            chunk, rows_in_chunk = [], 0
+            while start < len(pending) and (not chunk or rows_in_chunk + len(features[pending[start]][0]) <= BATCH_ROWS):
+                chunk.append(pending[start])
+                rows_in_chunk += len(features[pending[start]][0])
+                start += 1
+            counts = np.concatenate([features[i][0] for i in chunk])
+            lengths = np.concatenate([features[i][1] for i in chunk])
+            marked = np.concatenate([np.concatenate(([0], features[i][3][1:])) for i in chunk])
+            rows, phrase_ids, bounds = matcher.pair_bounds(counts, lengths, marked, threshold)
+            # np.nonzero returns rows in order, so each text's pairs are one slice
+            offsets = np.cumsum([0] + [len(features[i][0]) for i in chunk])
+            cuts = np.searchsorted(rows, offsets)
+            for k, i in enumerate(chunk):
+                lo, hi = cuts[k], cuts[k + 1]
+                if lo == hi:
+                    continue
+                best = [0.0] * len(matcher._unique)
+                if matcher._verify(normalized[i], words[i], features[i][2], features[i][3],
+                                   rows[lo:hi] - offsets[k], phrase_ids[lo:hi], bounds[lo:hi],
+                                   best, threshold, threshold, memo):
+                    decisions[i] = (risk, category)
+
+    return [d or ("none", "general") for d in decisions]
+
+def analyze_risk_batch(texts: List[str], processes: int = None, executor=None) -> List[Dict]:
+    """
+    analyze_risk for many messages; returns the same dicts in input order.
+    With processes > 1, batches of at least PARALLEL_MIN_TEXTS texts are split
+    across that many worker processes (executor reuses an existing pool).
+    """
+    texts = list(texts)
+    if processes and processes > 1 and len(texts) >= PARALLEL_MIN_TEXTS:
+        size = -(-len(texts) // processes)
+        chunks = [texts[i : i + size] for i in range(0, len(texts), size)]
+        if executor is not None:
+            decisions = [d for part in executor.map(classify_batch, chunks) for d in part]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                decisions = [d for part in pool.map(classify_batch, chunks) for d in part]
+    else:
+        decisions = classify_batch(texts)
+    logging.info(f"[safety] batch of {len(texts)} scored, {sum(d[0] == 'high' for d in decisions)} high risk")
+    return [_risk_result(risk, category) for risk, category in decisions]
+
+def _read_records(path: str, bad: Dict[str, int]) -> Iterator[Dict]:
+    """Records of the file; JSONL lines that aren't a JSON object are counted in bad."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    bad["invalid"] += 1
+                    continue
+                if not isinstance(record, dict):
+                    bad["not_object"] += 1
+                    continue
+                yield record
+
+def _record_text(record: Dict, text_field: str, bad: Dict[str, int]) -> str:
+    text = record.get(text_field)
+    if text is None or isinstance(text, str):
+        return text or ""
+    # a number or a nested value: scored as its JSON text
+    bad["not_string"] += 1
+    return json.dumps(text, ensure_ascii=False)
+
+def analyze_risk_stream(
+    input_path: str,
+    output_path: str,
+    text_field: str = "text",
+    id_field: str = "id",
+    batch_size: int = 5000,
+    processes: int = None,
+) -> int:
+    """
+    Scores a JSONL or CSV export (by extension) and writes one JSON line per
+    record: the analyze_risk dict, plus the record's id_field if present.
+    Records are read and written batch_size at a time, so memory stays flat
+    regardless of file size. JSONL lines that aren't a JSON object are
+    skipped, and a text_field that isn't a string is scored as its JSON
+    text; both are counted in the log. Returns the number of records scored.
+    """
+    executor = ProcessPoolExecutor(max_workers=processes) if processes and processes > 1 else None
+    total = 0
+    bad = {"invalid": 0, "not_object": 0, "not_string": 0}
+    try:
+        with open(output_path, "w", encoding="utf-8") as out:
+            records = _read_records(input_path, bad)
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                texts = [_record_text(r, text_field, bad) for r in batch]
+                results = analyze_risk_batch(texts, processes, executor)
+                for record, result in zip(batch, results):
+                    if id_field in record:
+                        result = {id_field: record[id_field], **result}
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                total += len(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if any(bad.values()):
+        logging.warning(
+            f"[safety] {input_path}: skipped {bad['invalid']} invalid JSON lines and "
+            f"{bad['not_object']} non-object records; scored {bad['not_string']} non-string texts as JSON"
+        )
+    return total
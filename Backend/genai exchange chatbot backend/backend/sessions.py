@@ -0,0 +1,448 @@
+# backend/sessions.py
+"""
+Server-side conversation memory, keyed by a session ID the client sends
+(any string of letters, digits, "-" and "_", e.g. a UUID):
+  - the last SESSION_TURNS turns are kept verbatim in a ring buffer,
+  - turns pushed out of it are folded into a rolling summary by Gemini,
+    SESSION_SUMMARY_BATCH at a time, in a background task at low
+    priority, so no reply waits for it,
+  - history() renders the summary and the newest turns within a fixed
+    token budget: the prompt stays the same size however long the
+    conversation runs, and the client sends only its new message,
+  - each session's memory is capped (SESSION_MAX_BYTES), sessions idle
+    for SESSION_IDLE_TTL are dropped, and at most SESSION_MAX_COUNT are
+    kept (least recently used first out),
+  - with SESSION_STORE_PATH set, every change is appended to a JSONL file
+    that is replayed (and compacted) at startup, so sessions survive a
+    restart without a database. Under serve.py the workers share the log:
+    each follows what the others append, so a conversation can move
+    between workers from one turn to the next.
+
+Turns are stored in English, as Gemini reads them, without the helpline
+block.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from backend import admission, metrics, rag
+from backend.context import estimate_tokens, truncate_to_tokens
+from backend.workers import run_blocking
+
+SESSION_TURNS = int(os.environ.get("SESSION_TURNS", "6"))
+# Prompt budget for the summary plus recent turns
+HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", "600"))
+SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", "200"))
+# Longest user message / reply kept per turn, and longest quoted in history
+TURN_TOKENS = int(os.environ.get("SESSION_TURN_TOKENS", "400"))
+HISTORY_TURN_TOKENS = int(os.environ.get("SESSION_HISTORY_TURN_TOKENS", "120"))
+MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", str(16 * 1024)))
+IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", str(2 * 3600)))
+MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "10000"))
+STORE_PATH = os.environ.get("SESSION_STORE_PATH", "")
+# Turns out of the ring buffer that are summarized together (one Gemini call)
+SUMMARY_BATCH = int(os.environ.get("SESSION_SUMMARY_BATCH", "3"))
+# Turns waiting for a summary beyond which they are folded in without Gemini
+PENDING_LIMIT = max(2 * SESSION_TURNS, 2 * SUMMARY_BATCH)
+# The log is rewritten once it holds this many times the live records
+COMPACT_FACTOR = 4
+COMPACT_MIN_RECORDS = 1000
+# Several worker processes append to the log (serve.py); it is then
+# followed, and compacted only at startup, before the workers fork
+SHARED_LOG = int(os.environ.get("SERVE_WORKERS", "1")) > 1
+
+HISTORY_SEPARATOR = "\n\n"
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+def valid_id(session_id: str) -> bool:
+    return bool(_VALID_ID.match(session_id or ""))
+
+class Turn:
+    __slots__ = ("seq", "user", "reply", "at")
+
+    def __init__(self, seq: int, user: str, reply: str, at: float):
+        self.seq = seq
+        self.user = user
+        self.reply = reply
+        self.at = at
+
+    def size(self) -> int:
+        return len(self.user.encode("utf-8")) + len(self.reply.encode("utf-8"))
+
+    def record(self, session_id: str) -> Dict:
+        return {"type": "turn", "session": session_id, "seq": self.seq,
+                "user": self.user, "reply": self.reply, "at": self.at}
+
+class Session:
+    __slots__ = ("id", "turns", "pending", "summary", "summarized", "next_seq", "last_seen", "summarizing")
+
+    def __init__(self, session_id: str, now: float):
+        self.id = session_id
+        self.turns: deque = deque(maxlen=SESSION_TURNS)
+        # turns out of the ring buffer, not yet in the summary
+        self.pending: List[Turn] = []
+        self.summary = ""
+        # seq of the last turn the summary covers
+        self.summarized = -1
+        self.next_seq = 0
+        self.last_seen = now
+        self.summarizing = False
+
+    def size(self) -> int:
+        return (len(self.summary.encode("utf-8"))
+                + sum(t.size() for t in self.turns) + sum(t.size() for t in self.pending))
+
+    def push(self, turn: Turn):
+        """Adds a turn; the oldest ones move to pending when the buffer or the memory cap is full."""
+        if len(self.turns) == self.turns.maxlen:
+            self.pending.append(self.turns[0])
+        self.turns.append(turn)
+        self.next_seq = max(self.next_seq, turn.seq + 1)
+        while len(self.turns) > 1 and self.size() > MAX_BYTES:
+            self.pending.append(self.turns.popleft())
+        if len(self.pending) > PENDING_LIMIT or (self.pending and self.size() > MAX_BYTES):
+            self.fold(None)
+
+    def fold(self, summary: Optional[str], through: Optional[int] = None):
+        """
+        Replaces the summary and drops the pending turns up to `through`.
+        summary=None folds them in without Gemini: the user's side of each,
+        appended to the old summary, which keeps its newest part.
+        """
+        through = self.pending[-1].seq if through is None and self.pending else through
+        if through is None:
+            return
+        folded = [t for t in self.pending if t.seq <= through]
+        self.pending = [t for t in self.pending if t.seq > through]
+        if summary is None:
+            lines = [self.summary] if self.summary else []
+            lines += ["The user said: " + truncate_to_tokens(t.user, 40) for t in folded]
+            summary = _keep_tail(" ".join(lines), SUMMARY_TOKENS)
+        self.summary = truncate_to_tokens(summary, SUMMARY_TOKENS)
+        self.summarized = max(self.summarized, through)
+
+    def history(self, max_tokens: int = HISTORY_TOKENS) -> str:
+        """
+        The summary and as many of the newest turns as fit in max_tokens
+        (pending ones included: they aren't in the summary yet).
+        """
+        parts = [truncate_to_tokens(f"Summary: {self.summary}", max_tokens)] if self.summary else []
+        budget = max_tokens - sum(estimate_tokens(p) for p in parts)
+        recent = []
+        for turn in reversed((*self.pending, *self.turns)):
+            text = (f"User: {truncate_to_tokens(turn.user, HISTORY_TURN_TOKENS)}\n"
+                    f"Assistant: {truncate_to_tokens(turn.reply, HISTORY_TURN_TOKENS)}")
+            # with the separator before it, if anything comes first
+            budget -= estimate_tokens(text) + (estimate_tokens(HISTORY_SEPARATOR) if parts or recent else 0)
+            if budget < 0:
+                break
+            recent.append(text)
+        return HISTORY_SEPARATOR.join(parts + recent[::-1])
+
+def _keep_tail(text: str, max_tokens: int) -> str:
+    """The last max_tokens of text, starting at a word."""
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    tail = text[-limit:]
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < limit // 4 else tail
+
+def _replay(replayed: Dict[str, list], record: Dict):
+    session_id, kind = record["session"], record["type"]
+    if kind == "drop":
+        replayed.pop(session_id, None)
+        return
+    state = replayed.setdefault(session_id, ["", -1, {}, 0.0])
+    if kind == "session":
+        state[0], state[1], state[3] = record["summary"], record["through"], record["last_seen"]
+        turns = [Turn(*fields) for fields in record["turns"]]
+    elif kind == "summary":
+        if record["through"] > state[1]:
+            state[0], state[1] = record["summary"], record["through"]
+        return
+    else:
+        turns = [Turn(record["seq"], record["user"], record["reply"], record["at"])]
+    for turn in turns:
+        state[2][turn.seq] = turn
+        state[3] = max(state[3], turn.at)
+
+# -------------------------
+# Store
+# -------------------------
+class SessionStore:
+    """
+    Sessions by ID, least recently used first. Used from the event loop
+    only; the log file is the one thing a worker thread touches, under
+    _log_lock. Idle expiry and the count cap are applied by every process
+    on its own, so only explicit ends are logged as drops.
+    """
+    def __init__(self, max_count: int = MAX_COUNT, idle_ttl: float = IDLE_TTL, path: str = "", shared: bool = False):
+        self.max_count = max_count
+        self.idle_ttl = idle_ttl
+        self.path = path
+        self.shared = shared and bool(path)
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._log = None
+        self._log_lock = threading.Lock()
+        self._log_records = 0
+        # how far into the shared log this process has read
+        self._offset = 0
+        # records appended while the log is being compacted
+        self._backlog: Optional[List[str]] = None
+        self.turns = 0
+        self.summaries = 0
+        self.summary_fallbacks = 0
+        self.evictions = 0
+        self.expired = 0
+        if path:
+            self._load()
+
+    def get(self, session_id: str) -> Session:
+        self._follow()
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id) or self._insert(session_id, now)
+        session.last_seen = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _insert(self, session_id: str, now: float) -> Session:
+        session = self._sessions[session_id] = Session(session_id, now)
+        while len(self._sessions) > self.max_count:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    def history(self, session_id: Optional[str]) -> str:
+        if not session_id:
+            return ""
+        self._follow()
+        self._expire(time.time())
+        session = self._sessions.get(session_id)
+        return session.history() if session is not None else ""
+
+    def record_turn(self, session_id: Optional[str], user: str, reply: str):
+        """Adds a finished turn; folding older turns into the summary happens in the background."""
+        if not session_id:
+            return
+        session = self.get(session_id)
+        turn = Turn(session.next_seq, truncate_to_tokens(user, TURN_TOKENS),
+                    truncate_to_tokens(reply, TURN_TOKENS), session.last_seen)
+        summarized = session.summarized
+        session.push(turn)
+        self.turns += 1
+        self._append(turn.record(session_id))
+        if session.summarized != summarized:
+            # pushed over a limit and folded without Gemini
+            self.summary_fallbacks += 1
+            self._append_summary(session)
+        if len(session.pending) >= SUMMARY_BATCH and not session.summarizing:
+            session.summarizing = True
+            asyncio.ensure_future(self._summarize(session))
+
+    async def _summarize(self, session: Session):
+        try:
+            # its own low-priority request: it never competes with replies,
+            # and is shed (left for the next turn) when Gemini is busy
+            admission.begin_request(admission.LOW, budget=None, upstreams=("gemini",))
+            while len(session.pending) >= SUMMARY_BATCH and self._sessions.get(session.id) is session:
+                batch = list(session.pending)
+                with metrics.span("summarize"):
+                    summary = await rag.summarize_conversation_async(
+                        session.summary, [(t.user, t.reply) for t in batch], SUMMARY_TOKENS * 3 // 4
+                    )
+                if summary is None:
+                    return
+                if session.summarized < batch[-1].seq:
+                    # (unless the memory cap folded them in meanwhile)
+                    session.fold(summary, batch[-1].seq)
+                    self.summaries += 1
+                    self._append_summary(session)
+        except admission.Rejected:
+            pass
+        except Exception as e:
+            logging.warning(f"[sessions] summary failed: {e!r}")
+        finally:
+            session.summarizing = False
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen < self.idle_ttl:
+                break
+            del self._sessions[session.id]
+            self.expired += 1
+
+    def end(self, session_id: str):
+        """Forgets a session (e.g. the user asked to start over)."""
+        self._follow()
+        if self._sessions.pop(session_id, None) is not None:
+            self._append({"type": "drop", "session": session_id})
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def _append_summary(self, session: Session):
+        self._append({"type": "summary", "session": session.id,
+                      "summary": session.summary, "through": session.summarized})
+
+    def _append(self, record: Dict):
+        if not self.path:
+            return
+        if self.shared:
+            # so this process can skip its own records when following
+            record["pid"] = os.getpid()
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._log_lock:
+            if self._backlog is not None:
+                self._backlog.append(line)
+            elif self._log is not None:
+                self._log.write(line)
+                self._log.flush()
+            self._log_records += 1
+            compact = (not self.shared and self._backlog is None
+                       and self._log_records > max(COMPACT_MIN_RECORDS, COMPACT_FACTOR * self._live_records()))
+            if compact:
+                self._backlog = []
+        if compact:
+            asyncio.ensure_future(run_blocking(self._compact, self._snapshot()))
+
+    def _live_records(self) -> int:
+        return sum(1 + len(s.turns) + len(s.pending) for s in self._sessions.values())
+
+    def _snapshot(self) -> List[Dict]:
+        # turns are never changed once added, so the worker thread can
+        # serialize these while the loop goes on
+        return [
+            {"type": "session", "session": s.id, "summary": s.summary, "through": s.summarized,
+             "last_seen": s.last_seen,
+             "turns": [(t.seq, t.user, t.reply, t.at) for t in (*s.pending, *s.turns)]}
+            for s in self._sessions.values()
+        ]
+
+    def _compact(self, snapshot: List[Dict]):
+        """Rewrites the log as one record per live session, plus what was appended meanwhile."""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for record in snapshot:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                with self._log_lock:
+                    f.writelines(self._backlog)
+                    f.flush()
+                    os.replace(tmp, self.path)
+                    if self._log is not None:
+                        self._log.close()
+                    self._log = open(self.path, "a", encoding="utf-8")
+                    self._log_records = len(snapshot) + len(self._backlog)
+                    self._backlog = None
+        except Exception as e:
+            logging.warning(f"[sessions] compacting {self.path} failed: {e!r}")
+            with self._log_lock:
+                if self._log is not None:
+                    self._log.writelines(self._backlog or [])
+                    self._log.flush()
+                self._backlog = None
+
+    def _load(self):
+        """Replays the log, then compacts it."""
+        # session id -> [summary, through, {seq: Turn}, last_seen]
+        replayed: Dict[str, list] = {}
+        records = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        _replay(replayed, json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # a line cut short by a crash mid-write
+                        continue
+                    records += 1
+        except FileNotFoundError:
+            pass
+        now = time.time()
+        live = [(sid, state) for sid, state in replayed.items() if now - state[3] < self.idle_ttl]
+        # oldest first, as get() keeps them
+        live.sort(key=lambda item: item[1][3])
+        for session_id, (summary, through, turns, last_seen) in live[-self.max_count:]:
+            session = Session(session_id, last_seen)
+            session.summary, session.summarized = summary, through
+            for turn in sorted(turns.values(), key=lambda t: t.seq):
+                session.push(turn)
+                session.pending = [t for t in session.pending if t.seq > session.summarized]
+            self._sessions[session_id] = session
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._backlog = []
+        self._compact(self._snapshot())
+        self._offset = os.path.getsize(self.path)
+        logging.info(f"[sessions] loaded {len(self._sessions)} sessions from {records} records in {self.path}")
+
+    def _follow(self):
+        """Applies the records other workers appended to the shared log since the last look."""
+        if not self.shared:
+            return
+        try:
+            size = os.stat(self.path).st_size
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # a line still being written is read next time
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        pid = os.getpid()
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+                if record.get("pid") != pid:
+                    self._apply(record)
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _apply(self, record: Dict):
+        session_id, kind = record["session"], record["type"]
+        session = self._sessions.get(session_id)
+        if kind == "drop":
+            self._sessions.pop(session_id, None)
+        elif kind == "turn":
+            session = session or self._insert(session_id, record["at"])
+            session.push(Turn(record["seq"], record["user"], record["reply"], record["at"]))
+            session.last_seen = max(session.last_seen, record["at"])
+            self._sessions.move_to_end(session_id)
+        elif kind == "summary" and session is not None and record["through"] > session.summarized:
+            session.summary, session.summarized = record["summary"], record["through"]
+            session.pending = [t for t in session.pending if t.seq > session.summarized]
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self._sessions),
+            "memory_bytes": sum(s.size() for s in self._sessions.values()),
+            "turns": self.turns,
+            "summaries": self.summaries,
+            "summary_fallbacks": self.summary_fallbacks,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "log_records": self._log_records,
+        }
+
+store = SessionStore(MAX_COUNT, IDLE_TTL, STORE_PATH, SHARED_LOG)
+
+def history(session_id: Optional[str]) -> str:
+    return store.history(session_id)
+
+def record_turn(session_id: Optional[str], user: str, reply: str):
+    store.record_turn(session_id, user, reply)
+
+def stats() -> Dict:
+    return store.stats()
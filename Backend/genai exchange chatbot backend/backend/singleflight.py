@@ -0,0 +1,124 @@
+# backend/singleflight.py
+"""
+Request coalescing for upstream calls. When several callers ask for the
+same thing at once (the helpline block's audio, retrieval for a trending
+phrase, the translated fallback text), the first one makes the call and
+the rest await its result instead of each going upstream:
+
+    flights = singleflight.group("tts", timeout=30)
+    audio = await flights.do(key, lambda: synthesize(...))
+
+The call runs as its own task, so a caller that gives up (timeout or
+cancellation) doesn't cancel it for the others; it is cancelled only when
+every caller has left. Its result, or its exception, goes to every caller.
+Only calls in flight are shared; repeats after it finishes are the caches'
+job.
+
+The task has its own admission context, made for everyone waiting on it:
+the highest priority and the latest deadline among them (a crisis turn
+joining a normal one's call raises it for the slots not yet taken), and
+the upstreams it couldn't use are reported to each caller as degraded.
+"""
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from backend import admission
+
+DEFAULT_TIMEOUT = float(os.environ.get("SINGLEFLIGHT_TIMEOUT", "30"))
+
+class _Flight:
+    __slots__ = ("task", "context", "waiters")
+
+    def __init__(self, fn: Callable[[], Awaitable[Any]], context: admission.RequestContext):
+        self.context = context
+        self.task = asyncio.ensure_future(self._run(fn))
+        self.waiters = 0
+
+    async def _run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        # the task's copy of the caller's contextvars; this doesn't touch the caller's
+        admission._request.set(self.context)
+        return await fn()
+
+class Group:
+    """Coalesces concurrent calls with equal keys."""
+    def __init__(self, name: str, timeout: Optional[float] = DEFAULT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Result of fn() for this key, shared with any caller already waiting
+        on the same key. timeout (default: the group's) bounds this
+        caller's wait and raises asyncio.TimeoutError.
+        """
+        self.calls += 1
+        caller = admission.current()
+        flight = self._flights.get(key)
+        if flight is None:
+            context = admission.RequestContext()
+            if caller is not None:
+                context.priority, context.deadline = caller.priority, caller.deadline
+            flight = _Flight(fn, context)
+            self._flights[key] = flight
+            self.upstream_calls += 1
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+        else:
+            self.coalesced += 1
+            if caller is not None:
+                flight.context.join(caller)
+            else:
+                flight.context.deadline = None
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if not flight.task.done():
+                self.timeouts += 1
+            raise
+        finally:
+            if caller is not None:
+                caller.degrade(flight.context.degraded)
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # nobody is left to use the result; a caller arriving before
+                # the cancellation lands must start a new call, not join this one
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def _finished(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.errors += 1
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+        }
+
+_groups: Dict[str, Group] = {}
+
+def group(name: str, timeout: Optional[float] = DEFAULT_TIMEOUT) -> Group:
+    """The named group, created on first use."""
+    if name not in _groups:
+        _groups[name] = Group(name, timeout)
+    return _groups[name]
+
+def stats() -> Dict:
+    return {name: g.stats() for name, g in _groups.items()}
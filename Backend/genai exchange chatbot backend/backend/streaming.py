@@ -0,0 +1,110 @@
+# backend/streaming.py
+import re
+import json
+import uuid
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+# A sentence ends at ., !, ?, the Devanagari danda (।) or a newline, followed
+# by whitespace. Gemini's chunks end mid-sentence, so text is buffered until
+# the boundary is actually seen.
+_SENTENCE_END = re.compile(r"(?<=[.!?।\n])\s+")
+
+class SentenceBuffer:
+    """
+    Accumulates streamed text and hands back complete sentences, each with
+    the whitespace that followed it, so joining them restores the text.
+    """
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._pending += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._pending):
+            # whitespace at the very end may continue in the next chunk
+            if match.end() == len(self._pending):
+                break
+            sentences.append(self._pending[start:match.end()])
+            start = match.end()
+        self._pending = self._pending[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest, self._pending = self._pending, ""
+        return [rest] if rest.strip() else []
+
+def split_sentences(text: str) -> List[str]:
+    buffer = SentenceBuffer()
+    return buffer.feed(text) + buffer.flush()
+
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Binary framing for voice replies. Every frame is
+#   1 byte kind | 4 byte big-endian payload length | payload
+# kind "J" carries a UTF-8 JSON event ({"event": ..., ...}), kind "A" one
+# segment of audio in the encoding named by the JSON events ("media_type";
+# MP3 unless the client asked otherwise). Audio frames arrive in playback
+# order.
+FRAME_JSON = b"J"
+FRAME_AUDIO = b"A"
+FRAMES_MEDIA_TYPE = "application/x-chat-frames"
+
+def frame_header(kind: bytes, length: int) -> bytes:
+    return kind + struct.pack(">I", length)
+
+def json_frame(event: str, data: dict) -> bytes:
+    payload = json.dumps({"event": event, **data}, ensure_ascii=False).encode("utf-8")
+    return frame_header(FRAME_JSON, len(payload)) + payload
+
+def audio_frame(audio: Union[bytes, memoryview]) -> Tuple[bytes, Union[bytes, memoryview]]:
+    """Header and payload separately, so cached audio isn't copied."""
+    return frame_header(FRAME_AUDIO, len(audio)), audio
+
+# -------------------------
+# Content negotiation
+# -------------------------
+MULTIPART_MEDIA_TYPE = "multipart/mixed"
+
+def parse_accept(header: Optional[str]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Media ranges of an Accept header with their parameters, most preferred
+    first (by q, then by position); ranges with q=0 are left out.
+    """
+    ranges = []
+    for position, item in enumerate((header or "").split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        values = {}
+        for param in params:
+            name, _, value = param.partition("=")
+            values[name.strip().lower()] = value.strip().strip('"')
+        try:
+            q = float(values.pop("q", "1"))
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            ranges.append((-q, position, media_type.lower(), values))
+    return [(media_type, values) for _, _, media_type, values in sorted(ranges)]
+
+def accepts(header: Optional[str], media_type: str) -> bool:
+    """Whether the client named media_type itself (wildcards don't count)."""
+    return any(m == media_type for m, _ in parse_accept(header))
+
+def multipart(parts: List[Tuple[str, Union[bytes, memoryview]]]) -> Tuple[bytes, str]:
+    """
+    A multipart/mixed body from (content type, payload) parts, and its
+    Content-Type. Payloads go in as raw bytes, without any encoding.
+    """
+    boundary = uuid.uuid4().hex
+    body = []
+    for content_type, payload in parts:
+        body.append(f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode())
+        body.append(bytes(payload))
+        body.append(b"\r\n")
+    body.append(f"--{boundary}--\r\n".encode())
+    return b"".join(body), f"{MULTIPART_MEDIA_TYPE}; boundary={boundary}"
@@ -1,30 +1,59 @@
 # stt.py - Final version with robust audio handling
-from google.cloud import speech
-from typing import Optional, Literal
+import os
+import asyncio
+from google.api_core import exceptions
+from typing import AsyncIterator, List, Optional, Literal, Tuple
+from backend import admission, clients, metrics
 
-_speech_client = speech.SpeechClient()
+# Set to host:port of a local fake speech server (python -m backend.fakes)
+# to run without Google credentials.
+EMULATOR_HOST = os.environ.get("SPEECH_EMULATOR_HOST")
+
+# google.cloud.speech is imported where it is used (and during startup
+# warm-up, by the client factories), not when this module is imported.
+def _make_client() -> "speech.SpeechClient":
+    from google.cloud import speech
+    if EMULATOR_HOST:
+        import grpc
+        from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+        return speech.SpeechClient(transport=SpeechGrpcTransport(channel=grpc.insecure_channel(EMULATOR_HOST)))
+    return speech.SpeechClient(credentials=clients.credentials())
+
+# The async client binds to the running event loop, so it is created on
+# first use from inside the loop rather than at import.
+def _make_async_client() -> "speech.SpeechAsyncClient":
+    from google.cloud import speech
+    if EMULATOR_HOST:
+        from grpc import aio
+        from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport
+        return speech.SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=aio.insecure_channel(EMULATOR_HOST)))
+    return speech.SpeechAsyncClient(credentials=clients.credentials())
+
+clients.register("speech", _make_client, warm=clients.grpc_channel_ready)
+clients.register("speech_async", _make_async_client, warm=clients.aio_channel_ready, on_loop=True)
 
 AudioEncodingLiteral = Literal[
-    'LINEAR16', 'OGG_OPUS', 'MP3', 'FLAC', 'MULAW', 'ALAW', 'AMR', 'AMR_WB'
+    'LINEAR16', 'OGG_OPUS', 'WEBM_OPUS', 'MP3', 'FLAC', 'MULAW', 'ALAW', 'AMR', 'AMR_WB'
 ]
 
-def speech_to_text_bytes(
-    audio_bytes: bytes, 
-    language_code: str = "en-IN", 
+# recognize only takes about a minute of audio; longer uploads go through
+# long_running_recognize, which takes inline content up to 10 MB.
+INLINE_MAX_BYTES = 10 * 1024 * 1024
+LONG_RUNNING_TIMEOUT = float(os.environ.get("STT_LONG_RUNNING_TIMEOUT", "300"))
+# streaming_recognize wants small requests (the API caps each at 25 KB)
+STREAM_CHUNK_BYTES = 16 * 1024
+
+def build_recognition_config(
+    language_code: str = "en-IN",
     sample_rate_hertz: int = None,
     encoding: Optional[AudioEncodingLiteral] = None,
-) -> Optional[str]:
+    audio_channel_count: Optional[int] = None,
+) -> "speech.RecognitionConfig":
     """
-    Accepts raw audio bytes and converts to transcript string. This version
-    has special handling for OGG_OPUS audio from web browsers.
+    Builds the RecognitionConfig for an upload. This version has special
+    handling for OGG_OPUS audio from web browsers.
     """
-    if not audio_bytes:
-        return None
-
-    audio = speech.RecognitionAudio(content=audio_bytes)
-    
-    config = None
-
+    from google.cloud import speech
     # --- THE FINAL FIX ---
     # For OGG_OPUS audio, the API requires a specific, minimal configuration.
     # We must provide the sample rate, but let the API infer other details.
@@ -36,36 +65,185 @@ def speech_to_text_bytes(
             model="default",
             enable_automatic_punctuation=True,
         )
-    else:
-        # Fallback for other potential audio formats
-        stt_encoding = speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED
-        if encoding:
-            try:
-                stt_encoding = getattr(speech.RecognitionConfig.AudioEncoding, encoding.upper())
-            except AttributeError:
-                print(f"Warning: Invalid encoding '{encoding}' provided.")
-        
-        config_params = {
-            "language_code": language_code,
-            "model": "default", 
-            "enable_automatic_punctuation": True,
-        }
-        if stt_encoding != speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED:
-            config_params["encoding"] = stt_encoding
-        if sample_rate_hertz:
-            config_params["sample_rate_hertz"] = sample_rate_hertz
-        config = speech.RecognitionConfig(**config_params)
+        if audio_channel_count and audio_channel_count > 1:
+            config.audio_channel_count = audio_channel_count
+        return config
+
+    # Fallback for other potential audio formats
+    stt_encoding = speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED
+    if encoding:
+        try:
+            stt_encoding = getattr(speech.RecognitionConfig.AudioEncoding, encoding.upper())
+        except AttributeError:
+            print(f"Warning: Invalid encoding '{encoding}' provided.")
+
+    config_params = {
+        "language_code": language_code,
+        "model": "default", 
+        "enable_automatic_punctuation": True,
+    }
+    if stt_encoding != speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED:
+        config_params["encoding"] = stt_encoding
+    if sample_rate_hertz:
+        config_params["sample_rate_hertz"] = sample_rate_hertz
+    # Only the first channel is recognized unless the API is told there are more
+    if audio_channel_count and audio_channel_count > 1:
+        config_params["audio_channel_count"] = audio_channel_count
+    return speech.RecognitionConfig(**config_params)
     # --- END OF FIX ---
 
+def _join_transcripts(response) -> str:
+    transcripts = [result.alternatives[0].transcript for result in response.results if result.alternatives]
+    return " ".join(transcripts).strip()
+
+def _too_long(error: Exception) -> bool:
+    # "Sync input too long. For audio longer than 1 min use LongRunningRecognize..."
+    return isinstance(error, exceptions.InvalidArgument) and "too long" in str(error).lower()
+
+def speech_to_text_bytes(
+    audio_bytes: bytes, 
+    language_code: str = "en-IN", 
+    sample_rate_hertz: int = None,
+    encoding: Optional[AudioEncodingLiteral] = None,
+) -> Optional[str]:
+    """
+    Accepts raw audio bytes and converts to transcript string.
+    """
+    if not audio_bytes:
+        return None
+    if len(audio_bytes) > INLINE_MAX_BYTES:
+        print(f"STT error: audio is {len(audio_bytes)} bytes, over the {INLINE_MAX_BYTES} byte inline limit")
+        return None
+
+    from google.cloud import speech
+    audio = speech.RecognitionAudio(content=audio_bytes)
+    config = build_recognition_config(language_code, sample_rate_hertz, encoding)
+    client = clients.get("speech")
+
     try:
-        response = _speech_client.recognize(config=config, audio=audio) 
-        
-        transcripts = [result.alternatives[0].transcript for result in response.results]
-            
-        return " ".join(transcripts).strip()
+        try:
+            response = client.recognize(config=config, audio=audio) 
+        except exceptions.InvalidArgument as e:
+            if not _too_long(e):
+                raise
+            operation = client.long_running_recognize(config=config, audio=audio)
+            response = operation.result(timeout=LONG_RUNNING_TIMEOUT)
+        return _join_transcripts(response)
         
     except Exception as e:
         # This will now print the specific error message from the Google API
         print(f"STT API Error: {e}")
         return None
 
+async def speech_to_text_bytes_async(
+    audio_bytes: bytes,
+    language_code: str = "en-IN",
+    sample_rate_hertz: int = None,
+    encoding: Optional[AudioEncodingLiteral] = None,
+    audio_channel_count: Optional[int] = None,
+) -> Optional[str]:
+    """Async variant of speech_to_text_bytes using SpeechAsyncClient."""
+    if not audio_bytes:
+        return None
+    if len(audio_bytes) > INLINE_MAX_BYTES:
+        print(f"STT error: audio is {len(audio_bytes)} bytes, over the {INLINE_MAX_BYTES} byte inline limit")
+        return None
+
+    metrics.observe_payload("stt_audio", len(audio_bytes))
+    from google.cloud import speech
+    audio = speech.RecognitionAudio(content=audio_bytes)
+    config = build_recognition_config(language_code, sample_rate_hertz, encoding, audio_channel_count)
+    client = clients.get("speech_async")
+
+    try:
+        async with admission.slot("stt"):
+            try:
+                response = await client.recognize(config=config, audio=audio)
+            except exceptions.InvalidArgument as e:
+                if not _too_long(e):
+                    raise
+                operation = await client.long_running_recognize(config=config, audio=audio)
+                response = await operation.result(timeout=LONG_RUNNING_TIMEOUT)
+        return _join_transcripts(response)
+    except admission.Rejected:
+        # not a transcription failure: the caller answers 429
+        raise
+    except Exception as e:
+        print(f"STT API Error: {e}")
+        return None
+
+async def speech_to_text_segments_async(
+    segments: List[bytes],
+    language_code: str = "en-IN",
+    sample_rate_hertz: int = None,
+    encoding: Optional[AudioEncodingLiteral] = None,
+    audio_channel_count: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Transcribes consecutive segments of one recording (see
+    backend/audio.py) concurrently and joins them in order. Segments that
+    fail are left out; None if all of them do.
+    """
+    transcripts = await asyncio.gather(*(
+        speech_to_text_bytes_async(segment, language_code, sample_rate_hertz, encoding, audio_channel_count)
+        for segment in segments
+    ))
+    transcripts = [t for t in transcripts if t]
+    return " ".join(transcripts) if transcripts else None
+
+# -------------------------
+# Streaming recognition
+# -------------------------
+def build_streaming_config(
+    language_code: str = "en-IN",
+    sample_rate_hertz: int = None,
+    encoding: Optional[AudioEncodingLiteral] = None,
+    single_utterance: bool = False,
+) -> "speech.StreamingRecognitionConfig":
+    from google.cloud import speech
+    return speech.StreamingRecognitionConfig(
+        config=build_recognition_config(language_code, sample_rate_hertz, encoding),
+        interim_results=True,
+        single_utterance=single_utterance,
+    )
+
+async def _stream_requests(
+    config: "speech.StreamingRecognitionConfig", chunks: AsyncIterator[bytes]
+) -> AsyncIterator["speech.StreamingRecognizeRequest"]:
+    from google.cloud import speech
+    # The first request carries only the config, the rest only audio
+    yield speech.StreamingRecognizeRequest(streaming_config=config)
+    async for chunk in chunks:
+        for start in range(0, len(chunk), STREAM_CHUNK_BYTES):
+            yield speech.StreamingRecognizeRequest(audio_content=chunk[start:start + STREAM_CHUNK_BYTES])
+
+async def stream_speech_to_text(
+    chunks: AsyncIterator[bytes],
+    language_code: str = "en-IN",
+    sample_rate_hertz: int = None,
+    encoding: Optional[AudioEncodingLiteral] = None,
+    single_utterance: bool = False,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Sends audio to streaming_recognize as it arrives and yields
+    ("interim", text) while the user is still speaking, then one
+    ("final", transcript) when the audio ends (or, with single_utterance,
+    when the speaker stops). Interim text includes the finalized part so
+    far. A stream is limited to about five minutes of audio.
+    """
+    config = build_streaming_config(language_code, sample_rate_hertz, encoding, single_utterance)
+    finals = []
+    async with admission.slot("stt_stream"):
+        responses = await clients.get("speech_async").streaming_recognize(requests=_stream_requests(config, chunks))
+        async for response in responses:
+            interim = []
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                if result.is_final:
+                    finals.append(result.alternatives[0].transcript.strip())
+                else:
+                    interim.append(result.alternatives[0].transcript.strip())
+            if interim:
+                yield "interim", " ".join(finals + interim)
+    yield "final", " ".join(finals).strip()
@@ -1,6 +1,17 @@
-from google.cloud import translate_v2 as translate
+import os
+import threading
+from typing import Dict, List, Optional
 
-_translate_client = translate.Client()
+from backend import admission, clients, langid, singleflight
+from backend.cache import TieredCache, MISSING, shared_cache
+from backend.workers import run_blocking
+
+def _make_client():
+    from google.cloud import translate_v2 as translate
+    return translate.Client(credentials=clients.credentials())
+
+# Translate v2 is plain HTTPS, so there is no channel to pre-open
+clients.register("translate", _make_client)
 
 # Map language codes from detection → supported by API
 LANG_CODE_FIX = {
@@ -13,35 +24,227 @@ LANG_CODE_FIX = {
     "mr-Latn": "mr",  # Marathi
 }
 
+CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "20000"))
+CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", str(24 * 3600)))
+# Identify languages locally (backend/langid.py) and only ask the API when unsure
+LOCAL_LANGID = os.environ.get("LOCAL_LANGID", "1") != "0"
+# Longest a caller waits on a Translate call, its own or one it shares
+CALL_TIMEOUT = float(os.environ.get("TRANSLATION_CALL_TIMEOUT", "15"))
+
 def normalize_lang_code(code: str) -> str:
     return LANG_CODE_FIX.get(code, code)
 
+def _cache_text(text: str) -> str:
+    # Whitespace differences don't change a detection or a translation
+    return " ".join(text.split())
+
+class TranslationService:
+    """
+    Cloud Translation with caching:
+      - detections and translations are kept in LRU+TTL caches keyed by
+        normalized text (and language pair), backed by the node-wide cache
+        when there is one (several workers, see serve.py),
+      - a source language the caller already knows is reused instead of
+        detected again,
+      - detection is local when backend/langid.py is confident,
+      - translate_batch sends all uncached segments in one translate call.
+    """
+    def __init__(self, client=None, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL, local_langid: bool = LOCAL_LANGID):
+        self._client = client
+        self.local_langid = local_langid
+        self.local_detections = 0
+        self.detections = TieredCache("detect", max_entries, ttl, shared_cache())
+        self.translations = TieredCache("translate", max_entries, ttl, shared_cache())
+        self.api_calls = {"detect": 0, "translate": 0}
+        self.source_reused = 0
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # without an explicit client, use the shared one from the registry
+        return self._client if self._client is not None else clients.get("translate")
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.api_calls[kind] += 1
+
+    def detect_local(self, text: str) -> Optional[str]:
+        """Language from backend/langid.py, or None when it isn't confident (or is off)."""
+        if not self.local_langid:
+            return None
+        lang = langid.detect(text)
+        if lang is not None:
+            with self._lock:
+                self.local_detections += 1
+        return lang
+
+    def detect_language(self, text: str) -> str:
+        if not text:
+            return "en"
+        lang = self.detect_local(text)
+        return lang if lang is not None else self.detect_remote(text)
+
+    def detect_remote(self, text: str) -> str:
+        """Detection by the Cloud Translation API (cached)."""
+        key = _cache_text(text)
+        lang = self.detections.get(key)
+        if lang is MISSING:
+            self._count("detect")
+            result = self.client.detect_language(text)
+            lang = normalize_lang_code(result.get("language", "en"))
+            self.detections.set(key, lang)
+        return lang
+
+    def translate(self, text: str, target_language: str, source_language: Optional[str] = None) -> str:
+        if not text:
+            return text
+        target = normalize_lang_code(target_language)
+        if source_language:
+            with self._lock:
+                self.source_reused += 1
+            src = normalize_lang_code(source_language)
+        else:
+            src = self.detect_language(text)
+        if src == target:
+            return text
+        key = (_cache_text(text), src, target)
+        cached = self.translations.get(key)
+        if cached is not MISSING:
+            return cached
+        self._count("translate")
+        res = self.client.translate(text, target_language=target, source_language=src)
+        translated = res.get("translatedText", text)
+        self.translations.set(key, translated)
+        # The translation's own language is known now; save a later detect call
+        self.detections.set(_cache_text(translated), target)
+        return translated
+
+    def cached_detection(self, text: str):
+        """detect_remote()'s answer if it is in this process's cache, else MISSING."""
+        return self.detections.peek(_cache_text(text))
+
+    def cached_translation(self, text: str, target_language: str, source_language: Optional[str] = None):
+        """translate()'s result if it needs no API call (cached in this process), else MISSING."""
+        if not text:
+            return text
+        target = normalize_lang_code(target_language)
+        src = normalize_lang_code(source_language) if source_language else self.detections.peek(_cache_text(text))
+        if src is MISSING:
+            return MISSING
+        result = text if src == target else self.translations.peek((_cache_text(text), src, target))
+        if result is not MISSING and source_language:
+            with self._lock:
+                self.source_reused += 1
+        return result
+
+    def translate_batch(self, texts: List[str], target_language: str, source_language: Optional[str] = None) -> List[str]:
+        """
+        Translates many segments with at most one translate call. Without a
+        source language the API detects each segment's language itself.
+        """
+        target = normalize_lang_code(target_language)
+        src = normalize_lang_code(source_language) if source_language else None
+        out = list(texts)
+        todo = {}
+        for i, text in enumerate(texts):
+            if not text or src == target:
+                continue
+            cached = self.translations.get((_cache_text(text), src, target)) if src else MISSING
+            if cached is MISSING:
+                todo.setdefault(text, []).append(i)
+            else:
+                out[i] = cached
+        if not todo:
+            return out
+        segments = list(todo)
+        self._count("translate")
+        results = self.client.translate(segments, target_language=target, source_language=src)
+        for text, res in zip(segments, results):
+            translated = res.get("translatedText", text)
+            detected = normalize_lang_code(res.get("detectedSourceLanguage") or src or "")
+            if detected:
+                self.detections.set(_cache_text(text), detected)
+                if detected == target:
+                    translated = text
+                self.translations.set((_cache_text(text), detected, target), translated)
+            for i in todo[text]:
+                out[i] = translated
+        return out
+
+    def stats(self) -> Dict:
+        return {
+            "detect_cache": self.detections.stats(),
+            "translate_cache": self.translations.stats(),
+            "api_calls": dict(self.api_calls),
+            "source_reused": self.source_reused,
+            "local_detections": self.local_detections,
+        }
+
+_service = TranslationService()
+
+def get_service() -> TranslationService:
+    return _service
+
 def detect_language(text: str) -> str:
-    if not text:
-        return "en"
-    result = _translate_client.detect_language(text)
-    lang = result.get("language", "en")
-    return normalize_lang_code(lang)
-
-def translate_to(text: str, target_language: str = "en") -> str:
-    if not text:
-        return text
-    src = detect_language(text)
-    if src == target_language:
-        return text
-    res = _translate_client.translate(
-        text,
-        target_language=normalize_lang_code(target_language),
-        source_language=src
-    )
-    return res.get("translatedText", text)
+    return _service.detect_language(text)
+
+def translate_to(text: str, target_language: str = "en", source_language: Optional[str] = None) -> str:
+    return _service.translate(text, target_language, source_language)
 
 def translate_from(text: str, source_language: str, target_language: str) -> str:
-    if not text:
-        return text
-    res = _translate_client.translate(
-        text,
-        target_language=normalize_lang_code(target_language),
-        source_language=normalize_lang_code(source_language)
-    )
-    return res.get("translatedText", text)
+    return _service.translate(text, target_language, source_language)
+
+def translate_batch(texts: List[str], target_language: str, source_language: Optional[str] = None) -> List[str]:
+    return _service.translate_batch(texts, target_language, source_language)
+
+def stats() -> Dict:
+    return _service.stats()
+
+# Translate v2 has no async client, so the async variants run the blocking
+# calls on the backend thread pool. Identical calls in flight at the same
+# time share one.
+_flights = singleflight.group("translate", CALL_TIMEOUT)
+
+# Cache hits are answered on the event loop, before the admission slot and
+# the thread hop: only calls that go upstream count against its concurrency.
+async def _call(key, fn, *args):
+    async def call():
+        async with admission.slot("translate"):
+            return await run_blocking(fn, *args)
+    return await _flights.do(key, call)
+
+async def detect_language_async(text: str) -> str:
+    # local identification takes microseconds; no need for a worker thread
+    lang = _service.detect_local(text) if text else "en"
+    if lang is not None:
+        return lang
+    lang = _service.cached_detection(text)
+    if lang is not MISSING:
+        return lang
+    return await _call(("detect", text), _service.detect_remote, text)
+
+async def translate_to_async(text: str, target_language: str = "en", source_language: Optional[str] = None) -> str:
+    cached = _service.cached_translation(text, target_language, source_language)
+    if cached is not MISSING:
+        return cached
+    return await _call(("to", text, target_language, source_language), translate_to, text, target_language, source_language)
+
+async def translate_from_async(text: str, source_language: str, target_language: str) -> str:
+    cached = _service.cached_translation(text, target_language, source_language)
+    if cached is not MISSING:
+        return cached
+    return await _call(("from", text, source_language, target_language), translate_from, text, source_language, target_language)
+
+async def translate_batch_async(texts: List[str], target_language: str, source_language: Optional[str] = None) -> List[str]:
+    if source_language:
+        cached = [_service.cached_translation(text, target_language, source_language) for text in texts]
+        if MISSING not in cached:
+            return cached
+    result = await _call(("batch", tuple(texts), target_language, source_language),
+                         translate_batch, texts, target_language, source_language)
+    # every caller gets its own list
+    return list(result)
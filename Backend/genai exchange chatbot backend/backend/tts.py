@@ -1,14 +1,114 @@
-from google.cloud import texttospeech
+import os
+import json
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
 
-_tts_client = texttospeech.TextToSpeechClient()
+from backend import admission, clients, metrics, singleflight
+from backend.streaming import parse_accept
+from backend.workers import run_blocking
 
-def synthesize_text(text: str, language_code: str = "en-IN", voice_name: str = None) -> bytes:
+# google.cloud.texttospeech is imported where it is used (and during
+# startup warm-up, by the client factories), not when this module is imported.
+def _make_client():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient(credentials=clients.credentials())
+
+def _make_async_client():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechAsyncClient(credentials=clients.credentials())
+
+clients.register("tts", _make_client, warm=clients.grpc_channel_ready)
+# The async client binds to the running event loop, so it is built on it
+clients.register("tts_async", _make_async_client, warm=clients.aio_channel_ready, on_loop=True)
+
+# Audio returned by the cache: bytes from the memory tier, or a read-only
+# memoryview over a memory-mapped file from the disk tier. Both can be sent
+# as a response body as-is.
+AudioBuffer = Union[bytes, memoryview]
+
+CACHE_ENABLED = os.environ.get("TTS_CACHE_ENABLED", "1") != "0"
+CACHE_MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+CACHE_DISK_BYTES = int(os.environ.get("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "/tmp/tts_cache")
+# Longest a caller waits on a synthesis, its own or one it shares
+SYNTHESIS_TIMEOUT = float(os.environ.get("TTS_SYNTHESIS_TIMEOUT", "30"))
+# Disk hits keep their mapping open so repeat hits don't re-open the file
+OPEN_MAPS = 256
+
+# -------------------------
+# Output formats
+# -------------------------
+# Encodings clients can ask for, and the media type of what Cloud TTS
+# returns for each (LINEAR16 comes back as a WAV file)
+MEDIA_TYPES = {"OGG_OPUS": "audio/ogg; codecs=opus", "MP3": "audio/mpeg", "LINEAR16": "audio/wav"}
+ACCEPTED_TYPES = {
+    "audio/ogg": "OGG_OPUS", "audio/opus": "OGG_OPUS",
+    "audio/mpeg": "MP3", "audio/mp3": "MP3",
+    "audio/wav": "LINEAR16", "audio/wave": "LINEAR16", "audio/x-wav": "LINEAR16", "audio/l16": "LINEAR16",
+}
+# Cloud TTS has no bitrate setting; the output sample rate is what sizes the
+# audio, so that is what clients choose (Opus only encodes these rates)
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+MIN_SAMPLE_RATE, MAX_SAMPLE_RATE = 8000, 48000
+DEFAULT_ENCODING = os.environ.get("TTS_AUDIO_ENCODING", "MP3")
+DEFAULT_SAMPLE_RATE = int(os.environ.get("TTS_SAMPLE_RATE_HERTZ", "0")) or None
+
+class AudioFormat:
+    """Encoding and (optional) sample rate of synthesized audio."""
+    __slots__ = ("encoding", "sample_rate_hertz")
+
+    def __init__(self, encoding: str = "MP3", sample_rate_hertz: Optional[int] = None):
+        if encoding not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported output encoding: {encoding}")
+        if sample_rate_hertz:
+            sample_rate_hertz = min(MAX_SAMPLE_RATE, max(MIN_SAMPLE_RATE, int(sample_rate_hertz)))
+            if encoding == "OGG_OPUS":
+                sample_rate_hertz = min(OPUS_SAMPLE_RATES, key=lambda rate: abs(rate - sample_rate_hertz))
+        self.encoding = encoding
+        self.sample_rate_hertz = sample_rate_hertz or None
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.encoding]
+
+    def params(self) -> dict:
+        params = {"audio_encoding": self.encoding}
+        if self.sample_rate_hertz:
+            params["sample_rate_hertz"] = self.sample_rate_hertz
+        return params
+
+DEFAULT_FORMAT = AudioFormat(DEFAULT_ENCODING, DEFAULT_SAMPLE_RATE)
+
+def negotiate_format(accept: Optional[str]) -> AudioFormat:
     """
-    Returns MP3 bytes for the given text.
+    The client's most preferred audio type in an Accept header, e.g.
+    "audio/ogg; codecs=opus; rate=16000, audio/mpeg;q=0.5". rate picks the
+    sample rate. Without a supported audio type (or with only audio/* or
+    */*), DEFAULT_FORMAT.
     """
-    if not text:
-        return b""
+    for media_type, params in parse_accept(accept):
+        encoding = ACCEPTED_TYPES.get(media_type)
+        if encoding is None:
+            continue
+        try:
+            rate = int(params.get("rate", 0)) or None
+        except ValueError:
+            rate = None
+        return AudioFormat(encoding, rate)
+    return DEFAULT_FORMAT
+
+def audio_config_params(audio_format: Optional[AudioFormat] = None) -> dict:
+    """Everything in the AudioConfig that changes the bytes produced."""
+    return (audio_format or DEFAULT_FORMAT).params()
 
+def build_request(
+    text: str, language_code: str = "en-IN", voice_name: str = None, audio_format: Optional[AudioFormat] = None
+) -> dict:
+    """Keyword arguments for synthesize_speech (sync or async client)."""
+    from google.cloud import texttospeech
     synthesis_input = texttospeech.SynthesisInput(text=text)
 
     # choose voice
@@ -19,15 +119,310 @@ def synthesize_text(text: str, language_code: str = "en-IN", voice_name: str = N
     if voice_name:
         voice.name = voice_name
 
-    audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+    params = audio_config_params(audio_format)
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=getattr(texttospeech.AudioEncoding, params["audio_encoding"]),
+        sample_rate_hertz=params.get("sample_rate_hertz", 0),
+    )
+    return {"input": synthesis_input, "voice": voice, "audio_config": audio_config}
+
+# -------------------------
+# Audio cache
+# -------------------------
+class AudioCache:
+    """
+    Content-addressed cache for synthesized audio, keyed by a hash of
+    (text, language_code, voice_name, audio config). Two LRU tiers, each
+    with its own byte budget:
+      - memory: recently synthesized audio as bytes,
+      - disk: one file per key under `directory`, served through mmap so a
+        hit doesn't copy the audio into Python bytes.
+    New audio is written to both tiers. File I/O happens outside the lock,
+    so get(key, disk=False) (memory only) is safe on the event loop while a
+    worker thread reads or writes files.
+    Worker processes sharing the directory (see serve.py, shared=True) serve
+    each other's files, and the disk budget covers the whole directory:
+    every disk_bytes / SCAN_FRACTION bytes written, a process rescans it
+    and evicts the least recently used files, whoever wrote them.
+    """
+    # between scans, each sharing process can overshoot the budget by this fraction of it
+    SCAN_FRACTION = 32
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int, shared: bool = False):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.shared = shared
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_scans": 0}
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_used = 0
+        self._written_since_scan = 0
+        self._maps: "OrderedDict[str, memoryview]" = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+            self.scan_disk()
+
+    @staticmethod
+    def key(text: str, language_code: str, voice_name: Optional[str], audio_config: dict) -> str:
+        raw = json.dumps([text, language_code, voice_name or "", audio_config], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".audio")
+
+    def scan_disk(self):
+        """Rebuilds the disk index from the directory and evicts down to the budget."""
+        # Oldest access first, so eviction order survives restarts (and
+        # covers files other workers wrote)
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".audio"):
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_atime, name[: -len(".audio")], st.st_size))
+        entries.sort()
+        with self._lock:
+            self._disk = OrderedDict((key, size) for _, key, size in entries)
+            self._disk_used = sum(size for _, _, size in entries)
+            for key in [k for k in self._maps if k not in self._disk]:
+                del self._maps[key]
+            self._written_since_scan = 0
+            self.stats["disk_scans"] += 1
+            victims = self._evict_disk()
+        self._remove(victims)
+
+    def get(self, key: str, disk: bool = True) -> Optional[AudioBuffer]:
+        """
+        Cached audio, or None. disk=False looks only at memory and files
+        already mapped, without I/O, and leaves the miss to a later get().
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return audio
+            view = self._maps.get(key)
+            if view is not None and key in self._disk:
+                self._disk.move_to_end(key)
+                self.stats["disk_hits"] += 1
+                return view
+            if self.disk_bytes <= 0:
+                self.stats["misses"] += 1
+                return None
+            if not disk:
+                return None
+        # not in this process's index: maybe written by another worker;
+        # os.replace makes a file complete or absent
+        view = self._map(key)
+        victims = []
+        with self._lock:
+            if view is None:
+                self._drop_disk(key)
+                self.stats["misses"] += 1
+                return None
+            if key not in self._disk:
+                self._disk[key] = len(view)
+                self._disk_used += len(view)
+                victims = self._evict_disk()
+            self._disk.move_to_end(key)
+            self._maps[key] = view
+            while len(self._maps) > OPEN_MAPS:
+                # Just drop the reference: a response still streaming the view
+                # keeps the mapping alive until it is done
+                self._maps.popitem(last=False)
+            self.stats["disk_hits"] += 1
+        self._remove(victims)
+        return view
+
+    def _map(self, key: str) -> Optional[memoryview]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.shared:
+                # the access time orders the other workers' scans
+                os.utime(path)
+        except (OSError, ValueError):
+            # not there, removed behind our back, or empty
+            return None
+        return memoryview(mapped)
+
+    def put(self, key: str, audio: bytes):
+        """Stores audio in both tiers. Writes a file: call it from a worker thread in async code."""
+        if not audio:
+            return
+        with self._lock:
+            if len(audio) <= self.memory_bytes:
+                if key in self._memory:
+                    self._memory_used -= len(self._memory.pop(key))
+                self._memory[key] = audio
+                self._memory_used += len(audio)
+                while self._memory_used > self.memory_bytes:
+                    _, old = self._memory.popitem(last=False)
+                    self._memory_used -= len(old)
+            if not (self.disk_bytes > 0 and key not in self._disk and len(audio) <= self.disk_bytes):
+                return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("TTS cache write error:", e)
+            return
+        victims = []
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_used += len(audio)
+            self._written_since_scan += len(audio)
+            scan = self.shared and self._written_since_scan >= self.disk_bytes // self.SCAN_FRACTION
+            if not scan:
+                victims = self._evict_disk()
+        if scan:
+            self.scan_disk()
+        self._remove(victims)
+
+    def _drop_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_used -= size
+        self._maps.pop(key, None)
+
+    def _evict_disk(self) -> list:
+        """Drops the oldest entries over the budget (lock held); returns their keys to remove."""
+        victims = []
+        while self._disk_used > self.disk_bytes and self._disk:
+            key = next(iter(self._disk))
+            self._drop_disk(key)
+            victims.append(key)
+        return victims
+
+    def _remove(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def info(self) -> dict:
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_used,
+        }
+
+# Workers forked by serve.py share CACHE_DIR
+SHARED_DIR = int(os.environ.get("SERVE_WORKERS", "1")) > 1
+
+_cache = AudioCache(CACHE_DIR, CACHE_MEMORY_BYTES, CACHE_DISK_BYTES, SHARED_DIR) if CACHE_ENABLED else None
+
+_flights = singleflight.group("tts", SYNTHESIS_TIMEOUT)
+
+def cache_stats() -> dict:
+    return _cache.info() if _cache is not None else {}
+
+def _cache_key(text: str, language_code: str, voice_name: str = None, audio_format: Optional[AudioFormat] = None) -> str:
+    return AudioCache.key(text, language_code, voice_name, audio_config_params(audio_format))
+
+async def _cached_async(key: str) -> Optional[AudioBuffer]:
+    # memory hits inline; reading a file (stat, open, mmap) on a worker thread
+    cached = _cache.get(key, disk=False)
+    if cached is None and _cache.disk_bytes > 0:
+        cached = await run_blocking(_cache.get, key)
+    return cached
+
+# -------------------------
+# Synthesis
+# -------------------------
+def synthesize_audio(
+    text: str, language_code: str = "en-IN", voice_name: str = None, audio_format: Optional[AudioFormat] = None
+) -> AudioBuffer:
+    """
+    Returns audio for the given text (MP3 unless audio_format says
+    otherwise), from the cache when possible. Cache hits skip the TTS call;
+    disk hits come back as a memoryview.
+    """
+    if not text:
+        return b""
+    key = _cache_key(text, language_code, voice_name, audio_format) if _cache is not None else None
+    if key is not None:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
 
     try:
-        response = _tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
+        response = clients.get("tts").synthesize_speech(**build_request(text, language_code, voice_name, audio_format))
+    except Exception as e:
+        print("TTS error:", e)
+        return b""
+    if key is not None:
+        _cache.put(key, response.audio_content)
+    return response.audio_content
+
+def synthesize_text(
+    text: str, language_code: str = "en-IN", voice_name: str = None, audio_format: Optional[AudioFormat] = None
+) -> bytes:
+    """
+    Returns audio bytes (MP3 by default) for the given text.
+    """
+    audio = synthesize_audio(text, language_code, voice_name, audio_format)
+    return audio if isinstance(audio, bytes) else bytes(audio)
+
+async def synthesize_audio_async(
+    text: str, language_code: str = "en-IN", voice_name: str = None, optional: bool = True,
+    audio_format: Optional[AudioFormat] = None,
+) -> AudioBuffer:
+    """
+    Async variant of synthesize_audio using TextToSpeechAsyncClient. Audio
+    is optional by default: when TTS is saturated it returns b"" at once
+    (the reply goes out as text). With optional=False the call queues, and
+    admission.Rejected propagates.
+    """
+    if not text:
+        return b""
+    key = _cache_key(text, language_code, voice_name, audio_format)
+    if _cache is not None:
+        cached = await _cached_async(key)
+        if cached is not None:
+            return cached
+
+    async def synthesize():
+        async with admission.slot("tts", optional=optional):
+            response = await clients.get("tts_async").synthesize_speech(
+                **build_request(text, language_code, voice_name, audio_format)
+            )
+        metrics.observe_payload("tts_audio", len(response.audio_content))
+        if _cache is not None:
+            await run_blocking(_cache.put, key, response.audio_content)
         return response.audio_content
+
+    try:
+        # concurrent requests for the same audio share one call; optional
+        # is part of the key so a required caller is never shed by another's
+        return await _flights.do((key, optional), synthesize)
+    except admission.Rejected:
+        if not optional:
+            raise
+        return b""
     except Exception as e:
         print("TTS error:", e)
         return b""
+
+async def synthesize_text_async(
+    text: str, language_code: str = "en-IN", voice_name: str = None, audio_format: Optional[AudioFormat] = None
+) -> bytes:
+    """Async variant of synthesize_text."""
+    audio = await synthesize_audio_async(text, language_code, voice_name, audio_format=audio_format)
+    return audio if isinstance(audio, bytes) else bytes(audio)
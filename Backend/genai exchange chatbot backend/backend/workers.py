@@ -0,0 +1,42 @@
+# backend/workers.py
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# Blocking SDK calls (Translate v2, Vertex RAG retrieval) have no async client,
+# so they run here instead of on the event loop. Size it to the number of
+# upstream calls one worker should have in flight at once.
+MAX_THREADS = int(os.environ.get("BACKEND_MAX_THREADS", "32"))
+
+_executor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="backend")
+    return _executor
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking function on the backend thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    # in the caller's context, so timing spans land in the right request's trace
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+def _after_fork():
+    # the pool's threads stay behind in the parent
+    global _executor
+    _executor = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
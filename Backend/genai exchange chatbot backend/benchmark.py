@@ -0,0 +1,328 @@
+# benchmark.py
+# Benchmarks the backend in-process, with every Google service replaced by
+# the fakes in backend/fakes.py, so it measures our own overhead and catches
+# performance regressions without credentials, network or quota, e.g.:
+#   python benchmark.py --out before.json
+#   python benchmark.py --out after.json --compare before.json
+#   python benchmark.py --latency zero --concurrency 1 8 32   # CPU cost only
+# Requests go straight to the ASGI app (no sockets), at each concurrency
+# level in turn; the report has p50/p95/p99, throughput and process CPU per
+# request, plus microbenchmarks of analyze_risk and build_context.
+# loadtest.py is the counterpart for a deployed server.
+import os
+import io
+import sys
+import json
+import math
+import time
+import wave
+import asyncio
+import argparse
+import platform
+import subprocess
+import contextlib
+from urllib.parse import urlencode
+
+# Set before the backend is imported: no warm-up against real endpoints,
+# and no TTS disk cache left over from an earlier run
+os.environ.setdefault("CLIENT_WARMUP", "0")
+os.environ.setdefault("TTS_CACHE_DIR", f"/tmp/benchmark_tts_cache_{os.getpid()}")
+
+QUERIES = [
+    "I'm really stressed about my exams",
+    "I can't sleep at night",
+    "I feel lonely at college",
+    "How do I deal with pressure from my parents?",
+    "mujhe exams ki bahut tension ho rahi hai",
+    "I don't see the point of living anymore",
+]
+ENDPOINTS = ["/chat_text", "/chat_voice", "/tts"]
+# Fields where a higher value is worse, and where lower is
+COMPARE_HIGHER_WORSE = ["p50_ms", "p95_ms", "p99_ms", "cpu_ms_per_request"]
+COMPARE_LOWER_WORSE = ["throughput_rps"]
+
+def _disable_caches():
+    # every request should reach the (fake) upstreams, not a warm cache
+    os.environ.setdefault("TTS_CACHE_ENABLED", "0")
+    os.environ.setdefault("RAG_CACHE_ENABLED", "0")
+    os.environ.setdefault("TRANSLATION_CACHE_SIZE", "0")
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+# -------------------------
+# In-process ASGI driver
+# -------------------------
+async def asgi_post(app, path: str, body: bytes, content_type: str):
+    """POSTs to the ASGI app directly; returns (status, response body)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 0), "server": ("benchmark", 80),
+        "headers": [(b"host", b"benchmark"), (b"content-type", content_type.encode()),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    received = False
+    status = None
+    chunks = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # the client never disconnects; streaming responses stop waiting on their own
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+def form_body(fields: dict):
+    return urlencode(fields).encode(), "application/x-www-form-urlencoded"
+
+def multipart_body(fields: dict, filename: str, content: bytes):
+    boundary = "benchmarkboundary7d1e"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def speech_wav(seconds: float = 4.0, rate: int = 16000) -> bytes:
+    """A mono LINEAR16 recording (the fake Speech returns a canned transcript for it)."""
+    import numpy as np
+    t = np.arange(int(seconds * rate)) / rate
+    # a warbling tone with pauses, so segmenting has quiet spots to find
+    signal = np.sin(2 * np.pi * (180 + 40 * np.sin(2 * np.pi * 3 * t)) * t) * (np.sin(2 * np.pi * 0.5 * t) > -0.3)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes((signal * 8000).astype("<i2").tobytes())
+    return out.getvalue()
+
+def make_request(endpoint: str, i: int, recording: bytes):
+    query = QUERIES[i % len(QUERIES)]
+    if endpoint == "/chat_voice":
+        return multipart_body({"language_code": "en"}, "recording.wav", recording)
+    if endpoint == "/tts":
+        return form_body({"text": query})
+    return form_body({"query": query, "user_lang": "auto"})
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    # nearest rank
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+async def run_level(app, endpoint: str, concurrency: int, total: int, recording: bytes) -> dict:
+    latencies, statuses = [], {}
+    next_index = iter(range(total))
+
+    async def worker():
+        for i in next_index:
+            body, content_type = make_request(endpoint, i, recording)
+            start = time.perf_counter()
+            try:
+                status, _ = await asgi_post(app, endpoint, body, content_type)
+            except Exception:
+                status = "exception"
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    ok = statuses.get("200", 0)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "statuses": statuses,
+        "errors": total - ok,
+        "throughput_rps": round(ok / wall, 2),
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 0.95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+        "cpu_ms_per_request": round(1000 * cpu / total, 3),
+    }
+
+# -------------------------
+# Microbenchmarks
+# -------------------------
+def microbench(name: str, fn, inputs, min_seconds: float = 1.0) -> dict:
+    for x in inputs:
+        fn(x)  # warm caches and lazy initialisation
+    timings = []
+    deadline = time.perf_counter() + min_seconds
+    while time.perf_counter() < deadline:
+        for x in inputs:
+            start = time.perf_counter_ns()
+            fn(x)
+            timings.append(time.perf_counter_ns() - start)
+    return {
+        "name": name,
+        "iterations": len(timings),
+        "mean_us": round(sum(timings) / len(timings) / 1000, 2),
+        "p50_us": round(percentile(timings, 0.50) / 1000, 2),
+        "p99_us": round(percentile(timings, 0.99) / 1000, 2),
+    }
+
+def run_microbenchmarks(min_seconds: float) -> list:
+    from backend import rag, safety
+    from backend.fakes import FAKE_CORPUS
+    messages = QUERIES + [
+        "honestly I'm fine, just tired after a long week of classes and assignments",
+        "main marna chahta hoon",
+        "I keep thinking everyone would be better off without me and I can't stop crying",
+    ]
+    # retrieval results as they come back: overlapping chunks, best first
+    result_sets = [
+        [{"text": FAKE_CORPUS[(start + i) % len(FAKE_CORPUS)] * (1 + i % 3), "score": 0.9 - 0.05 * i}
+         for i in range(8)] + [{"text": FAKE_CORPUS[start], "score": 0.3}]
+        for start in range(len(FAKE_CORPUS))
+    ]
+    return [
+        microbench("analyze_risk", safety.analyze_risk, messages, min_seconds),
+        microbench("build_context", rag.build_context, result_sets, min_seconds),
+    ]
+
+# -------------------------
+# Report
+# -------------------------
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+def run_metadata() -> dict:
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Rows of (what, field, baseline, current, relative change, regressed)."""
+    rows = []
+    old_load = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("load", [])}
+    for r in report.get("load", []):
+        old = old_load.get((r["endpoint"], r["concurrency"]))
+        if old is None:
+            continue
+        for field in COMPARE_HIGHER_WORSE + COMPARE_LOWER_WORSE:
+            if not old.get(field):
+                continue
+            change = (r[field] - old[field]) / old[field]
+            worse = change > threshold if field in COMPARE_HIGHER_WORSE else change < -threshold
+            rows.append((f"{r['endpoint']} c={r['concurrency']}", field, old[field], r[field], change, worse))
+    old_micro = {m["name"]: m for m in baseline.get("micro", [])}
+    for m in report.get("micro", []):
+        old = old_micro.get(m["name"])
+        if old and old.get("mean_us"):
+            change = (m["mean_us"] - old["mean_us"]) / old["mean_us"]
+            rows.append((m["name"], "mean_us", old["mean_us"], m["mean_us"], change, change > threshold))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process benchmark of the chat backend against fake Google services")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=16,
+                        help="requests per level (at least 4x the concurrency)")
+    parser.add_argument("--latency", choices=["realistic", "zero"], default="realistic",
+                        help="fake upstream latencies; zero leaves only the backend's own cost")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplies every fake latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="failure rate of every fake call")
+    parser.add_argument("--caches", action="store_true", help="keep the backend's caches on")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--micro-seconds", type=float, default=1.0, help="time per microbenchmark (0 skips them)")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if anything regressed")
+    args = parser.parse_args()
+
+    if not args.caches:
+        _disable_caches()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    from backend import fakes
+    import app as backend_app
+    logging.disable(logging.WARNING)
+
+    profiles = fakes.REALISTIC if args.latency == "realistic" else fakes.ZERO
+    profiles = {name: p.scaled(args.latency_scale) for name, p in profiles.items()}
+    for p in profiles.values():
+        p.failure_rate = args.failure_rate
+    installed = fakes.install(profiles, seed=args.seed, transcripts=QUERIES)
+    recording = speech_wav()
+
+    async def run_load() -> list:
+        results = []
+        for endpoint in args.endpoints:
+            # one unmeasured request per endpoint for lazy imports and first-use setup
+            await asgi_post(backend_app.app, endpoint, *make_request(endpoint, 0, recording))
+            for level in args.concurrency:
+                result = await run_level(backend_app.app, endpoint, level, max(args.requests, 4 * level), recording)
+                print(f"{endpoint:>12} c={level:<3} {result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.1f}  "
+                      f"p95 {result['p95_ms']:>8.1f}  p99 {result['p99_ms']:>8.1f} ms  "
+                      f"cpu {result['cpu_ms_per_request']:>7.2f} ms/req  errors {result['errors']}", file=sys.stderr)
+                results.append(result)
+        return results
+
+    report = {
+        "meta": run_metadata(),
+        "config": {
+            "latency": args.latency, "latency_scale": args.latency_scale, "failure_rate": args.failure_rate,
+            "caches": args.caches, "seed": args.seed, "requests": args.requests,
+        },
+    }
+    # the backend prints upstream errors; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report["load"] = asyncio.run(run_load())
+        report["micro"] = run_microbenchmarks(args.micro_seconds) if args.micro_seconds > 0 else []
+    report.update({
+        "upstream_calls": {name: fake.calls for name, fake in installed.items() if hasattr(fake, "calls")},
+    })
+    for m in report["micro"]:
+        print(f"{m['name']:>16} mean {m['mean_us']:>8.1f} us  p50 {m['p50_us']:>8.1f}  p99 {m['p99_us']:>8.1f}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        print(f"\nvs {baseline.get('meta', {}).get('commit', '?')[:10]} (threshold {args.threshold:.0%}):", file=sys.stderr)
+        if baseline.get("config") != report["config"]:
+            print(f"  warning: different settings, {baseline.get('config')} vs {report['config']}", file=sys.stderr)
+        for what, field, old, new, change, worse in rows:
+            flag = "  REGRESSION" if worse else ""
+            print(f"{what:>22} {field:>20} {old:>10} -> {new:<10} {change:+7.1%}{flag}", file=sys.stderr)
+        if args.fail_on_regression and any(row[-1] for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmark_safety.py
+# Microbenchmark of the compiled phrase matcher in backend/safety.py against
+# the brute-force scan it replaced (kept here as the reference that
+# tests/test_safety_parity.py checks it against), e.g.:
+#   python benchmark_safety.py
+#   python benchmark_safety.py --messages 500 --reference-seconds 30
+# Both are run on the same generated messages: phrases from the lists with
+# typos, embedded in filler words. The report has per-message cost for each
+# and the count of messages where they disagree (should be 0).
+import sys
+import random
+import argparse
+from typing import List, Tuple
+
+from benchmark import microbench
+
+FILLER = [
+    "i", "really", "think", "that", "today", "my", "exams", "college", "friends", "home",
+    "so", "and", "but", "feel", "it", "was", "is", "at", "work", "the", "night", "always",
+]
+
+def brute_force_match(text: str, phrase_list: List[str]) -> Tuple[List[Tuple[str, float]], float]:
+    """The original best_phrase_match: SequenceMatcher over every word window for every phrase."""
+    from backend.safety import normalize_text, similarity
+    t = normalize_text(text)
+    matches = []
+    best = 0.0
+    for phrase in phrase_list:
+        p = normalize_text(phrase)
+        r_whole = similarity(t, p)
+        t_words = t.split()
+        best_window = 0.0
+        phrase_len = max(1, len(p.split()))
+        max_window = min(len(t_words), phrase_len + 3)
+        for w in range(1, max_window + 1):
+            for i in range(len(t_words) - w + 1):
+                window = " ".join(t_words[i : i + w])
+                r = similarity(window, p)
+                if r > best_window:
+                    best_window = r
+        r = max(r_whole, best_window)
+        if r > best:
+            best = r
+        if r >= 0.5:
+            matches.append((phrase, r))
+    matches.sort(key=lambda x: x[1], reverse=True)
+    return matches, best
+
+def brute_force_risk(text: str) -> Tuple[str, str]:
+    """The original analyze_risk decision over the English lists."""
+    from backend import safety
+    t = safety.normalize_text(text)
+    for category, risk, threshold in safety.RISK_LEVELS:
+        phrases = {"suicidal": safety.SUICIDAL_PHRASES, "depression": safety.DEPRESSION_PHRASES,
+                   "anxiety": safety.ANXIETY_PHRASES}[category]
+        if brute_force_match(t, phrases)[1] >= threshold:
+            return risk, category
+    return "none", "general"
+
+def matcher_risk(text: str) -> Tuple[str, str]:
+    """The same decision from the compiled matchers (the Indic lists left out, as in the original)."""
+    from backend import safety
+    t = safety.normalize_text(text)
+    for category, risk, threshold in safety.RISK_LEVELS:
+        if safety.CATEGORY_MATCHERS[category].reaches(t, threshold):
+            return risk, category
+    return "none", "general"
+
+def _typo(phrase: str, rng: random.Random) -> str:
+    chars = list(phrase)
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.3:
+            del chars[i]
+        elif op < 0.6:
+            chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz ")
+        elif op < 0.8:
+            chars.insert(i, rng.choice("abcdefghijklmnopqrstuvwxyz"))
+        elif i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        if not chars:
+            chars = list(phrase)
+    return "".join(chars)
+
+def sample_messages(count: int, seed: int = 0, max_words: int = 12) -> List[str]:
+    """Messages of 1..max_words words; most carry a (possibly misspelled) listed phrase."""
+    from backend import safety
+    rng = random.Random(seed)
+    phrases = safety.SUICIDAL_PHRASES + safety.DEPRESSION_PHRASES + safety.ANXIETY_PHRASES
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(0, max_words - 4))]
+        if rng.random() < 0.8:
+            phrase = rng.choice(phrases)
+            words.insert(rng.randint(0, len(words)), _typo(phrase, rng) if rng.random() < 0.7 else phrase)
+        text = " ".join(words) or rng.choice(FILLER)
+        if rng.random() < 0.3:
+            text = text.capitalize() + rng.choice([".", "!!", "?", " :(", "..."])
+        messages.append(text)
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser(description="Phrase matcher vs the brute-force scan it replaced")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--seconds", type=float, default=2.0, help="time for the matcher's benchmark")
+    parser.add_argument("--reference-seconds", type=float, default=10.0, help="time for the brute-force benchmark")
+    args = parser.parse_args()
+
+    import logging
+    from backend import safety
+    logging.disable(logging.WARNING)
+    messages = sample_messages(args.messages, args.seed)
+    mismatches = sum(matcher_risk(m) != brute_force_risk(m) for m in messages)
+    rows = [
+        microbench("brute_force_risk", brute_force_risk, messages, args.reference_seconds),
+        microbench("analyze_risk", safety.analyze_risk, messages, args.seconds),
+    ]
+    for m in rows:
+        print(f"{m['name']:>18} mean {m['mean_us']:>10.1f} us  p50 {m['p50_us']:>10.1f}  p99 {m['p99_us']:>10.1f}")
+    print(f"speedup {rows[0]['mean_us'] / rows[1]['mean_us']:.0f}x, "
+          f"decisions differing on {mismatches} of {len(messages)} messages")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
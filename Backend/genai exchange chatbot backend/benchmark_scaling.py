@@ -0,0 +1,249 @@
+# benchmark_scaling.py
+# Throughput against the number of serve.py workers, with every Google
+# service replaced by the fakes in backend/fakes.py, e.g.:
+#   python benchmark_scaling.py --workers 1 2 4 8 --out scaling.json
+#   python benchmark_scaling.py --workers 1 2 --latency realistic --connections 64
+# For each worker count it starts serve.py on the first N cores, drives it
+# from load-generator processes on the remaining cores (asyncio, keep-alive
+# HTTP/1.1) for a fixed time, and reports req/s, latency, scaling efficiency
+# (req/s over N times the one-worker req/s) and per-worker memory: PSS
+# counts pages shared with the master and the other workers fractionally,
+# USS only pages the worker has to itself. With fewer cores than workers
+# plus one for the load, the numbers say nothing about scaling; it warns.
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import multiprocessing
+
+from benchmark import QUERIES, form_body, percentile, run_metadata
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ["/chat_text", "/tts"]
+
+def install_fakes():
+    """serve.py --worker-init hook: fakes in this worker, latency from BENCHMARK_LATENCY."""
+    from backend import fakes
+    profiles = fakes.REALISTIC if os.environ.get("BENCHMARK_LATENCY") == "realistic" else fakes.ZERO
+    fakes.install(profiles, seed=int(os.environ.get("SERVE_WORKER_INDEX", "0")), transcripts=QUERIES)
+
+# -------------------------
+# Load generator
+# -------------------------
+def _request(endpoint: str, i: int) -> bytes:
+    fields = {"text": QUERIES[i % len(QUERIES)]} if endpoint == "/tts" else \
+        {"query": QUERIES[i % len(QUERIES)], "user_lang": "en"}
+    body, content_type = form_body(fields)
+    head = (f"POST {endpoint} HTTP/1.1\r\nHost: benchmark\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode() + body
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get("content-length", "0")))
+    return status
+
+async def _drive(port: int, endpoint: str, connections: int, warmup: float, duration: float, offset: int):
+    latencies, errors = [], 0
+    start = time.perf_counter() + warmup
+    stop = start + duration
+
+    async def connection(n: int):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        i = offset + n
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop:
+                break
+            writer.write(_request(endpoint, i))
+            status = await _read_response(reader)
+            done = time.perf_counter()
+            i += connections
+            if sent < start:
+                continue
+            if status == 200:
+                latencies.append(done - sent)
+            else:
+                errors += 1
+        writer.close()
+
+    await asyncio.gather(*(connection(n) for n in range(connections)))
+    return latencies, errors
+
+def _load_process(args):
+    port, endpoint, connections, warmup, duration, offset, cores = args
+    if cores:
+        os.sched_setaffinity(0, cores)
+    return asyncio.run(_drive(port, endpoint, connections, warmup, duration, offset))
+
+# -------------------------
+# Server
+# -------------------------
+def _get(port: int, path: str, timeout: float = 2.0):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=timeout) as resp:
+        return resp.status, resp.read()
+
+def _wait_ready(port: int, workers: int, timeout: float = 60.0):
+    # ready once /ready has answered 200 from every worker
+    seen = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and len(seen) < workers:
+        try:
+            status, _ = _get(port, "/ready")
+            if status == 200:
+                seen.add(json.loads(_get(port, "/stats")[1])["worker"])
+                continue
+        except OSError:
+            pass
+        time.sleep(0.1)
+    if len(seen) < workers:
+        raise RuntimeError(f"serve.py didn't come up with {workers} workers on port {port}")
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+def memory(pid: int) -> dict:
+    """RSS, PSS and USS of a process in MiB, from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {}
+    mib = lambda kb: round(kb / 1024, 1)
+    return {
+        "rss_mib": mib(fields.get("Rss", 0)),
+        "pss_mib": mib(fields.get("Pss", 0)),
+        "uss_mib": mib(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)),
+    }
+
+def run_workers(workers: int, args, cores: list) -> dict:
+    shared = tempfile.mkdtemp(prefix="benchmark_scaling_")
+    env = dict(
+        os.environ,
+        CLIENT_WARMUP="0",
+        BENCHMARK_LATENCY=args.latency,
+        SHARED_CACHE_PATH=os.path.join(shared, "cache.sqlite"),
+        SESSION_STORE_PATH=os.path.join(shared, "sessions.jsonl"),
+        TTS_CACHE_DIR=os.path.join(shared, "tts"),
+    )
+    if not args.caches:
+        # every request should reach the (fake) upstreams, not a warm cache
+        env.update(TTS_CACHE_ENABLED="0", RAG_CACHE_ENABLED="0", TRANSLATION_CACHE_SIZE="0", RESPONSE_CACHE_ENABLED="0")
+    server_cores = cores[:workers] if len(cores) > workers else None
+    client_cores = cores[workers:] if server_cores else None
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(workers), "--log-level", "warning", "--worker-init", "benchmark_scaling:install_fakes"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        preexec_fn=(lambda: os.sched_setaffinity(0, server_cores)) if server_cores else None,
+    )
+    try:
+        _wait_ready(args.port, workers)
+        clients = args.clients or (len(client_cores) if client_cores else 1)
+        per_client = max(1, args.connections * workers // clients)
+        jobs = [(args.port, args.endpoint, per_client, args.warmup, args.duration, c * per_client, client_cores)
+                for c in range(clients)]
+        with multiprocessing.get_context("spawn").Pool(clients) as pool:
+            results = pool.map(_load_process, jobs)
+        latencies = [l for ls, _ in results for l in ls]
+        errors = sum(e for _, e in results)
+        worker_memory = [memory(pid) for pid in _children(server.pid)]
+        master_memory = memory(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(shared, ignore_errors=True)
+    mean = lambda key: round(sum(m.get(key, 0) for m in worker_memory) / len(worker_memory), 1) if worker_memory else None
+    return {
+        "workers": workers,
+        "connections": per_client * clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / args.duration, 2),
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 2),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+        "master_memory": master_memory,
+        "worker_rss_mib": mean("rss_mib"),
+        "worker_pss_mib": mean("pss_mib"),
+        "worker_uss_mib": mean("uss_mib"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of serve.py against its worker count, with fake Google services")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="worker counts to run (default: 1, 2, 4, ... up to the cores available less one)")
+    parser.add_argument("--endpoint", default="/chat_text", choices=ENDPOINTS)
+    parser.add_argument("--connections", type=int, default=16, help="keep-alive connections per worker")
+    parser.add_argument("--clients", type=int, default=0, help="load-generator processes (default: one per spare core)")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per worker count")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before that")
+    parser.add_argument("--latency", choices=["zero", "realistic"], default="zero",
+                        help="fake upstream latencies; zero makes throughput CPU-bound, which is what scales with cores")
+    parser.add_argument("--caches", action="store_true", help="keep the backend's caches on")
+    parser.add_argument("--port", type=int, default=7890)
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    cores = sorted(os.sched_getaffinity(0))
+    counts = args.workers or [n for n in (1, 2, 4, 8, 16, 32, 64) if n < len(cores)] or [1]
+    if max(counts) + 1 > len(cores):
+        print(f"warning: {len(cores)} cores for up to {max(counts)} workers plus the load generator; "
+              f"workers share cores, so this shows no scaling", file=sys.stderr)
+
+    rows = []
+    for workers in counts:
+        row = run_workers(workers, args, cores)
+        base = rows[0] if rows else row
+        row["efficiency"] = round(row["throughput_rps"] / (base["throughput_rps"] * workers / base["workers"]), 3) \
+            if base["throughput_rps"] else None
+        rows.append(row)
+        print(f"workers {workers:>3} {row['throughput_rps']:>9.1f} req/s  efficiency {row['efficiency']:>6.1%}  "
+              f"p50 {row['p50_ms']:>7.1f}  p99 {row['p99_ms']:>7.1f} ms  errors {row['errors']}  "
+              f"worker PSS {row['worker_pss_mib']} MiB  USS {row['worker_uss_mib']} MiB", file=sys.stderr)
+
+    report = {
+        "meta": {**run_metadata(), "cores_available": len(cores)},
+        "config": {
+            "endpoint": args.endpoint, "latency": args.latency, "caches": args.caches,
+            "connections_per_worker": args.connections, "duration": args.duration,
+        },
+        "scaling": rows,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
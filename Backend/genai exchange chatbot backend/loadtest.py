@@ -0,0 +1,89 @@
+# loadtest.py
+# Fires concurrent requests at a running backend and reports throughput and
+# latency per concurrency level, e.g.:
+#   python loadtest.py --url http://localhost:7860 --concurrency 1 4 16 32
+# --accept compares audio encodings and reply containers by bytes per request:
+#   python loadtest.py --endpoint /tts --accept "audio/ogg; codecs=opus"
+#   python loadtest.py --endpoint /chat_voice --audio question.wav --accept "application/x-chat-frames"
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+QUERIES = [
+    "I'm really stressed about my exams",
+    "I can't sleep at night",
+    "I feel lonely at college",
+    "How do I deal with pressure from my parents?",
+]
+
+def _one_request(session: requests.Session, url: str, endpoint: str, i: int, accept=None, audio=None):
+    data = {"query": QUERIES[i % len(QUERIES)], "user_lang": "en"}
+    files = None
+    if endpoint == "/tts":
+        data = {"text": QUERIES[i % len(QUERIES)]}
+    elif endpoint == "/chat_voice":
+        data = {"language_code": "en"}
+        files = {"file": ("question.wav", audio)}
+    headers = {"Accept": accept} if accept else {}
+    start = time.perf_counter()
+    resp = session.post(url + endpoint, data=data, files=files, headers=headers, timeout=120)
+    resp.raise_for_status()
+    # response bytes as sent: body plus header values (the legacy voice reply carries its text in one)
+    size = len(resp.content) + sum(len(k) + len(v) for k, v in resp.headers.items())
+    return time.perf_counter() - start, size
+
+def run_level(url: str, endpoint: str, concurrency: int, total: int, accept=None, audio=None) -> dict:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    errors = 0
+    latencies = []
+    sizes = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(_one_request, session, url, endpoint, i, accept, audio) for i in range(total)]
+        for f in futures:
+            try:
+                latency, size = f.result()
+                latencies.append(latency)
+                sizes.append(size)
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else float("nan")
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": 1000 * statistics.median(latencies) if latencies else float("nan"),
+        "p99_ms": 1000 * pick(0.99),
+        "bytes_per_request": statistics.mean(sizes) if sizes else float("nan"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency load test for the chat backend")
+    parser.add_argument("--url", default="http://localhost:7860")
+    parser.add_argument("--endpoint", default="/chat_text", choices=["/chat_text", "/tts", "/chat_voice"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--accept", help="Accept header to send (audio encoding / reply container)")
+    parser.add_argument("--audio", help="recorded question to upload, for /chat_voice")
+    args = parser.parse_args()
+    if args.endpoint == "/chat_voice" and not args.audio:
+        parser.error("/chat_voice needs --audio")
+    audio = open(args.audio, "rb").read() if args.audio else None
+
+    print(f"{'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'bytes/req':>10} {'errors':>6}")
+    for level in args.concurrency:
+        r = run_level(args.url.rstrip("/"), args.endpoint, level, max(args.requests, level), args.accept, audio)
+        print(f"{r['concurrency']:>5} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.0f} {r['p99_ms']:>8.0f} "
+              f"{r['bytes_per_request']:>10.0f} {r['errors']:>6}")
+
+if __name__ == "__main__":
+    main()
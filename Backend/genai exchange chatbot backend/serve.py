@@ -0,0 +1,170 @@
+# serve.py
+"""
+Pre-fork server for using every core of a node:
+
+    python serve.py --host 0.0.0.0 --port 7860 --workers 4
+
+The master imports the app and builds the read-only state once (safety
+phrase automata and helpline tables, language-ID models, the local
+retrieval index, the prompt text, compiled regular expressions), freezes
+it out of the garbage collector's reach, and forks the workers, which
+share it copy-on-write and accept connections on one listening socket.
+Nothing in the master opens a network connection: each worker builds and
+warms up its own Google clients, so its gRPC channels are its own
+(backend/clients.py resets the registry in a forked child).
+
+Across the workers of one node:
+  - detections, translations and retrieval results are shared through a
+    SQLite file (SHARED_CACHE_PATH), TTS audio through the disk tier
+    (TTS_CACHE_DIR); both default to a directory in /dev/shm,
+  - sessions follow one append-only log (SESSION_STORE_PATH, same place
+    by default),
+  - admission limits (ADMISSION_*_CONCURRENCY) and /stats, /metrics are
+    per worker; the pid in /stats says which one answered.
+
+A worker that dies is replaced. SIGTERM or SIGINT stops the workers
+gracefully and then the master.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import tempfile
+from typing import Callable, Dict, Optional
+
+# A worker that dies sooner than this after starting is restarted only after a pause
+MIN_WORKER_LIFETIME = 5.0
+RESTART_DELAY = 1.0
+
+def shared_directory(port: int) -> str:
+    """Per-port directory for the state the workers share; in memory when /dev/shm exists."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    path = os.path.join(base, f"chatbot-{port}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def configure(workers: int, port: int):
+    """Environment the backend modules read at import, set before the app is imported."""
+    os.environ["SERVE_WORKERS"] = str(workers)
+    if workers > 1:
+        shared = shared_directory(port)
+        os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(shared, "cache.sqlite"))
+        os.environ.setdefault("SESSION_STORE_PATH", os.path.join(shared, "sessions.jsonl"))
+        os.environ.setdefault("TTS_CACHE_DIR", os.path.join(shared, "tts"))
+
+def _import(spec: str):
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+def preload(app_spec: str):
+    """Imports the app and builds everything read-only that workers would otherwise build each."""
+    app = _import(app_spec)
+    from backend import context, langid, local_index, rag, safety
+    local_index.get_index()
+    # first calls compile the patterns used inline and fill lookup tables;
+    # untimed entry points, so no request metrics start out in the workers
+    safety.classify_risk(safety.normalize_text("I can't sleep and I feel hopeless"))
+    langid.detect("mujhe neend nahi aati")
+    rag.normalize_query("I can't sleep!")
+    context.assemble_context([{"text": "Sleep matters.", "score": 1.0}])
+    gc.collect()
+    # keep the collector from touching (and so copying) the shared pages
+    gc.freeze()
+    return app
+
+def listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def _run_worker(app, sock: socket.socket, index: int, log_level: str, worker_init: Optional[Callable]):
+    import uvicorn
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+    os.environ["SERVE_WORKER_INDEX"] = str(index)
+    if worker_init is not None:
+        worker_init()
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def serve(app_spec: str = "app:app", host: str = "0.0.0.0", port: int = 7860, workers: int = 1,
+          log_level: str = "info", worker_init: Optional[str] = None):
+    """
+    Runs the master until SIGTERM/SIGINT. worker_init ("module:function")
+    is called in every worker after the fork, before the server starts
+    (benchmark_scaling.py installs the fake clients with it).
+    """
+    configure(workers, port)
+    app = preload(app_spec)
+    init = _import(worker_init) if worker_init else None
+    sock = listen(host, port)
+    children: Dict[int, tuple] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, index, log_level, init)
+            except BaseException:
+                logging.exception(f"[serve] worker {index} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+    logging.info(f"[serve] {workers} workers on {host}:{port}, master {os.getpid()}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, 0.0))
+        if stopping or index is None:
+            continue
+        logging.warning(f"[serve] worker {index} (pid {pid}) exited with status {status}; restarting")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(RESTART_DELAY)
+        spawn(index)
+    sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork server for the chat backend")
+    parser.add_argument("--app", default="app:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "7860")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1,
+                        help="worker processes (default: WEB_CONCURRENCY, else one per core)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--worker-init", help="module:function to call in each worker after the fork")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    serve(args.app, args.host, args.port, max(1, args.workers), args.log_level, args.worker_init)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Run from anywhere: the backend package and the top-level scripts import from here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Set before the backend is imported: no warm-up against real endpoints, no
+# TTS files left in /tmp, and requests through the app reach the (fake)
+# upstreams rather than a cache warmed by an earlier test
+os.environ.setdefault("CLIENT_WARMUP", "0")
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="tests_tts_cache_"))
+os.environ.setdefault("TTS_CACHE_ENABLED", "0")
+os.environ.setdefault("RAG_CACHE_ENABLED", "0")
+os.environ.setdefault("TRANSLATION_CACHE_SIZE", "0")
+
+@pytest.fixture
+def fake_clients():
+    """Every Google client replaced by a zero-latency fake (backend/fakes.py), by registry name."""
+    import app  # noqa: F401  (registers the clients)
+    from backend import clients, fakes
+    yield fakes.install(fakes.ZERO)
+    clients.reset()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from backend import admission
+from benchmark import asgi_post, form_body, multipart_body, speech_wav
+
+def _fill_queue(monkeypatch, name: str):
+    upstream = admission.get_upstream(name)
+    monkeypatch.setattr(upstream, "queued", upstream.queue_limit)
+
+def test_only_the_requests_upstreams_are_checked(monkeypatch):
+    _fill_queue(monkeypatch, "tts")
+    admission.begin_request(admission.NORMAL, upstreams=("translate", "rag", "gemini"))
+    with pytest.raises(admission.Overloaded) as e:
+        admission.begin_request(admission.NORMAL, upstreams=("translate", "tts"))
+    assert e.value.upstream == "tts"
+    with pytest.raises(admission.Overloaded):
+        admission.begin_request(admission.NORMAL)
+    admission.begin_request(admission.CRITICAL, upstreams=("tts",))
+
+def test_reclassify_sets_the_priority_and_checks_again(monkeypatch):
+    _fill_queue(monkeypatch, "gemini")
+    ctx = admission.begin_request(admission.CRITICAL)
+    admission.reclassify(admission.CRITICAL, ("gemini",))
+    assert ctx.priority == admission.CRITICAL
+    with pytest.raises(admission.Overloaded):
+        admission.reclassify(admission.NORMAL, ("gemini",))
+    assert ctx.priority == admission.NORMAL
+
+def test_escalating_moves_queued_calls_up(monkeypatch):
+    upstream = admission.get_upstream("gemini")
+    monkeypatch.setattr(upstream, "concurrency", 1)
+    admitted = []
+
+    async def call(name, escalate_after=None):
+        admission.begin_request(admission.NORMAL, upstreams=())
+        if escalate_after is not None:
+            asyncio.get_running_loop().call_later(escalate_after, admission.escalate)
+        async with admission.slot("gemini"):
+            admitted.append(name)
+            await asyncio.sleep(0.02)
+
+    async def main():
+        calls = [asyncio.create_task(call("holder"))]
+        await asyncio.sleep(0)
+        calls.append(asyncio.create_task(call("first in line")))
+        await asyncio.sleep(0)
+        # queued behind the others, then found to be high risk
+        calls.append(asyncio.create_task(call("escalated", escalate_after=0.005)))
+        await asyncio.gather(*calls)
+
+    asyncio.run(main())
+    assert admitted == ["holder", "escalated", "first in line"]
+    assert upstream.queued == 0 and upstream.in_flight == 0
+
+def _post_voice(app, transcript: str):
+    from backend import fakes
+    installed = fakes.install(fakes.ZERO, transcripts=[transcript])
+    body, content_type = multipart_body({"language_code": "en"}, "question.wav", speech_wav(1.0))
+    status, _ = asyncio.run(asgi_post(app.app, "/chat_voice", body, content_type))
+    return status, installed["speech_async"].calls
+
+def test_text_requests_ignore_a_full_tts_queue(fake_clients, monkeypatch):
+    import app
+    _fill_queue(monkeypatch, "tts")
+    status, _ = asyncio.run(asgi_post(app.app, "/chat_text", *form_body({"query": "I can't sleep", "user_lang": "en"})))
+    assert status == 200
+
+def test_voice_is_refused_only_after_transcription(fake_clients, monkeypatch):
+    import app
+    _fill_queue(monkeypatch, "tts")
+    status, calls = _post_voice(app, "I can't sleep before my exams")
+    assert status == 429
+    assert sum(calls.values()) >= 1
+
+def test_crisis_voice_is_not_refused(fake_clients, monkeypatch):
+    import app
+    _fill_queue(monkeypatch, "tts")
+    status, _ = _post_voice(app, "I want to kill myself")
+    assert status == 200
+
+def test_live_streams_leave_the_upload_stt_pool_alone(fake_clients, monkeypatch):
+    from backend import stt
+    monkeypatch.setattr(admission.get_upstream("stt"), "concurrency", 1)
+
+    async def main():
+        admission.begin_request(admission.CRITICAL, budget=None, upstreams=())
+        release = asyncio.Event()
+
+        async def chunks():
+            yield b"hello"
+            await release.wait()
+
+        async def listen():
+            return [event async for event in stt.stream_speech_to_text(chunks(), "en-IN", 16000, "LINEAR16")]
+
+        live = [asyncio.create_task(listen()) for _ in range(2)]
+        await asyncio.sleep(0.2)
+        in_flight = admission.get_upstream("stt").in_flight, admission.get_upstream("stt_stream").in_flight
+        upload = await asyncio.wait_for(stt.speech_to_text_bytes_async(speech_wav(1.0), "en-IN"), 5)
+        release.set()
+        return in_flight, upload, await asyncio.gather(*live)
+
+    in_flight, upload, live = asyncio.run(main())
+    assert in_flight == (0, 2)
+    assert upload and all(events[-1][0] == "final" for events in live)
@@ -0,0 +1,99 @@
+# Blocking SDK calls must run off the event loop: while requests wait on a
+# slow (blocking) upstream, the loop keeps serving everything else.
+import sys
+import time
+import asyncio
+import subprocess
+import threading
+import contextvars
+
+from backend import fakes, workers
+from benchmark import asgi_post, form_body
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+def test_run_blocking_runs_on_the_pool_in_the_callers_context():
+    def where():
+        return threading.current_thread().name, request_id.get()
+
+    async def main():
+        request_id.set("r1")
+        return await workers.run_blocking(where)
+
+    thread, value = asyncio.run(main())
+    assert thread.startswith("backend") and value == "r1"
+
+def test_blocking_upstreams_dont_stall_the_loop(fake_clients):
+    import app
+    # Translate and Vertex RAG have no async client: their fakes time.sleep()
+    profiles = dict(fakes.ZERO, translate=fakes.CallProfile(0.2), rag=fakes.CallProfile(0.2))
+    fakes.install(profiles)
+    requests = 8
+
+    async def main():
+        gaps, stop = [], asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.ensure_future(ticker())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            asgi_post(app.app, "/chat_text", *form_body({"query": f"mujhe neend nahi aati {i}", "user_lang": "hi"}))
+            for i in range(requests)
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick
+        return results, elapsed, max(gaps)
+
+    results, elapsed, worst_gap = asyncio.run(main())
+    assert [status for status, _ in results] == [200] * requests
+    # run on the loop, 8 requests x (translate + retrieval) would take >= 3.2 s
+    assert elapsed < 1.5
+    assert worst_gap < 0.1
+
+def test_clients_are_built_off_the_loop(fake_clients, monkeypatch):
+    from backend import clients, rag
+    fake = fake_clients["gemini"]
+    built_on = []
+
+    def slow_factory():
+        built_on.append(threading.current_thread())
+        time.sleep(0.2)
+        return fake
+
+    monkeypatch.setattr(clients._entries["gemini"], "factory", slow_factory)
+    clients.reset("gemini")
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        reply = await rag.generate_response_with_llm_async("I can't sleep", "")
+        task.cancel()
+        return reply, ticks
+
+    reply, ticks = asyncio.run(main())
+    assert reply != rag.FALLBACK_RESPONSE
+    assert built_on and built_on[0] is not threading.main_thread()
+    # the loop kept running while the client was built
+    assert ticks >= 10
+
+def test_importing_the_app_leaves_the_google_sdks_unloaded():
+    # they are imported by the client factories, off the loop (or at warm-up)
+    sdks = ("google.cloud.speech", "google.cloud.texttospeech", "google.cloud.translate_v2", "vertexai")
+    code = f"import sys, app; print([m for m in {sdks!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
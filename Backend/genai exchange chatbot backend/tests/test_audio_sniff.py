@@ -0,0 +1,60 @@
+# sniff() reads whatever a client uploads: anything it can't use must come
+# back as UnsupportedAudio (a 400, or an error event), never another exception.
+import random
+import struct
+
+import pytest
+
+from backend import audio
+from benchmark import speech_wav
+
+def _element(element_id: bytes, payload: bytes) -> bytes:
+    return element_id + bytes([0x80 | len(payload)]) + payload
+
+OPUS_HEAD = b"OpusHead" + bytes([1, 1]) + struct.pack("<HI", 312, 48000) + b"\0\0\0"
+WEBM = (
+    _element(b"\x1a\x45\xdf\xa3", _element(b"\x42\x82", b"webm"))
+    + b"\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff"  # Segment of unknown size
+    + _element(b"\x16\x54\xae\x6b", _element(b"\xae", _element(b"\x86", b"A_OPUS") + _element(b"\x63\xa2", OPUS_HEAD)
+                                              + _element(b"\xe1", _element(b"\xb5", struct.pack(">f", 48000.0))
+                                                         + _element(b"\x9f", b"\x01"))))
+)
+OGG = b"OggS" + bytes(22) + bytes([1, len(OPUS_HEAD)]) + OPUS_HEAD
+FLAC = b"fLaC" + bytes(14) + ((16000 << 44) | (15 << 36) | 16000).to_bytes(8, "big")
+MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x02\0\0" + bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(8)
+WAV = speech_wav(0.1)[:128]
+
+HEADERS = {"webm": WEBM, "ogg": OGG, "flac": FLAC, "mp3": MP3, "wav": WAV}
+
+@pytest.mark.parametrize("container", HEADERS)
+def test_valid_headers(container):
+    info = audio.sniff(HEADERS[container])
+    assert info.container == container and info.sample_rate and info.channels
+
+def test_truncated_ebml_header():
+    with pytest.raises(audio.UnsupportedAudio):
+        audio.sniff(b"\x1a\x45\xdf\xa3")
+
+def _sniff_or_unsupported(head: bytes):
+    try:
+        audio.sniff(head)
+    except audio.UnsupportedAudio:
+        pass
+
+@pytest.mark.parametrize("container", HEADERS)
+def test_every_truncation(container):
+    head = HEADERS[container]
+    for n in range(len(head)):
+        _sniff_or_unsupported(head[:n])
+
+@pytest.mark.parametrize("container", HEADERS)
+def test_corrupted_and_garbage_headers(container):
+    head = HEADERS[container]
+    rng = random.Random(container)
+    for _ in range(300):
+        corrupted = bytearray(head)
+        for _ in range(rng.randint(1, 4)):
+            corrupted[rng.randrange(len(corrupted))] = rng.randrange(256)
+        _sniff_or_unsupported(bytes(corrupted))
+        # the magic bytes followed by noise
+        _sniff_or_unsupported(head[:4] + bytes(rng.randrange(256) for _ in range(rng.randint(0, 40))))
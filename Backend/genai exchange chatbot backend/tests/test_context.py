@@ -0,0 +1,52 @@
+from backend import context
+
+SLEEP = ("Keeping a regular sleep schedule helps the body settle. Go to bed and wake up at the same "
+         "time every day, even on weekends, and avoid screens for an hour before sleeping.")
+EXAMS = ("Exam stress is common among students. Breaking revision into short sessions with breaks "
+         "in between makes it easier to focus and to remember what you studied.")
+BREATHING = ("Slow breathing calms the nervous system. Breathe in for four counts, hold for four, "
+             "and breathe out for six; repeat it a few times when you feel anxious.")
+
+def _results(*texts):
+    return [{"text": t, "score": 1.0 - 0.1 * i} for i, t in enumerate(texts)]
+
+def test_near_duplicates_keep_the_better_ranked_copy():
+    reworded = SLEEP.replace("even on weekends", "including weekends") + " "
+    assert context.dedup([EXAMS, SLEEP, reworded, BREATHING]) == [0, 1, 3]
+    assert context.dedup([SLEEP, SLEEP.upper()]) == [0]
+
+def test_distinct_chunks_are_all_kept_in_ranking_order():
+    text, stats = context.assemble_context(_results(BREATHING, SLEEP, EXAMS), max_tokens=10_000)
+    assert text.split(context.SEPARATOR) == [BREATHING, SLEEP, EXAMS]
+    assert stats == {"chunks": 3, "kept": 3, "duplicates": 0, "truncated": 0,
+                     "tokens": context.estimate_tokens(text)}
+
+def test_empty_and_duplicate_chunks_are_dropped():
+    text, stats = context.assemble_context(_results(SLEEP, "  ", EXAMS, SLEEP))
+    assert text.split(context.SEPARATOR) == [SLEEP, EXAMS]
+    assert stats["chunks"] == 3 and stats["duplicates"] == 1
+
+def test_budget_is_never_exceeded():
+    chunks = [f"Tip {i}: " + EXAMS + " " + SLEEP + f" ({i})" for i in range(20)]
+    for budget in (60, 100, 250, 500, 1000):
+        text, stats = context.assemble_context(_results(*chunks), max_tokens=budget)
+        assert stats["tokens"] <= budget
+
+def test_last_chunk_is_cut_at_a_sentence_end():
+    budget = context.estimate_tokens(SLEEP) + context.estimate_tokens(context.SEPARATOR) + 45
+    long_chunk = " ".join([EXAMS, BREATHING, SLEEP.replace("sleep", "rest")])
+    text, stats = context.assemble_context(_results(SLEEP, long_chunk), max_tokens=budget)
+    first, cut = text.split(context.SEPARATOR)
+    assert first == SLEEP and stats["truncated"] == 1
+    assert long_chunk.startswith(cut) and cut.endswith(".")
+
+def test_a_fragment_too_small_to_help_is_left_out():
+    budget = context.estimate_tokens(SLEEP) + context.MIN_FRAGMENT_TOKENS - 1
+    text, stats = context.assemble_context(_results(SLEEP, EXAMS), max_tokens=budget)
+    assert text == SLEEP
+    assert stats["kept"] == 1 and stats["truncated"] == 0
+
+def test_truncate_without_a_sentence_end_cuts_at_a_word():
+    text = "word " * 100
+    cut = context.truncate_to_tokens(text, 10)
+    assert len(cut) <= 40 and cut.endswith("word")
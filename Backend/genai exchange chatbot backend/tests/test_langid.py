@@ -0,0 +1,35 @@
+# Held-out messages (none of them in the training samples) and what
+# detect() should say; "lang": null means too little to go on, so the
+# caller asks the Translation API.
+import os
+import json
+
+import pytest
+
+from backend import langid
+
+with open(os.path.join(os.path.dirname(__file__), "fixtures", "langid.jsonl"), encoding="utf-8") as f:
+    FIXTURES = [json.loads(line) for line in f if line.strip()]
+
+@pytest.mark.parametrize("case", FIXTURES, ids=[c["text"][:24] for c in FIXTURES])
+def test_detect(case):
+    assert langid.detect(case["text"]) == case["lang"]
+
+def test_confidence_is_a_probability():
+    for case in FIXTURES:
+        lang, confidence = langid.identify(case["text"])
+        assert 0.0 <= confidence <= 1.0
+        if lang is None:
+            assert confidence == 0.0
+
+def test_empty_text():
+    assert langid.identify("") == (None, 0.0)
+
+def test_extra_samples_are_split_by_script(tmp_path):
+    path = tmp_path / "samples.json"
+    path.write_text(json.dumps({"gu": ["mane bahu chinta thay chhe"], "hi": ["मुझे डर लगता है"]}, ensure_ascii=False),
+                    encoding="utf-8")
+    latin, devanagari = langid._load_samples(str(path))
+    assert latin["gu"] == ["mane bahu chinta thay chhe"]
+    assert devanagari["hi"][-1] == "मुझे डर लगता है"
+    assert "gu" not in devanagari and latin["hi"] == langid.SAMPLES["hi"]
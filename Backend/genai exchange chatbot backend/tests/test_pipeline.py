@@ -0,0 +1,105 @@
+# The stage scheduler: every stage starts once the stages it depends on
+# have finished, so a run costs its critical path rather than the sum of
+# its stages.
+import time
+import asyncio
+
+import pytest
+
+from backend import fakes, pipeline
+from backend.pipeline import Stage
+
+def _after(seconds, value=None, error=None):
+    async def fn(run):
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return value
+    return fn
+
+def _run(stages):
+    started = time.perf_counter()
+    run = asyncio.run(pipeline.run_stages(stages))
+    return run, time.perf_counter() - started
+
+def test_independent_stages_overlap():
+    async def total(run):
+        return run.results["a"] + run.results["b"]
+
+    run, elapsed = _run([
+        Stage("a", _after(0.1, 1)),
+        Stage("b", _after(0.1, 2)),
+        Stage("total", total, deps=["a", "b"]),
+    ])
+    assert run.results["total"] == 3
+    assert elapsed < 0.18
+
+def test_a_timeout_starts_when_the_deps_are_done():
+    run, _ = _run([
+        Stage("slow", _after(0.1, "x")),
+        Stage("next", _after(0.05, "y"), deps=["slow"], timeout=0.08),
+    ])
+    assert run.results["next"] == "y"
+
+def test_optional_stages_degrade_to_their_default():
+    run, _ = _run([
+        Stage("failing", _after(0, error=RuntimeError("upstream down")), default=[]),
+        Stage("late", _after(0.2, "late"), timeout=0.05, default=None),
+    ])
+    assert run.results == {"failing": [], "late": None}
+
+def test_a_failed_required_stage_cancels_the_rest():
+    started = time.perf_counter()
+    with pytest.raises(pipeline.StageFailed) as e:
+        asyncio.run(pipeline.run_stages([
+            Stage("broken", _after(0.01, error=ValueError("bad"))),
+            Stage("long", _after(5)),
+        ]))
+    assert e.value.stage == "broken" and isinstance(e.value.error, ValueError)
+    assert time.perf_counter() - started < 1
+
+def test_a_stage_cancelled_on_purpose_does_not_fail_the_run():
+    async def decide(run):
+        run.cancel("speculative")
+        return "decided"
+
+    run, elapsed = _run([Stage("speculative", _after(5), default=[]), Stage("decide", decide)])
+    assert run.results == {"decide": "decided"}
+    assert elapsed < 1
+
+# The chat-turn stage graph: dependencies are declared, so each stage's
+# timeout covers only its own work.
+def _stages(**kwargs):
+    return {s.name: s for s in pipeline.chat_turn_stages("mujhe neend nahi aati", **kwargs)}
+
+def test_retrieval_declares_its_input():
+    stages = _stages(user_lang="hi")
+    assert stages["retrieval"].deps == ("english",)
+    assert stages["english"].deps == ("lang",)
+    assert "speculative_retrieval" not in stages
+
+def test_retrieval_timeout_excludes_translation(fake_clients, monkeypatch):
+    # translation alone takes longer than the retrieval timeout
+    fakes.install(dict(fakes.ZERO, translate=fakes.CallProfile(0.3), rag=fakes.CallProfile(0.05)))
+    monkeypatch.setattr(pipeline, "RETRIEVAL_TIMEOUT", 0.2)
+    run = asyncio.run(pipeline.run_stages(pipeline.chat_turn_stages("mujhe neend nahi aati", "hi", generation=False)))
+    assert run.results["retrieval"], "retrieval timed out while waiting for translation"
+    assert run.timings["retrieval"] < 0.2
+
+def test_speculation_is_dropped_once_the_language_is_known(fake_clients):
+    installed = fakes.install(dict(fakes.ZERO, detect=fakes.CallProfile(0.05), rag=fakes.CallProfile(0.3)))
+    run = asyncio.run(pipeline.run_stages(pipeline.chat_turn_stages("मुझे नींद नहीं आती", "auto", generation=False)))
+    assert run.results["lang"] == "hi"
+    assert run.results["retrieval"]
+    # the speculative call on the raw query was cancelled, not awaited: one
+    # retrieval's worth of time after detection, and no result
+    assert run.timings["speculative_retrieval"] < 0.3
+    assert "speculative_retrieval" not in run.results
+    assert installed["vertex_rag"].calls["rag"] >= 1
+
+def test_english_speculation_is_the_retrieval(fake_clients):
+    installed = fakes.install(dict(fakes.ZERO, detect=fakes.CallProfile(0.05), rag=fakes.CallProfile(0.1)))
+    run = asyncio.run(pipeline.run_stages(pipeline.chat_turn_stages("I can't sleep at night", "auto", generation=False)))
+    assert run.results["lang"] == "en"
+    assert run.results["retrieval"] and run.results["retrieval"] is run.results["speculative_retrieval"]
+    assert installed["vertex_rag"].calls["rag"] == 1
@@ -0,0 +1,19 @@
+# Similar-query hits in the retrieval cache: rephrasings share an entry,
+# queries whose content words are in another order do not.
+from backend.rag import RetrievalCache
+
+RESULTS = [{"text": "Sleep hygiene tips", "source": "sleep.pdf"}]
+
+def test_rephrasings_share_an_entry():
+    cache = RetrievalCache()
+    cache.put("I can't sleep!", 5, RESULTS)
+    assert cache.get("cant sleep", 5) == RESULTS
+    assert cache.get("I'm really so feeling can't sleep", 5) == RESULTS
+    assert cache.get("cant sleep", 3) is None
+    assert cache.stats_counts["similar_hits"] == 2
+
+def test_word_order_counts():
+    cache = RetrievalCache()
+    cache.put("sad and not happy", 5, RESULTS)
+    assert cache.get("happy and not sad", 5) is None
+    assert cache.get("I am sad and not happy", 5) == RESULTS
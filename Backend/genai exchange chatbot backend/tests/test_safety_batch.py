@@ -0,0 +1,83 @@
+# analyze_risk_batch and analyze_risk_stream must give analyze_risk's result
+# for every message, in input order, on every path (single process, process
+# pool, JSONL and CSV files).
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from backend import safety
+from benchmark_safety import sample_messages
+
+MESSAGES = sample_messages(150, seed=3) + [
+    "", None, "ok", "ok", "hi", "I want to die", "i want to die", "मैं मरना चाहता हूँ",
+    "mujhe bahut ghabrahat ho rahi hai", "line\x00with a nul", "sad\n\nand lonely",
+]
+
+def _single(texts):
+    return [safety.analyze_risk(t or "") for t in texts]
+
+def test_batch_equals_single():
+    assert safety.analyze_risk_batch(MESSAGES) == _single(MESSAGES)
+
+def test_normalize_batch_equals_normalize_text():
+    assert safety.normalize_batch(MESSAGES) == [safety.normalize_text(t or "") for t in MESSAGES]
+
+def test_process_pool_equals_single(monkeypatch):
+    monkeypatch.setattr(safety, "PARALLEL_MIN_TEXTS", 10)
+    expected = _single(MESSAGES)
+    assert safety.analyze_risk_batch(MESSAGES, processes=2) == expected
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert safety.analyze_risk_batch(MESSAGES, processes=3, executor=pool) == expected
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_stream_jsonl(tmp_path, monkeypatch, processes):
+    monkeypatch.setattr(safety, "PARALLEL_MIN_TEXTS", 10)
+    source = tmp_path / "messages.jsonl"
+    with open(source, "w", encoding="utf-8") as f:
+        for i, text in enumerate(MESSAGES):
+            record = {"id": i, "text": text} if i % 5 else {"text": text}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n\n")
+    out = tmp_path / "scored.jsonl"
+    assert safety.analyze_risk_stream(str(source), str(out), batch_size=40, processes=processes) == len(MESSAGES)
+    results = [json.loads(line) for line in open(out, encoding="utf-8")]
+    for i, (result, expected) in enumerate(zip(results, _single(MESSAGES))):
+        if i % 5:
+            assert result.pop("id") == i
+        assert "id" not in result
+        assert result == expected
+    assert len(results) == len(MESSAGES)
+
+def test_stream_jsonl_with_bad_records(tmp_path, caplog):
+    source = tmp_path / "mixed.jsonl"
+    lines = [
+        {"id": 1, "text": "I want to die"}, [], "x", 3, None, {"id": 2, "text": 3},
+        {"id": 3, "text": ["so", "alone"]}, {"id": 4}, {"id": 5, "text": "ok"},
+    ]
+    with open(source, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+        f.write('{"id": 6, "text": \n')
+    out = tmp_path / "scored.jsonl"
+    with caplog.at_level("WARNING"):
+        assert safety.analyze_risk_stream(str(source), str(out), batch_size=2) == 5
+    results = [json.loads(line) for line in open(out, encoding="utf-8")]
+    assert [r.pop("id") for r in results] == [1, 2, 3, 4, 5]
+    assert results == _single(["I want to die", "3", '["so", "alone"]', "", "ok"])
+    assert "skipped 1 invalid JSON lines and 4 non-object records; scored 2 non-string texts" in caplog.text
+
+def test_stream_csv(tmp_path):
+    source = tmp_path / "messages.CSV"
+    with open(source, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["message_id", "body"])
+        writer.writeheader()
+        for i, text in enumerate(MESSAGES):
+            writer.writerow({"message_id": f"m{i}", "body": (text or "").replace("\x00", " ")})
+    out = tmp_path / "scored.jsonl"
+    count = safety.analyze_risk_stream(str(source), str(out), text_field="body", id_field="message_id", batch_size=33)
+    assert count == len(MESSAGES)
+    expected = _single([(t or "").replace("\x00", " ") for t in MESSAGES])
+    for i, line in enumerate(open(out, encoding="utf-8")):
+        result = json.loads(line)
+        assert result.pop("message_id") == f"m{i}"
+        assert result == expected[i]
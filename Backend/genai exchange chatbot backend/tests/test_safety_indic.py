@@ -0,0 +1,58 @@
+# The Indic lists match runs of the user's own words, the last one as a
+# stem; English text must not hit them through a romanized word that is
+# also English.
+import pytest
+
+from backend import safety
+
+def _indic_hits(text: str) -> dict:
+    words = safety.normalize_text(text).split()
+    return {c: m.exact_hits(words) for c, m in safety.INDIC_MATCHERS.items() if m.exact_hits(words)}
+
+@pytest.mark.parametrize("text", [
+    "there is tension at work",
+    "Tension between my parents is getting worse",
+    "the muscle tension goes away after a walk",
+])
+def test_english_text_misses_the_indic_lists(text):
+    assert _indic_hits(text) == {}
+
+@pytest.mark.parametrize("text", [
+    "mujhe bahut tension ho rahi hai",
+    "exam ki tension hai yaar",
+    "टेंशन हो रही है",
+    "naaku bhayam ga undi",
+])
+def test_romanized_and_native_anxiety(text):
+    assert set(_indic_hits(text)) == {"anxiety"}
+    assert safety.analyze_risk(text)["category"] == "anxiety"
+
+@pytest.mark.parametrize("text", [
+    "मैं खुद को मारना चाहता हूँ",
+    "मैं अपनी जान लेना चाहता हूं",
+    "main khud ko maarna chahta hoon",
+    "main apni jaan lena chahta hoon",
+    "ज़िंदगी खत्म करना चाहती हूँ",
+    "zindagi khatam karna hai mujhe",
+])
+def test_inflected_self_harm_statements_are_high_risk(text):
+    assert "suicidal" in _indic_hits(text)
+    assert safety.analyze_risk(text)["risk"] == "high"
+
+def test_a_stem_needs_the_words_before_it():
+    assert _indic_hits("jaan lena mushkil hai") == {}
+    assert _indic_hits("mujhe kuch karna chahta hoon") == {}
+
+@pytest.mark.parametrize("za", ["\u095b", "\u091c\u093c"])
+def test_precomposed_and_decomposed_letters_match_alike(za):
+    # ज़ typed as one code point (U+095B) or as ज + nukta
+    assert safety.analyze_risk(f"मैं {za}िंदगी खत्म कर दूँगा")["risk"] == "high"
+
+def test_single_romanized_words_are_not_english():
+    # analyze_risk's English lists are fuzzy-matched; their words are English
+    english = {w for p in safety.SUICIDAL_PHRASES + safety.DEPRESSION_PHRASES + safety.ANXIETY_PHRASES
+               for w in safety.normalize_text(p).split()}
+    singles = {p for by_lang in safety.INDIC_PHRASES.values() for phrases in by_lang.values()
+               for p in phrases if p.isascii() and " " not in p}
+    # matched as prefixes: no English word may start with one
+    assert singles and not any(w.startswith(single) for w in english for single in singles)
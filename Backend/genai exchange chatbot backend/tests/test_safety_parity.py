@@ -0,0 +1,37 @@
+# The compiled PhraseMatcher must give exactly the scores and decisions of
+# the brute-force scan it replaced (benchmark_safety.brute_force_match).
+import pytest
+
+from backend import safety
+from benchmark_safety import brute_force_match, brute_force_risk, matcher_risk, sample_messages
+
+EDGE_CASES = [
+    "", "   ", "!!!", "sad", "i want to die", "I WANT TO DIE!!!", "i wnat to dei",
+    "can’t focus", "can't focus at all", "i cant go on like this", "tired", "tension headaches",
+    "everything is fine today, thanks", "i i i i i i i i i i i i", "kill  myself", "self-harm",
+    "feeling hopeless about future and i feel trapped forever",
+]
+MESSAGES = EDGE_CASES + sample_messages(96, seed=7)
+LISTS = {
+    "suicidal": safety.SUICIDAL_PHRASES,
+    "depression": safety.DEPRESSION_PHRASES,
+    "anxiety": safety.ANXIETY_PHRASES,
+}
+
+@pytest.mark.parametrize("category", LISTS)
+def test_best_phrase_match_equals_brute_force(category):
+    phrases = LISTS[category]
+    for text in MESSAGES:
+        matches, best = safety.best_phrase_match(text, phrases)
+        expected_matches, expected_best = brute_force_match(text, phrases)
+        assert best == pytest.approx(expected_best, abs=1e-12), text
+        assert sorted(matches) == pytest.approx(sorted(expected_matches)), text
+
+def test_uncompiled_phrase_list_equals_brute_force():
+    phrases = ["panic attack", "cannot breathe", "alone"]
+    for text in MESSAGES[:30]:
+        assert safety.best_phrase_match(text, phrases) == pytest.approx(brute_force_match(text, phrases)), text
+
+def test_risk_decisions_equal_brute_force():
+    for text in MESSAGES:
+        assert matcher_risk(text) == brute_force_risk(text), text
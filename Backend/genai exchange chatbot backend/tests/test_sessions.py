@@ -0,0 +1,52 @@
+import asyncio
+
+from backend import context, fakes, sessions
+from backend.sessions import SESSION_TURNS, SUMMARY_BATCH, SessionStore
+
+def _conversation(store: SessionStore, session_id: str, turns: int, start: int = 0):
+    async def main():
+        for i in range(start, start + turns):
+            store.record_turn(session_id, f"message {i} about my exams", f"reply {i}")
+            # let a background summary run, as requests would between turns
+            for _ in range(3):
+                await asyncio.sleep(0)
+    asyncio.run(main())
+
+def test_turns_out_of_the_buffer_are_summarized(fake_clients):
+    store = SessionStore()
+    _conversation(store, "s1", SESSION_TURNS + SUMMARY_BATCH)
+    session = store.get("s1")
+    assert [t.seq for t in session.turns] == list(range(SUMMARY_BATCH, SESSION_TURNS + SUMMARY_BATCH))
+    assert session.pending == [] and session.summarized == SUMMARY_BATCH - 1
+    assert session.summary.startswith(fakes.FAKE_REPLY[0].strip())
+    assert store.stats()["summaries"] == 1 and fake_clients["gemini_summary"].calls["gemini"] == 1
+    history = store.history("s1")
+    assert history.startswith("Summary: ")
+    assert "message 0 about" not in history and f"message {SESSION_TURNS + SUMMARY_BATCH - 1} about" in history
+
+def test_summaries_fall_back_without_gemini(fake_clients):
+    fakes.install(dict(fakes.ZERO, gemini=fakes.CallProfile(failure_rate=1.0)))
+    store = SessionStore()
+    _conversation(store, "s2", SESSION_TURNS + sessions.PENDING_LIMIT + 1)
+    session = store.get("s2")
+    assert store.stats()["summaries"] == 0 and store.stats()["summary_fallbacks"] >= 1
+    assert session.summary.startswith("The user said: message 0 about")
+    assert len(session.pending) <= sessions.PENDING_LIMIT
+
+def test_history_stays_within_its_budget(fake_clients):
+    store = SessionStore()
+    _conversation(store, "s3", 60)
+    for budget in (20, 100, 300, sessions.HISTORY_TOKENS):
+        assert context.estimate_tokens(store.get("s3").history(budget)) <= budget
+    assert store.get("s3").summary
+
+def test_sessions_survive_a_restart(fake_clients, tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    store = SessionStore(path=path)
+    _conversation(store, "s4", SESSION_TURNS + SUMMARY_BATCH)
+    _conversation(store, "gone", 1)
+    store.end("gone")
+    restarted = SessionStore(path=path)
+    assert restarted.history("s4") == store.history("s4")
+    assert restarted.get("s4").summarized == store.get("s4").summarized
+    assert restarted.history("gone") == ""
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from backend import admission, singleflight
+
+def _upstream(calls, result="done", delay=0.05):
+    async def call():
+        calls.append(result)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call
+
+def test_concurrent_calls_with_one_key_share_a_flight():
+    calls = []
+
+    async def main():
+        flights = singleflight.Group("test")
+        results = await asyncio.gather(
+            *(flights.do("k", _upstream(calls)) for _ in range(5)),
+            flights.do("other", _upstream(calls, "other")),
+        )
+        return results, flights.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == ["done"] * 5 + ["other"]
+    assert calls == ["done", "other"]
+    assert stats["upstream_calls"] == 2 and stats["coalesced"] == 4 and stats["in_flight"] == 0
+
+def test_every_caller_gets_the_flights_error():
+    async def main():
+        flights = singleflight.Group("test")
+        results = await asyncio.gather(
+            *(flights.do("k", _upstream([], ValueError("upstream down"))) for _ in range(3)),
+            return_exceptions=True,
+        )
+        return results, flights.stats()
+
+    results, stats = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert stats["upstream_calls"] == 1 and stats["errors"] == 1
+
+def test_a_caller_giving_up_leaves_the_flight_to_the_others():
+    calls = []
+
+    async def main():
+        flights = singleflight.Group("test")
+        impatient = asyncio.ensure_future(flights.do("k", _upstream(calls), timeout=0.01))
+        patient = asyncio.ensure_future(flights.do("k", _upstream(calls)))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        return await patient, flights.stats()
+
+    result, stats = asyncio.run(main())
+    assert result == "done" and calls == ["done"] and stats["timeouts"] == 1
+
+def test_the_flight_is_cancelled_once_every_caller_leaves():
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flights = singleflight.Group("test")
+        callers = [asyncio.ensure_future(flights.do("k", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flights.in_flight()
+
+    assert asyncio.run(main()) == 0
+    assert cancelled == [True]
+
+def test_finished_flights_are_not_reused():
+    calls = []
+
+    async def main():
+        flights = singleflight.Group("test")
+        await flights.do("k", _upstream(calls, delay=0))
+        await flights.do("k", _upstream(calls, delay=0))
+
+    asyncio.run(main())
+    assert calls == ["done", "done"]
+
+# The flight runs in its own admission context, which serves every caller
+async def _request(priority, budget, coro_fn):
+    # as an endpoint would: each request task begins its own admission context
+    ctx = admission.begin_request(priority, budget=budget, upstreams=())
+    return ctx, await coro_fn()
+
+def test_a_joining_caller_raises_the_flights_priority():
+    seen = []
+
+    async def call():
+        await asyncio.sleep(0.05)
+        seen.append(admission.current().priority)
+        return "done"
+
+    async def main():
+        flights = singleflight.Group("test")
+        first = asyncio.create_task(_request(admission.NORMAL, 10, lambda: flights.do("k", call)))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(_request(admission.CRITICAL, None, lambda: flights.do("k", call)))
+        return await first, await second, flights.stats()
+
+    (first_ctx, a), (second_ctx, b), stats = asyncio.run(main())
+    assert a == b == "done" and stats["upstream_calls"] == 1 and stats["coalesced"] == 1
+    assert seen == [admission.CRITICAL]
+    # the callers' own contexts are left alone
+    assert first_ctx.priority == admission.NORMAL and first_ctx.deadline is not None
+    assert second_ctx.priority == admission.CRITICAL
+
+def test_the_flight_keeps_the_latest_deadline():
+    deadlines = []
+
+    async def call():
+        await asyncio.sleep(0.05)
+        deadlines.append(admission.remaining())
+
+    async def main():
+        flights = singleflight.Group("test")
+        first = asyncio.create_task(_request(admission.NORMAL, 1, lambda: flights.do("k", call)))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(_request(admission.NORMAL, 30, lambda: flights.do("k", call)))
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+    assert deadlines[0] > 20
+
+def test_every_caller_sees_the_flights_degraded_upstreams():
+    async def call():
+        await asyncio.sleep(0.05)
+        admission.current().degrade(["tts"])
+
+    async def main():
+        flights = singleflight.Group("test")
+        first = asyncio.create_task(_request(admission.NORMAL, 10, lambda: flights.do("k", call)))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(_request(admission.NORMAL, 10, lambda: flights.do("k", call)))
+        return await first, await second
+
+    (first_ctx, _), (second_ctx, _) = asyncio.run(main())
+    assert first_ctx.degraded == second_ctx.degraded == ["tts"]
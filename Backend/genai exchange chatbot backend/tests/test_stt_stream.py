@@ -0,0 +1,41 @@
+# Streaming recognition against FakeSpeechServer, which speaks the real
+# Speech gRPC protocol and "recognizes" UTF-8 text.
+import asyncio
+
+import pytest
+
+from backend import clients, stt
+from backend.fakes import FakeSpeechServer
+
+@pytest.fixture
+def speech_server(monkeypatch):
+    server = FakeSpeechServer().start()
+    monkeypatch.setattr(stt, "EMULATOR_HOST", server.address)
+    clients.reset("speech_async")
+    yield server
+    server.stop()
+    clients.reset("speech_async")
+
+def _listen(chunks, **kwargs):
+    async def audio():
+        for chunk in chunks:
+            yield chunk
+
+    async def main():
+        return [event async for event in stt.stream_speech_to_text(audio(), "en-IN", 16000, "LINEAR16", **kwargs)]
+
+    return asyncio.run(main())
+
+def test_interim_text_then_one_final_transcript(speech_server):
+    events = _listen([b"I feel ", b"low today"])
+    assert events == [("interim", "I feel"), ("interim", "I feel low today"), ("final", "I feel low today")]
+    assert speech_server.calls["streaming_recognize"] == 1
+
+def test_large_chunks_are_split_into_small_requests(speech_server):
+    events = _listen([b"a" * (2 * stt.STREAM_CHUNK_BYTES + 10)])
+    # one interim result per audio request
+    assert [kind for kind, _ in events] == ["interim"] * 3 + ["final"]
+    assert events[-1] == ("final", "a" * (2 * stt.STREAM_CHUNK_BYTES + 10))
+
+def test_silence_gives_an_empty_final_transcript(speech_server):
+    assert _listen([]) == [("final", "")]
@@ -0,0 +1,91 @@
+# Translation cache hits are answered without an admission slot, a worker
+# thread or an API call.
+import asyncio
+
+import pytest
+
+from backend import admission, translation
+
+class CountingClient:
+    def __init__(self):
+        self.calls = []
+
+    def detect_language(self, text):
+        self.calls.append(("detect", text))
+        return {"language": "hi"}
+
+    def translate(self, text, target_language, source_language=None):
+        self.calls.append(("translate", text))
+        if isinstance(text, list):
+            return [{"translatedText": f"[{target_language}]{t}", "detectedSourceLanguage": source_language or "hi"} for t in text]
+        return {"translatedText": f"[{target_language}]{text}"}
+
+@pytest.fixture
+def service(monkeypatch):
+    service = translation.TranslationService(CountingClient(), max_entries=100, local_langid=False)
+    monkeypatch.setattr(translation, "_service", service)
+    hops = []
+    real = translation.run_blocking
+
+    async def counting_run_blocking(fn, *args):
+        hops.append(fn)
+        return await real(fn, *args)
+
+    monkeypatch.setattr(translation, "run_blocking", counting_run_blocking)
+    return service, hops
+
+def _admitted():
+    return admission.get_upstream("translate").stats()["admitted"]
+
+def test_hits_skip_the_slot_and_the_thread(service):
+    service, hops = service
+
+    async def main():
+        first = await translation.translate_to_async("mera  naam", "en", "hi")
+        admitted, calls = _admitted(), len(hops)
+        again = [
+            await translation.translate_to_async("mera naam", "en", "hi"),
+            await translation.translate_from_async("mera naam", "hi", "en"),
+            # the translation's language was remembered: no detect call for it
+            await translation.translate_to_async("[en]mera naam", "en"),
+            await translation.translate_to_async("hello", "en", "en"),
+        ]
+        return first, again, admitted, calls
+
+    first, again, admitted, calls = asyncio.run(main())
+    assert first == "[en]mera  naam"
+    assert again == ["[en]mera  naam", "[en]mera  naam", "[en]mera naam", "hello"]
+    assert _admitted() == admitted and len(hops) == calls == 1
+    assert service.client.calls == [("translate", "mera  naam")]
+
+def test_detection_hits_skip_the_slot(service):
+    service, hops = service
+
+    async def main():
+        assert await translation.detect_language_async("kya haal hai") == "hi"
+        admitted = _admitted()
+        assert await translation.detect_language_async("kya  haal hai") == "hi"
+        # no source given: the cached detection picks the cached translation
+        await translation.translate_to_async("kya haal hai", "en")
+        admitted_after_miss = _admitted()
+        assert await translation.translate_to_async("kya haal hai", "en") == "[en]kya haal hai"
+        return admitted, admitted_after_miss
+
+    admitted, admitted_after_miss = asyncio.run(main())
+    assert admitted_after_miss == admitted + 1
+    assert _admitted() == admitted_after_miss
+    assert service.client.calls == [("detect", "kya haal hai"), ("translate", "kya haal hai")]
+    assert service.stats()["detect_cache"]["misses"] == 1
+
+def test_batch_hits_skip_the_slot(service):
+    service, hops = service
+
+    async def main():
+        first = await translation.translate_batch_async(["a b", "c"], "en", "hi")
+        calls = len(hops)
+        second = await translation.translate_batch_async(["a b", "c"], "en", "hi")
+        return first, second, calls
+
+    first, second, calls = asyncio.run(main())
+    assert first == second == ["[en]a b", "[en]c"]
+    assert len(hops) == calls == 1
@@ -0,0 +1,50 @@
+import os
+import asyncio
+import threading
+
+from backend import tts
+from backend.tts import AudioCache
+
+def _files(directory: str) -> list:
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith(".audio")]
+
+def test_memory_only_get_does_no_io(tmp_path):
+    cache = AudioCache(str(tmp_path), memory_bytes=0, disk_bytes=1 << 20)
+    cache.put("a" * 64, b"x" * 100)
+    assert cache.get("a" * 64, disk=False) is None
+    assert cache.info()["misses"] == 0
+    assert bytes(cache.get("a" * 64)) == b"x" * 100
+    # mapped now: answered without touching the file
+    assert bytes(cache.get("a" * 64, disk=False)) == b"x" * 100
+
+def test_async_lookup_and_store_run_off_the_loop(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path), memory_bytes=0, disk_bytes=1 << 20)
+    monkeypatch.setattr(tts, "_cache", cache)
+    threads = []
+    mapped, put = AudioCache._map, AudioCache.put
+    monkeypatch.setattr(AudioCache, "_map", lambda self, key: threads.append(threading.current_thread()) or mapped(self, key))
+    monkeypatch.setattr(AudioCache, "put", lambda self, key, audio: threads.append(threading.current_thread()) or put(self, key, audio))
+
+    async def run():
+        await tts.run_blocking(cache.put, "b" * 64, b"y" * 10)
+        return await tts._cached_async("b" * 64)
+
+    assert bytes(asyncio.run(run())) == b"y" * 10
+    assert threads and all(t is not threading.main_thread() for t in threads)
+
+def test_shared_directory_budget_is_global(tmp_path):
+    budget = 64 * 1024
+    workers = [AudioCache(str(tmp_path), memory_bytes=0, disk_bytes=budget, shared=True) for _ in range(2)]
+    for i in range(32):
+        workers[i % 2].put(f"{i:064x}", b"z" * 4096)
+    for cache in workers:
+        cache.scan_disk()
+    assert len(_files(str(tmp_path))) * 4096 <= budget
+    assert workers[0].info()["disk_bytes"] <= budget
+
+def test_shared_directory_serves_other_workers_files(tmp_path):
+    first = AudioCache(str(tmp_path), memory_bytes=0, disk_bytes=1 << 20, shared=True)
+    second = AudioCache(str(tmp_path), memory_bytes=0, disk_bytes=1 << 20, shared=True)
+    first.put("c" * 64, b"w" * 50)
+    assert bytes(second.get("c" * 64)) == b"w" * 50
+    assert second.info()["disk_hits"] == 1
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+SETTINGS = json.dumps({"encoding": "LINEAR16", "sample_rate_hertz": 16000})
+
+def _events(ws) -> list:
+    events = []
+    while True:
+        message = ws.receive()
+        if message["type"] == "websocket.close":
+            return events
+        if message.get("text"):
+            events.append(json.loads(message["text"])["event"])
+
+@pytest.fixture
+def client(fake_clients):
+    import app
+    with TestClient(app.app) as c:
+        yield c
+
+@pytest.mark.parametrize("settings", ["{not json", "[1, 2]", '"auto"'])
+def test_malformed_settings_get_an_error_event(client, settings):
+    with client.websocket_connect("/ws/chat_voice") as ws:
+        ws.send_text(settings)
+        assert _events(ws) == ["error"]
+
+@pytest.mark.parametrize("control", ["{not json", "null"])
+def test_malformed_control_message_gets_an_error_event(client, control):
+    with client.websocket_connect("/ws/chat_voice") as ws:
+        ws.send_text(SETTINGS)
+        ws.send_bytes(b"\0" * 3200)
+        ws.send_text(control)
+        assert _events(ws)[-1] == "error"
+
+def test_end_event_still_finishes_the_turn(client):
+    with client.websocket_connect("/ws/chat_voice") as ws:
+        ws.send_text(SETTINGS)
+        ws.send_bytes(b"\0" * 3200)
+        ws.send_text('{"event": "end"}')
+        events = _events(ws)
+        assert events[0] == "transcript" and events[-1] == "done"